@@ -126,8 +126,6 @@ elif args.item == 'table':
 
     ALTER TABLE [dbo].[UserData]
         ADD CONSTRAINT UX_UserData_uuid_method_ts UNIQUE(uuid, method, timestamp)
-    ALTER TABLE [dbo].[UserData]
-        ADD CONSTRAINT FK_UserData_uuid FOREIGN KEY (uuid) REFERENCES [Authorization] (uuid) ON DELETE CASCADE
 
     CREATE TABLE [dbo].[GranularData](
         [id] [BIGINT] IDENTITY(1,1) NOT NULL PRIMARY KEY,
@@ -139,18 +137,22 @@ elif args.item == 'table':
     ) ON [PRIMARY]
 
     ALTER TABLE [dbo].[GranularData]
-        ADD CONSTRAINT FK_GranularData_uuid FOREIGN KEY (uuid) REFERENCES [Authorization] (uuid) ON DELETE CASCADE
+        ADD CONSTRAINT UK_GranularData UNIQUE NONCLUSTERED (uuid, method, item_id)
 
     CREATE TABLE [dbo].[StreamCache](
         [id] [BIGINT] IDENTITY(1,1) NOT NULL PRIMARY KEY,
-        [uuid] [nchar](36) NOT NULL FOREIGN KEY REFERENCES [Authorization] (uuid),
+        [uuid] [nchar](36) NOT NULL,
         [item_id] [nvarchar](100) NOT NULL,
         [timestamp] [bigint] NOT NULL,
-        [data] [text] NOT NULL
+        [data] [text] NOT NULL,
+        [content_hash] [char](40) NULL,
+        [stream_type] [nvarchar](50) NULL
     ) ON [PRIMARY]
 
-    ALTER TABLE [dbo].[StreamCache]
-        ADD CONSTRAINT FK_StreamCache_uuid FOREIGN KEY (uuid) REFERENCES [Authorization] (uuid) ON DELETE CASCADE
+    CREATE NONCLUSTERED INDEX [IX_StreamCache_uuid_stream_type_timestamp] ON [dbo].[StreamCache]
+        (uuid, stream_type, timestamp DESC, id DESC)
+    CREATE NONCLUSTERED INDEX [IX_StreamCache_uuid_timestamp] ON [dbo].[StreamCache]
+        (uuid, timestamp DESC, id DESC)
 
     CREATE TABLE [dbo].[Limit](
         [id] [BIGINT] IDENTITY(1,1) NOT NULL PRIMARY KEY,
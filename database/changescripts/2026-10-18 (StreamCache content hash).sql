@@ -0,0 +1,8 @@
+USE [LIGHTNING]
+GO
+
+-- Hash of the item's JSON, so update_stream_cache() can find changed items
+-- without reading the data column. Existing rows are left NULL and get
+-- their hash the next time their stream is refreshed.
+alter table [StreamCache] add content_hash char(40) null
+GO
@@ -0,0 +1,41 @@
+USE [LIGHTNING]
+GO
+
+-- The stream type is the prefix of item_id ('photo' for 'photo:1234').
+-- Storing it lets feed reads filter on an indexed column instead of
+-- item_id LIKE 'photo:%'.
+alter table [StreamCache] add stream_type nvarchar(50) null
+GO
+
+-- Backfill in batches to keep the transaction log and locks small.
+WHILE 1 = 1
+BEGIN
+    UPDATE TOP (10000) [StreamCache]
+        SET stream_type = LEFT(item_id, CHARINDEX(':', item_id) - 1)
+        WHERE stream_type IS NULL AND CHARINDEX(':', item_id) > 1
+    IF @@ROWCOUNT = 0 BREAK
+END
+GO
+
+-- Feed reads seek on (uuid[, stream_type]) and walk (timestamp, id)
+-- backwards from a cursor.
+CREATE NONCLUSTERED INDEX [IX_StreamCache_uuid_stream_type_timestamp] ON [dbo].[StreamCache]
+(
+	[uuid] ASC,
+	[stream_type] ASC,
+	[timestamp] DESC,
+	[id] DESC
+)WITH (PAD_INDEX  = OFF, STATISTICS_NORECOMPUTE  = OFF, SORT_IN_TEMPDB = OFF, IGNORE_DUP_KEY = OFF, DROP_EXISTING = OFF, ONLINE = OFF, ALLOW_ROW_LOCKS  = ON, ALLOW_PAGE_LOCKS  = ON) ON [PRIMARY]
+GO
+
+CREATE NONCLUSTERED INDEX [IX_StreamCache_uuid_timestamp] ON [dbo].[StreamCache]
+(
+	[uuid] ASC,
+	[timestamp] DESC,
+	[id] DESC
+)WITH (PAD_INDEX  = OFF, STATISTICS_NORECOMPUTE  = OFF, SORT_IN_TEMPDB = OFF, IGNORE_DUP_KEY = OFF, DROP_EXISTING = OFF, ONLINE = OFF, ALLOW_ROW_LOCKS  = ON, ALLOW_PAGE_LOCKS  = ON) ON [PRIMARY]
+GO
+
+-- Covered by the indexes above.
+DROP INDEX [IX_StreamCache_uuid] ON [dbo].[StreamCache]
+GO
@@ -0,0 +1,24 @@
+USE [LIGHTNING]
+GO
+
+-- Deleting an Authorization used to cascade to UserData, GranularData and
+-- StreamCache in one statement, locking all three for as long as a large
+-- account took to delete. Their rows are now purged in small batches after
+-- the Authorization is gone (DatastoreSQL.purge_user_data()), so the
+-- foreign keys, named and unnamed, are dropped.
+DECLARE @sql nvarchar(max)
+WHILE 1 = 1
+BEGIN
+    SELECT TOP 1 @sql = 'ALTER TABLE [dbo].[' + OBJECT_NAME(parent_object_id) + '] DROP CONSTRAINT [' + name + ']'
+        FROM sys.foreign_keys
+        WHERE referenced_object_id = OBJECT_ID(N'[dbo].[Authorization]')
+        AND parent_object_id IN (
+            OBJECT_ID(N'[dbo].[UserData]'),
+            OBJECT_ID(N'[dbo].[GranularData]'),
+            OBJECT_ID(N'[dbo].[StreamCache]')
+        )
+    IF @@ROWCOUNT = 0 BREAK
+    EXEC sp_executesql @sql
+END
+GO
+
@@ -1 +1,32 @@
 "Generic docstring A"
+from __future__ import absolute_import
+
+
+def connect(connection, *args, **kwargs):
+    """
+    Connect to the datastore named by 'connection'. 'sqlite:<path>' (or
+    'sqlite::memory:') selects the embedded SQLite backend; anything else is
+    an ODBC connection string for SQL Server.
+    """
+    if connection.startswith('sqlite:'):
+        from lightning.datastore.sqlite import DatastoreSQLite
+        return DatastoreSQLite.connect(connection[len('sqlite:'):], *args, **kwargs)
+
+    from lightning.datastore.sql import DatastoreSQL
+    return DatastoreSQL.connect(connection, *args, **kwargs)
+
+
+def options(config):
+    "The datastore settings in a Lightning config, as keyword arguments for connect()."
+    return dict(
+        authz_cache_size=config.get('authz_cache_size', 10000),
+        authz_cache_ttl=config.get('authz_cache_ttl', 60),
+        view_cache_size=config.get('view_cache_size', 1000),
+        view_cache_ttl=config.get('view_cache_ttl', 60),
+        pool_min=config.get('sql_pool_min', 3),
+        pool_max=config.get('sql_pool_max', 5),
+        pool_recycle=config.get('sql_pool_recycle'),
+        read_connection=config.get('sql_read_connection'),
+        read_lag=config.get('sql_read_lag', 5),
+        compress_min_size=config.get('sql_compress_min_size', 512),
+    )
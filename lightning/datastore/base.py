@@ -12,6 +12,9 @@ class DatastoreBase(object):
     def get_oauth_token(self, *args, **kwargs):
         'Abstract base method for get_oauth_token'
         raise NotImplementedError
+    def get_oauth_tokens(self, *args, **kwargs):
+        'Abstract base method for get_oauth_tokens'
+        raise NotImplementedError
     def set_oauth_token(self, *args, **kwargs):
         'Abstract base method for set_oauth_token'
         raise NotImplementedError
@@ -42,6 +45,9 @@ class DatastoreBase(object):
     def get_value(self, *args, **kwargs):
         'Abstract base method for get_value'
         raise NotImplementedError
+    def get_values(self, *args, **kwargs):
+        'Abstract base method for get_values'
+        raise NotImplementedError
     def get_value_range(self, *args, **kwargs):
         'Abstract base method for get_value_range'
         raise NotImplementedError
@@ -51,3 +57,24 @@ class DatastoreBase(object):
     def write_value(self, *args, **kwargs):
         'Abstract base method for write_value'
         raise NotImplementedError
+    def write_values(self, *args, **kwargs):
+        'Abstract base method for write_values'
+        raise NotImplementedError
+    def compact_user_data(self, *args, **kwargs):
+        'Abstract base method for compact_user_data'
+        raise NotImplementedError
+    def purge_user_data(self, *args, **kwargs):
+        'Abstract base method for purge_user_data'
+        raise NotImplementedError
+    def sync(self, *args, **kwargs):
+        'Abstract base method for sync'
+        raise NotImplementedError
+    def write_granular_datum(self, *args, **kwargs):
+        'Abstract base method for write_granular_datum'
+        raise NotImplementedError
+    def write_granular_data(self, *args, **kwargs):
+        'Abstract base method for write_granular_data'
+        raise NotImplementedError
+    def find_unwritten_granular_data(self, *args, **kwargs):
+        'Abstract base method for find_unwritten_granular_data'
+        raise NotImplementedError
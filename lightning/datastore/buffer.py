@@ -0,0 +1,187 @@
+"""
+A write-behind buffer for the datastore writes made by the worker.
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+from twisted.internet import defer, reactor
+from twisted.python import log
+from twisted.python.failure import Failure
+
+
+class WriteBuffer(object):
+    """
+    Wraps a datastore so that write_value(s), write_granular_data(um) and
+    update_stream_cache() return at once, and are written later in batches.
+    Everything else is passed through to the datastore.
+
+    Buffered writes are coalesced per uuid: values with the same timestamp
+    become one write_values(), granular data for the same method one
+    write_granular_data(), and only the last update_stream_cache() is kept
+    (each one replaces the whole cached stream anyway).
+
+    The buffer is flushed when it holds 'max_writes' writes, 'max_delay'
+    seconds after the first one, or when sync() is called. A job calls
+    sync(uuid) before it's done, which fails if any of the uuid's writes did.
+    Flushes are written one at a time, so writes are stored in order.
+    """
+    def __init__(self, datastore, max_writes=500, max_delay=1.0, clock=reactor):
+        self.datastore = datastore
+        self.max_writes = max_writes
+        self.max_delay = max_delay
+        self.clock = clock
+
+        self.pending = OrderedDict()
+        self.writes = 0
+        self.timer = None
+        self.lock = defer.DeferredLock()
+        # uuid => a list of the flushes it's being written in, each a list
+        # of the Deferreds waiting on it.
+        self.flushing = {}
+        # uuid => the Failure of writes that failed before sync() was called.
+        self.failed = {}
+
+    def __getattr__(self, name):
+        return getattr(self.datastore, name)
+
+    def buffered(self, uuid):
+        "The writes buffered for 'uuid'. Counts a new write."
+        writes = self.pending.get(uuid)
+        if writes is None:
+            writes = self.pending[uuid] = {
+                'values': OrderedDict(),
+                'granular': OrderedDict(),
+                'stream': None,
+            }
+        self.writes += 1
+        return writes
+
+    def added(self):
+        "Flush if the buffer is full, or arrange for it to be soon."
+        if self.writes >= self.max_writes:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.clock.callLater(self.max_delay, self.flush)
+        return defer.succeed(True)
+
+    def write_value(self, **kwargs):
+        "Buffer a value for 'uuid'/'method' at 'timestamp'"
+        assert kwargs.get('uuid') != None
+        assert kwargs.get('method') != None
+        assert kwargs.get('timestamp') != None
+
+        return self.write_values(
+            uuid=kwargs['uuid'],
+            timestamp=kwargs['timestamp'],
+            values={kwargs['method']: kwargs['data']},
+        )
+
+    def write_values(self, uuid=None, timestamp=None, values=None):
+        "Buffer many values for 'uuid' at 'timestamp'"
+        assert uuid != None
+        assert timestamp != None
+
+        if type(values) == dict:
+            values = values.items()
+        writes = self.buffered(uuid)
+        writes['values'].setdefault(int(timestamp), OrderedDict()).update(values or [])
+        return self.added()
+
+    def write_granular_datum(self, **kwargs):
+        return self.write_granular_data([kwargs], **kwargs)
+
+    def write_granular_data(self, data, **kwargs):
+        "Buffer granular data for kwargs['authorization']/kwargs['method']"
+        authorization = kwargs['authorization']
+        writes = self.buffered(authorization.uuid)
+        granular = writes['granular'].setdefault(kwargs['method'], [authorization, []])
+        granular[1].extend(data)
+        return self.added()
+
+    def update_stream_cache(self, data, authorization):
+        "Buffer the new cached stream for 'authorization'"
+        writes = self.buffered(authorization.uuid)
+        writes['stream'] = (list(data), authorization)
+        return self.added()
+
+    @defer.inlineCallbacks
+    def write(self, uuid, writes):
+        "Make the buffered writes for one uuid, in the order they were made."
+        for timestamp, values in writes['values'].iteritems():
+            yield self.datastore.write_values(
+                uuid=uuid, timestamp=timestamp, values=values,
+            )
+        for method, (authorization, data) in writes['granular'].iteritems():
+            yield self.datastore.write_granular_data(
+                data, authorization=authorization, method=method,
+            )
+        if writes['stream']:
+            yield self.datastore.update_stream_cache(*writes['stream'])
+
+    def written(self, result, uuid, waiters):
+        "Tell whoever is waiting on a uuid's writes how they went."
+        self.flushing[uuid] = [w for w in self.flushing[uuid] if w is not waiters]
+        if not self.flushing[uuid]:
+            del self.flushing[uuid]
+
+        if isinstance(result, Failure) and not waiters:
+            log.err(result, 'Buffered writes for %s failed' % uuid)
+            self.failed[uuid] = result
+        for d in waiters:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(None)
+
+    def flush(self):
+        "Write everything buffered. Returns a Deferred fired when it's written."
+        if self.timer is not None:
+            if self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+
+        batch, self.pending, self.writes = self.pending, OrderedDict(), 0
+        if not batch:
+            return defer.succeed(None)
+
+        waiters = {}
+        for uuid in batch:
+            waiters[uuid] = []
+            self.flushing.setdefault(uuid, []).append(waiters[uuid])
+
+        def write_batch():
+            return defer.DeferredList([
+                self.write(uuid, writes).addBoth(self.written, uuid, waiters[uuid])
+                for uuid, writes in batch.iteritems()
+            ])
+
+        return self.lock.run(write_batch)
+
+    def sync(self, uuid=None):
+        """
+        Flush, and return a Deferred that fires when the writes for 'uuid'
+        (or all writes, if it's None) are stored. It fails with the error of
+        the first write that did.
+        """
+        if uuid is None or uuid in self.pending:
+            self.flush()
+
+        uuids = set(self.flushing) | set(self.failed) if uuid is None else [uuid]
+        waiting = []
+        for uuid in uuids:
+            if uuid in self.failed:
+                waiting.append(defer.fail(self.failed.pop(uuid)))
+            for waiters in self.flushing.get(uuid, []):
+                d = defer.Deferred()
+                waiters.append(d)
+                waiting.append(d)
+        if not waiting:
+            return defer.succeed(None)
+
+        return defer.DeferredList(
+            waiting, fireOnOneErrback=True, consumeErrors=True,
+        ).addCallbacks(
+            lambda _: None,
+            lambda failure: failure.value.subFailure,
+        )
@@ -0,0 +1,278 @@
+"""
+In-process caches used by the datastore.
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+from twisted.internet import defer
+
+import json
+import logging
+import time
+
+
+class LRUCache(object):
+    """
+    A bounded least-recently-used cache whose entries also expire after
+    `ttl` seconds. A `ttl` of None means entries never expire, and a `size`
+    of 0 disables the cache entirely.
+
+    Hits and misses are counted so callers can report on the cache.
+    """
+    def __init__(self, size=1000, ttl=None, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True):
+        "Return the value for key, or default if it's missing or expired."
+        entry = self._data.pop(key, None)
+        if entry is not None and self.ttl is not None and entry[1] <= self.clock():
+            entry = None
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+
+        # Re-insert to mark this key as the most recently used.
+        self._data[key] = entry
+        if count:
+            self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        "Store value under key, evicting the least recently used entries."
+        if self.size <= 0:
+            return
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = self.clock() + self.ttl
+        self._data.pop(key, None)
+        self._data[key] = (value, expires_at)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        "Remove key, if present."
+        self._data.pop(key, None)
+
+    def clear(self):
+        "Remove everything. The counters are left alone."
+        self._data.clear()
+
+    def stats(self):
+        "Return the counters and occupancy of the cache."
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'max_size': self.size,
+        }
+
+
+class AuthzCache(object):
+    """
+    Caches authorizations by uuid and by (client_name, service_name, user_id).
+
+    The uuid key holds a snapshot of the authorization's columns and the
+    (client_name, service_name, user_id) key only points at the uuid, so
+    dropping the uuid entry is enough to invalidate both. Every hit builds a
+    new Authz, so callers that modify the object they get back (the
+    refresh_token() methods do) cannot change what is cached.
+    """
+    def __init__(self, size=10000, ttl=60, clock=time.time):
+        self.cache = LRUCache(size=size, ttl=ttl, clock=clock)
+
+    @classmethod
+    def snapshot(cls, authz):
+        "Extract the column values of an Authz, skipping twistar internals."
+        return dict(
+            (k, v) for k, v in authz.__dict__.iteritems()
+            if not k.startswith('_') and k not in ['errors', 'is_new']
+        )
+
+    def get(self, uuid=None, client_name=None, service_name=None, user_id=None):
+        "Return a fresh Authz for the key given, or None on a miss."
+        from lightning.model.authorization import Authz
+
+        if not uuid:
+            uuid = self.cache.get(
+                ('csu', client_name, service_name, user_id), count=False,
+            )
+        attrs = None
+        if uuid:
+            attrs = self.cache.get(('uuid', uuid.rstrip()), count=False)
+
+        if attrs is None:
+            self.cache.misses += 1
+            return None
+        self.cache.hits += 1
+        return Authz(**attrs)
+
+    def set(self, authz):
+        "Cache an Authz under both of its keys."
+        if not authz or not getattr(authz, 'uuid', None):
+            return
+        uuid = authz.uuid.rstrip()
+        self.cache.set(('uuid', uuid), self.snapshot(authz))
+        self.cache.set(
+            ('csu', authz.client_name, authz.service_name, authz.user_id),
+            uuid,
+        )
+
+    def invalidate(self, uuid=None, client_name=None, service_name=None, user_id=None):
+        "Drop an authorization, given either of its keys."
+        if client_name and service_name and user_id:
+            key = ('csu', client_name, service_name, user_id)
+            uuid = uuid or self.cache.get(key, count=False)
+            self.cache.delete(key)
+            if not uuid:
+                # The pointer may have been evicted before the snapshot was.
+                for cached_key, (attrs, _) in self.cache._data.items():
+                    if cached_key[0] == 'uuid' and (
+                        attrs['client_name'], attrs['service_name'],
+                        attrs['user_id'],
+                    ) == (client_name, service_name, user_id):
+                        self.cache.delete(cached_key)
+        if uuid:
+            self.cache.delete(('uuid', uuid.rstrip()))
+
+    def clear(self):
+        "Drop every cached authorization."
+        self.cache.clear()
+
+    def stats(self):
+        "Return the hit/miss counters and occupancy of the cache."
+        return self.cache.stats()
+
+
+# KEYS[1] is a uuid's hash. ARGV is the version the reader saw before it
+# read the value, then the method, the entry and the TTL. The entry is only
+# stored if no write has bumped the version since.
+SET_SCRIPT = """
+if (redis.call('HGET', KEYS[1], '_version') or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+if tonumber(ARGV[4]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+return 1
+"""
+
+# KEYS[1] is a uuid's hash. ARGV is the TTL, then the methods to drop; all
+# of them if there are none. The version is bumped and kept either way.
+INVALIDATE_SCRIPT = """
+local version = redis.call('HINCRBY', KEYS[1], '_version', 1)
+if #ARGV > 1 then
+    redis.call('HDEL', KEYS[1], unpack(ARGV, 2))
+else
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[1], '_version', version)
+end
+if tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return version
+"""
+
+
+class ValueCache(object):
+    """
+    Caches the latest value of each (uuid, method) in Redis, where it is
+    shared by the web servers and invalidated by the workers that write
+    values.
+
+    Each uuid's values are kept in one hash keyed by method, so they can all
+    be dropped at once. Entries are (data, timestamp) pairs, stored with when
+    they were cached so each one expires on its own; whether a value has
+    expired is decided from the authorization when it's read. Redis errors
+    are logged and treated as misses.
+
+    The hash also holds a '_version' that every invalidation bumps. A reader
+    gets the version before it reads the database and set() only stores the
+    value if it's unchanged, so a value read before a write can't be cached
+    after the write invalidated it.
+    """
+    PREFIX = 'lightning:value:'
+
+    def __init__(self, redis, ttl=86400, clock=time.time):
+        self.redis = redis
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, uuid):
+        "The Redis hash holding the values for uuid."
+        return self.PREFIX + uuid.rstrip()
+
+    def failed(self, failure):
+        logging.warning('Value cache error: %s' % failure.getErrorMessage())
+        return None
+
+    def eval(self, script, key, *args):
+        # cyclone's client has no EVAL of its own, and raises rather than
+        # failing the Deferred when it isn't connected.
+        return defer.maybeDeferred(
+            self.redis.execute_command, 'EVAL', script, 1, key, *args
+        ).addErrback(self.failed)
+
+    def get(self, uuid, method):
+        "Return a Deferred firing with (data, timestamp), or None on a miss."
+        def decode(value):
+            entry = value and json.loads(value)
+            if not entry or len(entry) < 3 or (
+                    self.ttl and entry[2] + self.ttl <= self.clock()):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return tuple(entry[:2])
+
+        return defer.maybeDeferred(
+            self.redis.hget, self.key(uuid), method,
+        ).addCallback(decode).addErrback(self.failed)
+
+    def version(self, uuid):
+        """
+        Return a Deferred firing with the version of uuid's values, to be
+        passed to set(). Call it before reading the values to cache.
+        """
+        return defer.maybeDeferred(
+            self.redis.hget, self.key(uuid), '_version',
+        ).addCallbacks(lambda version: str(version or 0), self.failed)
+
+    def set(self, uuid, method, data, timestamp, version):
+        """
+        Cache the latest value of uuid/method, unless uuid's values were
+        invalidated since version() returned 'version'.
+        """
+        if version is None:
+            # Redis failed when the version was asked for.
+            return defer.succeed(None)
+        entry = json.dumps([data, timestamp, self.clock()])
+        return self.eval(
+            SET_SCRIPT, self.key(uuid), version, method, entry, self.ttl or 0,
+        )
+
+    def invalidate(self, uuid, methods=None):
+        "Drop the cached values of uuid, or only those of 'methods'."
+        if methods is not None and not methods:
+            return defer.succeed(None)
+        return self.eval(
+            INVALIDATE_SCRIPT, self.key(uuid), self.ttl or 0, *(methods or [])
+        )
+
+    def stats(self):
+        "Return the hit/miss counters of the cache."
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,38 @@
+"""
+The compact encoding of the JSON stored in UserData.data and StreamCache.data.
+
+A stored value is either the JSON text itself, or a header naming the
+encoding followed by the encoded text. JSON never starts with '~', so the
+two can't be confused and old rows need no marker. The only encoding so far
+is '~z1:', zlib-compressed UTF-8 JSON in base64 (both columns are text).
+"""
+
+from __future__ import absolute_import
+
+import base64
+import zlib
+
+ZLIB_HEADER = '~z1:'
+
+
+def compress(text, min_size=512):
+    """
+    Encode 'text' for storage. Text shorter than 'min_size' bytes (or any
+    text, if min_size is None), and text that doesn't get shorter, is stored
+    as it is.
+    """
+    if min_size is None or len(text) < min_size:
+        return text
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    encoded = ZLIB_HEADER + base64.b64encode(zlib.compress(text, 6))
+    if len(encoded) >= len(text):
+        return text
+    return encoded
+
+
+def decompress(stored):
+    "Return the JSON text of a stored value, whatever its encoding."
+    if stored and stored.startswith(ZLIB_HEADER):
+        return zlib.decompress(base64.b64decode(stored[len(ZLIB_HEADER):])).decode('utf-8')
+    return stored
@@ -0,0 +1,136 @@
+"""
+An adbapi connection pool that can be pre-warmed, recycles old connections
+and keeps track of how busy it is.
+"""
+
+from __future__ import absolute_import
+
+from twisted.enterprise import adbapi
+from twisted.internet import defer
+
+import threading
+import time
+
+
+class InstrumentedConnectionPool(adbapi.ConnectionPool):
+    """
+    An adbapi.ConnectionPool with gauges, for sizing the pool.
+
+    adbapi runs every interaction on a thread of its own thread pool, and
+    each thread keeps one connection, so cp_max is both the most connections
+    and the most threads. On top of the usual cp_* arguments this takes:
+
+    * cp_recycle - close and re-open connections older than this many
+      seconds before they're used (None means never).
+    * cp_clock - the time function, for testing.
+
+    stats() reports the open connections, how many interactions are running
+    and queued, and how long interactions waited for a thread and ran.
+    """
+    def __init__(self, dbapiName, *connargs, **connkw):
+        self.recycle = connkw.pop('cp_recycle', None)
+        self.clock = connkw.pop('cp_clock', time.time)
+        adbapi.ConnectionPool.__init__(self, dbapiName, *connargs, **connkw)
+
+        self.opened_at = {}
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.queued = 0
+        self.interactions = 0
+        self.recycled = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.exec_time = 0.0
+        self.max_exec_time = 0.0
+
+    def connect(self):
+        "Return the connection for this thread, re-opening it if it's too old."
+        conn = adbapi.ConnectionPool.connect(self)
+        tid = self.threadID()
+        now = self.clock()
+        opened_at = self.opened_at.setdefault(tid, now)
+        if self.recycle is not None and now - opened_at > self.recycle:
+            self.disconnect(conn)
+            self.recycled += 1
+            conn = adbapi.ConnectionPool.connect(self)
+            self.opened_at[tid] = now
+        return conn
+
+    def disconnect(self, conn):
+        adbapi.ConnectionPool.disconnect(self, conn)
+        self.opened_at.pop(self.threadID(), None)
+
+    def instrument(self, f):
+        "Wrap f, which will run on a pool thread, so that it is counted."
+        submitted = self.clock()
+        with self.lock:
+            self.queued += 1
+
+        def counted(*args, **kwargs):
+            started = self.clock()
+            with self.lock:
+                self.queued -= 1
+                self.in_use += 1
+                self.wait_time += started - submitted
+                self.max_wait_time = max(self.max_wait_time, started - submitted)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                elapsed = self.clock() - started
+                with self.lock:
+                    self.in_use -= 1
+                    self.interactions += 1
+                    self.exec_time += elapsed
+                    self.max_exec_time = max(self.max_exec_time, elapsed)
+
+        return counted
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        # runQuery() and runOperation() come through here too.
+        return adbapi.ConnectionPool.runInteraction(
+            self, self.instrument(interaction), *args, **kwargs
+        )
+
+    def runWithConnection(self, func, *args, **kwargs):
+        return adbapi.ConnectionPool.runWithConnection(
+            self, self.instrument(func), *args, **kwargs
+        )
+
+    def warm(self, timeout=5):
+        """
+        Open cp_min connections now, rather than when they're first needed.
+        Each waits (up to 'timeout' seconds) for the others to start, so they
+        land on different threads. Returns a Deferred.
+        """
+        cond = threading.Condition()
+        started = [0]
+
+        def hold(conn):
+            deadline = time.time() + timeout
+            with cond:
+                started[0] += 1
+                cond.notify_all()
+                while started[0] < self.min and time.time() < deadline:
+                    cond.wait(deadline - time.time())
+
+        return defer.gatherResults([
+            self.runWithConnection(hold) for i in range(self.min)
+        ])
+
+    def stats(self):
+        "Return the gauges and counters of the pool."
+        with self.lock:
+            interactions = self.interactions
+            return {
+                'min': self.min,
+                'max': self.max,
+                'connections': len(self.connections),
+                'in_use': self.in_use,
+                'queued': self.queued,
+                'interactions': interactions,
+                'recycled': self.recycled,
+                'avg_wait_time': self.wait_time / interactions if interactions else 0.0,
+                'max_wait_time': self.max_wait_time,
+                'avg_exec_time': self.exec_time / interactions if interactions else 0.0,
+                'max_exec_time': self.max_exec_time,
+            }
@@ -6,60 +6,204 @@ This is where the SQL Server adapter for Lightning lives.
 from __future__ import absolute_import
 
 from lightning.datastore.base import DatastoreBase
+from lightning.datastore.cache import AuthzCache, LRUCache
+from lightning.datastore.codec import compress, decompress
+from lightning.datastore.pool import InstrumentedConnectionPool
+from lightning.error import InvalidArgumentError, SQLError
 from lightning.utils import get_uuid, flatten
 
 from lightning.model.authorization import Authz
 from lightning.model.granular_data import GranularData
 from lightning.model.inflight_authorization import InflightAuthz
-from lightning.model.stream_cache import StreamCache
+from lightning.model.stream_cache import get_stream_type
 from lightning.model.user_data import UserData
 from lightning.model.view import View
 
-from twisted.enterprise import adbapi
 from twisted.internet import defer
+from twisted.python import log
 from twistar.registry import Registry
 
+import hashlib
 import json
 import logging
 import pprint
-import pyodbc
 import time
 
 # Note(ray): This can be used to debug twistar SQL statements
 # from twistar.dbconfig.base import InteractionBase
 # InteractionBase.LOG = True
 
+
+def bind_config(config, pool):
+    """
+    Return a twistar config of the same dialect as 'config' that runs its
+    queries on 'pool', rather than on Registry.DBPOOL.
+    """
+    class BoundConfig(config.__class__):
+        def executeOperation(self, query, *args, **kwargs):
+            self.log(query, args, kwargs)
+            return pool.runOperation(query, *args, **kwargs)
+
+        def execute(self, query, *args, **kwargs):
+            self.log(query, args, kwargs)
+            return pool.runQuery(query, *args, **kwargs)
+
+        def runInteraction(self, interaction, *args, **kwargs):
+            return pool.runInteraction(interaction, *args, **kwargs)
+
+    return BoundConfig()
+
+
+def fetch_dicts(txn):
+    "Fetch the rows of the last statement run on 'txn' as dicts."
+    if txn.description is None:  # SQLite, when RETURNING returned nothing.
+        return []
+    columns = [d[0] for d in txn.description]
+    return [dict(zip(columns, row)) for row in txn.fetchall()]
+
 class DatastoreSQL(DatastoreBase):
     """
     This is the implementation of DatastoreBase for MS SQL Server 2008.
     """
-    def __init__(self, connection, *args, **kwargs):
+    # SQL Server allows at most 2100 parameters per statement, so lists of
+    # UUIDs are looked up in chunks well below that.
+    AUTHZ_CHUNK_SIZE = 500
+    # Bulk statements are split so they stay under the same limit, and under
+    # the 1000 rows SQL Server allows in a VALUES list.
+    MAX_PARAMETERS = 2000
+    MAX_VALUES_ROWS = 1000
+    BEGIN_TRANSACTION = 'BEGIN TRANSACTION'
+    COMMIT_TRANSACTION = 'COMMIT TRANSACTION'
+    ROLLBACK_TRANSACTION = 'IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION'
+    # The columns set_oauth_token() writes to a new authorization, and
+    # their types, so that NULLs bind the same as values.
+    AUTHZ_UPSERT_COLUMNS = [
+        'uuid', 'client_name', 'service_name', 'user_id', 'token',
+        'refresh_token', 'redirect_uri', 'secret', 'expired_on_timestamp',
+    ]
+    AUTHZ_UPSERT_TYPES = [
+        'nchar(36)', 'nvarchar(100)', 'nvarchar(100)', 'nvarchar(100)',
+        'nvarchar(max)', 'nvarchar(max)', 'nvarchar(max)', 'nvarchar(max)',
+        'bigint',
+    ]
+
+    def __init__(self, connection, authz_cache_size=10000, authz_cache_ttl=60,
+            view_cache_size=1000, view_cache_ttl=60,
+            pool_min=3, pool_max=5, pool_recycle=None,
+            read_connection=None, read_lag=5, compress_min_size=512,
+            *args, **kwargs):
         super(DatastoreSQL, self).__init__(*args, **kwargs)
         # Store the config for later use
         self.config = {
             'connection': connection,
+            'pool_min': pool_min,
+            'pool_max': pool_max,
+            'pool_recycle': pool_recycle,
+            'read_connection': read_connection,
+            # JSON at least this long is stored compressed (see codec.py).
+            'compress_min_size': compress_min_size,
         }
+        # Authorizations are read on nearly every request but rarely change.
+        # Writes through this object invalidate the cache; the TTL bounds how
+        # long another process's writes can go unnoticed.
+        self.authz_cache = AuthzCache(size=authz_cache_size, ttl=authz_cache_ttl)
+        # View definitions are parsed once and then reused until they're
+        # changed through this object, or the TTL passes.
+        self.view_cache = LRUCache(size=view_cache_size, ttl=view_cache_ttl)
+        # name => how many times the view has been changed, so a read that
+        # overlaps a change doesn't cache what it read.
+        self.view_versions = {}
+        # An optional ValueCache of the latest value of each uuid/method.
+        self.value_cache = None
+        # With a read_connection, the read-only queries go to a second pool
+        # (a replica) instead. Whatever was written through this object in
+        # the last 'read_lag' seconds is read from the primary, so a request
+        # that writes and then reads sees its own writes.
+        self.read_pool = None
+        self.read_db = None
+        self.recent_writes = LRUCache(size=authz_cache_size, ttl=read_lag)
 
     @classmethod
     def connect(cls, connection, *args, **kwargs):
         "This is how we instantiate a DatastoreSQL object with connection"
         obj = cls(connection, *args, **kwargs)
 
-        Registry.DBPOOL = adbapi.ConnectionPool(
-            'pyodbc',
-            obj.config['connection'],
-            autocommit=True,
-            cp_reconnect=True
-        )
+        Registry.DBPOOL = obj.open_pool(obj.config['connection'])
+        Registry.IMPL = None  # Pick the dialect for this pool, not the last one.
         obj.raw_db = Registry.DBPOOL  # Accessible if we need *really* low-level access to DB.
         obj.db = Registry.getConfig()
 
+        # Open the connections now, so the first requests don't wait on them.
+        obj.raw_db.warm().addErrback(log.err)
+
+        if obj.config['read_connection']:
+            obj.read_pool = obj.open_pool(obj.config['read_connection'])
+            obj.read_db = bind_config(obj.db, obj.read_pool)
+            obj.read_pool.warm().addErrback(log.err)
+
         return obj
 
+    def open_pool(self, connection):
+        "Create the connection pool for an ODBC connection string."
+        return InstrumentedConnectionPool(
+            'pyodbc',
+            connection,
+            autocommit=True,
+            cp_reconnect=True,
+            cp_min=self.config['pool_min'],
+            cp_max=self.config['pool_max'],
+            cp_recycle=self.config['pool_recycle'],
+        )
+
+    def pool_stats(self):
+        "Return the gauges of the connection pool (and the read pool's, if any)."
+        stats = self.raw_db.stats()
+        if self.read_pool:
+            stats['read'] = self.read_pool.stats()
+        return stats
+
     def disconnect(self):
         "This is how we disconnect"
+        if self.read_pool:
+            self.read_pool.close()
         return Registry.DBPOOL.close()
 
+    def wrote(self, key):
+        """Note a write to 'key' (a uuid, or a table), so reads of it stay on
+        the primary for the next 'read_lag' seconds."""
+        self.recent_writes.set(key, True)
+
+    def run_read(self, key, read, *args, **kwargs):
+        """
+        Call read(db, pool, *args, **kwargs) for a read-only query of 'key',
+        where db is a twistar config and pool the connection pool to use.
+
+        That's the read pool, unless there isn't one or 'key' was written to
+        lately. If the read pool fails, the read is retried on the primary.
+        """
+        if not self.read_pool or key in self.recent_writes:
+            return read(self.db, self.raw_db, *args, **kwargs)
+
+        def fall_back(failure):
+            failure.trap(SQLError)
+            log.err(failure, 'Read pool failed, reading from the primary')
+            return read(self.db, self.raw_db, *args, **kwargs)
+
+        return defer.maybeDeferred(
+            read, self.read_db, self.read_pool, *args, **kwargs
+        ).addErrback(fall_back)
+
+    def run_value_read(self, key, read, *args, **kwargs):
+        """
+        Like run_read(), for the reads of values. What they find is put in
+        the value cache, which every web server shares, so with a value
+        cache they go to the primary: a lagging replica's answer would be
+        served to everyone until the next write.
+        """
+        if self.value_cache:
+            return defer.maybeDeferred(read, self.db, self.raw_db, *args, **kwargs)
+        return self.run_read(key, read, *args, **kwargs)
+
     def status(self):
         "This is how we know we're still connected and good."
         def handle_response(r):
@@ -87,6 +231,51 @@ class DatastoreSQL(DatastoreBase):
             ret.append(arg)
         return ret
 
+    def in_where(self, column, values, **kwargs):
+        """Build a twistar where-list for 'column IN (values)', ANDed with an
+        equality (or IN, for lists) condition for each non-empty kwarg."""
+        where = ['%s IN (%s)' % (column, ', '.join(['?'] * len(values)))]
+        where_args = list(values)
+        for key, value in sorted(kwargs.iteritems()):
+            if not value:
+                continue
+            if type(value) == list:
+                where.append('%s IN (%s)' % (key, ', '.join(['?'] * len(value))))
+                where_args.extend(value)
+            else:
+                where.append('%s = ?' % key)
+                where_args.append(value)
+        return [' AND '.join(where)] + where_args
+
+    def chunk_rows(self, rows, params_per_row):
+        "Split rows into lists small enough for one bulk statement each."
+        size = min(self.MAX_PARAMETERS // params_per_row, self.MAX_VALUES_ROWS)
+        return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+    def limit_query(self, query, num):
+        "Limit a SELECT statement to its first 'num' rows, if 'num' is given."
+        if not num:
+            return query
+        return query.replace('SELECT', 'SELECT TOP (%d)' % int(num), 1)
+
+    def run_in_transaction(self, interaction, *args, **kwargs):
+        """
+        Run interaction(txn, *args, **kwargs) in a thread, inside a single
+        transaction. The pool is in autocommit mode, so the transaction is
+        opened and closed explicitly.
+        """
+        def transaction(txn):
+            txn.execute(self.BEGIN_TRANSACTION)
+            try:
+                result = interaction(txn, *args, **kwargs)
+            except:
+                txn.execute(self.ROLLBACK_TRANSACTION)
+                raise
+            txn.execute(self.COMMIT_TRANSACTION)
+            return result
+
+        return self.raw_db.runInteraction(transaction)
+
     @defer.inlineCallbacks
     def get_oauth_token(self, **kwargs):
         """
@@ -107,33 +296,32 @@ class DatastoreSQL(DatastoreBase):
             assert kwargs.get('client_name') != None
             assert kwargs.get('service_name') != None
 
-            authz = yield Authz.find(where=self.args_to_where(**kwargs), limit=1)
+            authz = None
+            if kwargs.get('user_id'):
+                authz = self.authz_cache.get(
+                    client_name=kwargs['client_name'],
+                    service_name=kwargs['service_name'],
+                    user_id=kwargs['user_id'],
+                )
+            if not authz:
+                authz = yield Authz.find(where=self.args_to_where(**kwargs), limit=1)
+                self.authz_cache.set(authz)
             if not authz:
                 defer.returnValue(dict())
             else:
                 uuid = authz.uuid
 
         if type(uuid) == list:
-            authz = yield defer.gatherResults([
-                Authz.find(where=['uuid = ?', this], limit=1) for this in uuid
-            ])
-
-            authz = [this for this in authz if this]
-
-            if kwargs.get('client_name'):
-                authz = [
-                    this for this in authz
-                    if this.client_name == kwargs['client_name']
-                ]
-            if kwargs.get('service_name'):
-                if type(kwargs['service_name']) != list:
-                    kwargs['service_name'] = [kwargs['service_name']]
-                authz = [
-                    this for this in authz
-                    if this.service_name in kwargs['service_name']
-                ]
+            authz = yield self.get_oauth_tokens(
+                uuid,
+                client_name=kwargs.get('client_name'),
+                service_name=kwargs.get('service_name'),
+            )
         else:
-            authz = yield Authz.find(where=['uuid = ?', uuid], limit=1)
+            authz = self.authz_cache.get(uuid=uuid)
+            if not authz:
+                authz = yield Authz.find(where=['uuid = ?', uuid], limit=1)
+                self.authz_cache.set(authz)
             if not authz:
                 defer.returnValue(None)
             if kwargs.get('client_name'):
@@ -145,67 +333,129 @@ class DatastoreSQL(DatastoreBase):
 
         defer.returnValue(authz)
 
+    @defer.inlineCallbacks
+    def get_oauth_tokens(self, uuids, client_name=None, service_name=None):
+        """
+        Retrieve the authorizations for a list of UUIDs in as few queries as
+        possible. The UUIDs are looked up with a single 'uuid IN (...)' query
+        per chunk of AUTHZ_CHUNK_SIZE, with the client_name and service_name
+        (a single name or a list of names) filters applied in SQL.
+
+        Returns a list of Authz objects in the order of the UUIDs requested.
+        Unknown UUIDs (and those filtered out) are omitted.
+        """
+        if service_name and type(service_name) != list:
+            service_name = [service_name]
+
+        # Serve what we can from the cache, filtering in Python, and don't ask
+        # the database for the same UUID twice.
+        by_uuid = {}
+        wanted = []
+        for uuid in uuids:
+            uuid = uuid.rstrip()
+            if uuid in by_uuid or uuid in wanted:
+                continue
+            authz = self.authz_cache.get(uuid=uuid)
+            if not authz:
+                wanted.append(uuid)
+            elif (not client_name or authz.client_name == client_name) and \
+                    (not service_name or authz.service_name in service_name):
+                by_uuid[uuid] = authz
+
+        # The filters are pushed into SQL, so only matching rows are cached
+        # here; the rest are looked up again next time.
+        found = yield defer.gatherResults([
+            Authz.find(where=self.in_where(
+                'uuid', wanted[idx:idx + self.AUTHZ_CHUNK_SIZE],
+                client_name=client_name,
+                service_name=service_name,
+            ))
+            for idx in range(0, len(wanted), self.AUTHZ_CHUNK_SIZE)
+        ])
+
+        # uuid is an nchar column, so shorter values come back space-padded.
+        for authz in flatten(found):
+            if authz:
+                self.authz_cache.set(authz)
+                by_uuid[authz.uuid.rstrip()] = authz
+        defer.returnValue([
+            by_uuid[uuid.rstrip()] for uuid in uuids
+            if uuid.rstrip() in by_uuid
+        ])
+
+    def invalidate_oauth_token(self, authorization=None, **kwargs):
+        """Drop an authorization from the cache. Pass either the Authz that
+        changed or its uuid / client_name, service_name and user_id."""
+        if authorization:
+            kwargs = AuthzCache.snapshot(authorization)
+        self.authz_cache.invalidate(
+            uuid=kwargs.get('uuid'),
+            client_name=kwargs.get('client_name'),
+            service_name=kwargs.get('service_name'),
+            user_id=kwargs.get('user_id'),
+        )
+
+    def authz_cache_stats(self):
+        "Return the hit/miss counters of the authorization cache."
+        return self.authz_cache.stats()
+
     @defer.inlineCallbacks
     def set_oauth_token(self, **auth_args):
         """Creates or updates an authorization
         Args:
             auth_args: dict, contains the properties of the authorization to set
         Returns:
-            tuple containing uuid and boolean indicating authorization newness
+            the Authz, with is_new set to a boolean indicating its newness
         """
         assert auth_args.get('client_name') is not None
         assert auth_args.get('service_name') is not None
         assert auth_args.get('user_id') is not None
-        # 1) Do we have a UUID for this tuple?
-        authz = yield Authz.find(
-            where=self.args_to_where(
-                client_name=auth_args['client_name'],
-                service_name=auth_args['service_name'],
-                user_id=auth_args['user_id'],
-            ),
-            limit=1,
+        # A new authorization gets this UUID; an existing one keeps its own.
+        uuid = get_uuid()
+        row = dict(
+            (column, auth_args.get(column)) for column in self.AUTHZ_UPSERT_COLUMNS
         )
-        # 2) If not, create a UUID and write it.
-        if not authz:
-            uuid = get_uuid()
-            authz = yield Authz(
-                client_name=auth_args.get('client_name', None),
-                expired_on_timestamp=auth_args.get('expired_on_timestamp', None),
-                redirect_uri=auth_args.get('redirect_uri', None),
-                refresh_token=auth_args.get('refresh_token', None),
-                secret=auth_args.get('secret', None),
-                service_name=auth_args.get('service_name', None),
-                state=auth_args.get('state', None),
-                token=auth_args.get('token', None),
-                user_id=auth_args.get('user_id', None),
-                uuid=uuid,
-            ).save()
-
-            # Sometimes Twistar doesn't return the created row's id after a call
-            # to save(). In that case, hit the DB and grab the object.
-            if not authz.id:
-                authz = yield Authz.find(
-                    where=self.args_to_where(
-                        uuid=uuid,
-                    ),
-                    limit=1
-                )
-
-            authz.is_new = True
-        else:
-            uuid = authz.uuid
-            authz.is_new = False
-            attrs = {}
-            if auth_args.get('token') and auth_args['token'] != authz.token:
-                attrs['token'] = auth_args['token']
-            if auth_args.get('secret') and auth_args['secret'] != authz.secret:
-                attrs['secret'] = auth_args['secret']
-            if len(attrs):
-                authz.updateAttrs(attrs)
-                authz = yield authz.save()
+        row['uuid'] = uuid
+        stored = yield self.upsert_authz(row)
+        authz = Authz(**stored)
+        authz.is_new = authz.uuid.rstrip() == uuid
 
+        self.invalidate_oauth_token(authz)
         defer.returnValue(authz)
 
+    def upsert_authz(self, row):
+        """The SQL half of set_oauth_token(). In one statement, insert 'row'
+        (a dict of AUTHZ_UPSERT_COLUMNS), or update the token and secret (if
+        they're given) of the authorization with the same client_name,
+        service_name and user_id. Returns the stored row as a dict."""
+        def upsert(txn):
+            txn.execute(
+                """
+                MERGE [Authorization] WITH (HOLDLOCK) AS a
+                USING (SELECT %s) AS s
+                ON a.client_name = s.client_name
+                    AND a.service_name = s.service_name
+                    AND a.user_id = s.user_id
+                WHEN MATCHED THEN UPDATE SET
+                    token = COALESCE(NULLIF(s.token, ''), a.token),
+                    secret = COALESCE(NULLIF(s.secret, ''), a.secret)
+                WHEN NOT MATCHED THEN
+                    INSERT (%s) VALUES (%s)
+                OUTPUT inserted.*;
+                """ % (
+                    ', '.join(
+                        'CAST(? AS %s) AS %s' % (sql_type, column)
+                        for column, sql_type in zip(self.AUTHZ_UPSERT_COLUMNS, self.AUTHZ_UPSERT_TYPES)
+                    ),
+                    ', '.join(self.AUTHZ_UPSERT_COLUMNS),
+                    ', '.join('s.%s' % column for column in self.AUTHZ_UPSERT_COLUMNS),
+                ),
+                [row[column] for column in self.AUTHZ_UPSERT_COLUMNS],
+            )
+            return fetch_dicts(txn)[0]
+
+        return self.raw_db.runInteraction(upsert)
+
     @defer.inlineCallbacks
     def expire_oauth_token(self, **kwargs):
         "Expire the oauth token."
@@ -215,6 +465,7 @@ class DatastoreSQL(DatastoreBase):
         authz = yield Authz.find(where=['uuid = ?', kwargs['uuid']], limit=1)
         authz.expired_on_timestamp = kwargs['timestamp']
         yield authz.save()
+        self.invalidate_oauth_token(authz)
 
     @defer.inlineCallbacks
     def delete_oauth_token(self, **kwargs):
@@ -224,6 +475,7 @@ class DatastoreSQL(DatastoreBase):
         uuid = kwargs.get('uuid')
         if uuid:
             yield Authz.deleteAll(where=['uuid = ?', uuid])
+            self.invalidate_oauth_token(uuid=uuid)
             defer.returnValue(True)
         else:
             assert kwargs.get('client_name') != None
@@ -231,6 +483,7 @@ class DatastoreSQL(DatastoreBase):
             assert kwargs.get('user_id') != None
 
             yield Authz.deleteAll(where=self.args_to_where(**kwargs))
+            self.invalidate_oauth_token(**kwargs)
             defer.returnValue(True)
 
     @defer.inlineCallbacks
@@ -252,35 +505,50 @@ class DatastoreSQL(DatastoreBase):
     @defer.inlineCallbacks
     def retrieve_inflight_authz(self, **kwargs):
         """This is used for the OAuth v1 authorization because there is data
-        that must be preserved between calls.
+        that must be preserved between calls. The data is deleted as it's
+        retrieved, so each can only be used once.
         """
-        data = yield InflightAuthz.find(
-            where=self.args_to_where(**kwargs), limit=1
-        )
-        yield InflightAuthz.deleteAll(where=self.args_to_where(**kwargs))
-        if data:
-            defer.returnValue(data)
+        where = self.args_to_where(**kwargs)
+        assert where[0]
+        rows = yield self.consume_inflight_authz(where)
+        if rows:
+            row = min(rows, key=lambda r: r['id'])
+            defer.returnValue(InflightAuthz(**row))
         else:
             defer.returnValue(None)
 
+    def consume_inflight_authz(self, where):
+        """The SQL half of retrieve_inflight_authz(). Delete the inflight
+        authorizations matching the twistar where-list, and return them as
+        dicts, in one statement: of two callbacks racing for the same one,
+        only one gets it."""
+        def consume(txn):
+            txn.execute(
+                'DELETE FROM [InflightAuthorization] OUTPUT deleted.* WHERE %s' % where[0],
+                where[1:],
+            )
+            return fetch_dicts(txn)
+
+        return self.raw_db.runInteraction(consume)
+
     @defer.inlineCallbacks
     def get_views(self):
         """Return a list of all views stored in the system.
         This takes no parameters.
         """
         try:
-            views = yield View.find()
-            defer.returnValue([v.name for v in views])
-        except pyodbc.Error:
-            logging.error(pprint.pformat(Registry.DBPOOL.__dict__))
-            msg = ""
-            for conn in Registry.DBPOOL.connections:
-                msg += "%s, " % (pprint.pformat(Registry.DBPOOL.connections[conn]))
-            logging.error('Connections: [%s]' % msg)
+            views = yield self.run_read(
+                'View', lambda db, pool: db.select(View.TABLENAME, select='name'),
+            )
+            defer.returnValue([v['name'] for v in views or []])
+        except SQLError:
+            logging.error('Connection pool: %s' % pprint.pformat(self.pool_stats()))
 
     @defer.inlineCallbacks
     def view_exists(self, name):
         'Does a view with this name exist?'
+        if name in self.view_cache:
+            defer.returnValue(True)
         view = yield View.find(where=['name = ?', name])
         exists = False
         if view:
@@ -289,32 +557,57 @@ class DatastoreSQL(DatastoreBase):
 
     @defer.inlineCallbacks
     def get_view(self, name):
-        'Retrieve a view definition given a name'
+        """Retrieve a view definition given a name. The same (cached) list is
+        returned until the view changes, so don't modify it."""
+        items = self.view_cache.get(name)
+        if items is not None:
+            defer.returnValue(items)
+
+        version = self.view_versions.get(name, 0)
         view = yield View.find(where=['name = ?', name], limit=1)
         if not view:
             defer.returnValue([])  # XXX(ray): Emulated behavior of tornadoredis
 
         items = json.loads(view.definition)
+        if self.view_versions.get(name, 0) == version:
+            self.view_cache.set(name, items)
         defer.returnValue(items)
 
+    def changed_view(self, name):
+        "Note that view 'name' is changing, and drop its cached definition."
+        self.view_versions[name] = self.view_versions.get(name, 0) + 1
+        self.view_cache.delete(name)
+
     @defer.inlineCallbacks
     def set_view(self, name, values):
         'Create or update a view. This does a complete overwrite.'
-        view = yield View.find(where=['name = ?', name])
-        if view:
-            # Do an update.
-            view.definition = json.dumps(values)
-            view.update()
-        else:
-            # Do an insert.
-            definition = json.dumps(values)
-            yield View(name=name, definition=definition).save()
+        # The cache is dropped before and after the write: reads that start
+        # in between may see either definition, but won't cache it.
+        self.changed_view(name)
+        try:
+            view = yield View.find(where=['name = ?', name], limit=1)
+            if view:
+                # Do an update.
+                view.definition = json.dumps(values)
+                yield view.save()
+            else:
+                # Do an insert.
+                definition = json.dumps(values)
+                yield View(name=name, definition=definition).save()
+        finally:
+            self.changed_view(name)
+        self.wrote('View')
         defer.returnValue(True)
 
     @defer.inlineCallbacks
     def delete_view(self, name):
         'Delete a view given a name.'
-        yield View.deleteAll(where=['name = ?', name])
+        self.changed_view(name)
+        try:
+            yield View.deleteAll(where=['name = ?', name])
+        finally:
+            self.changed_view(name)
+        self.wrote('View')
         defer.returnValue(True)
 
     @defer.inlineCallbacks
@@ -325,9 +618,10 @@ class DatastoreSQL(DatastoreBase):
         """
         old_data = yield UserData.find(
             where=self.args_to_where(without=['authorization', 'feed_type', 'timestamp'], **kwargs),
-            limit=1
+            limit=1,
+            orderby='timestamp DESC',
         )
-        if old_data and str(old_data.data) == str(kwargs['data']):
+        if old_data and str(decompress(old_data.data)) == str(kwargs['data']):
             defer.returnValue(True)
 
         defer.returnValue(False)
@@ -339,32 +633,206 @@ class DatastoreSQL(DatastoreBase):
         assert authorization != None
         assert method != None
 
-        # Look up the index of the data in the sorted-set. This will be
-        # something returned by value_name()
-        data = yield UserData.find(
-            where=self.args_to_where(without=['testcase'], uuid=authorization.uuid, method=method),
-            limit=1,
-            orderby='timestamp DESC'
-        )
-        if not data:
-            defer.returnValue([])
+        cached = None
+        if self.value_cache:
+            cached = yield self.value_cache.get(authorization.uuid, method)
+        if cached:
+            data, timestamp = cached
+        else:
+            if self.value_cache:
+                version = yield self.value_cache.version(authorization.uuid)
+            row = yield self.run_value_read(
+                authorization.uuid,
+                lambda db, pool: db.select(
+                    UserData.TABLENAME,
+                    select='data, timestamp',
+                    where=['uuid = ? AND method = ?', authorization.uuid, method],
+                    limit=1,
+                    orderby='timestamp DESC',
+                ),
+            )
+            if not row:
+                defer.returnValue([])
+            data, timestamp = row['data'], row['timestamp']
+            if self.value_cache:
+                yield self.value_cache.set(
+                    authorization.uuid, method, data, timestamp, version,
+                )
+
+        defer.returnValue(self.decode_value(authorization, data, timestamp))
+
+    def decode_value(self, authorization, data, timestamp):
+        """Turn a stored value into what get_value() returns: [value], or
+        [value, expired_on] if the authorization expired after it was written."""
         try:
-            val = int(data.data)
+            val = int(data)
         except:
-            val = json.loads(data.data)
+            val = json.loads(decompress(data))
+
+        # The expiration isn't cached with the value, so it's always current.
+        if authorization.expired_on_timestamp and authorization.expired_on_timestamp > timestamp:
+            return [val, authorization.expired_on_timestamp]
+        return [val]
+
+    @defer.inlineCallbacks
+    def get_values(self, authorization=None, methods=None):
+        """
+        Retrieve the most recent value of each of 'methods' for
+        'authorization', as a dict of method => what get_value() would return
+        for it. Whatever isn't in the value cache is read in one query (per
+        chunk of methods) that picks the latest row of each method.
+        """
+        assert authorization != None
+
+        methods = list(set(methods or []))
+        ret = dict((method, []) for method in methods)
+
+        wanted = methods
+        if self.value_cache:
+            cached = yield defer.gatherResults([
+                self.value_cache.get(authorization.uuid, method)
+                for method in methods
+            ])
+            wanted = []
+            for method, value in zip(methods, cached):
+                if value:
+                    ret[method] = self.decode_value(authorization, *value)
+                else:
+                    wanted.append(method)
+            if wanted:
+                version = yield self.value_cache.version(authorization.uuid)
+
+        for chunk in self.chunk_rows(wanted, 1):
+            rows = yield self.run_value_read(
+                authorization.uuid,
+                lambda db, pool, query, args: pool.runQuery(query, args),
+                """
+                SELECT method, data, timestamp FROM (
+                    SELECT method, data, timestamp, ROW_NUMBER() OVER (
+                        PARTITION BY method ORDER BY timestamp DESC
+                    ) AS rn
+                    FROM [UserData]
+                    WHERE uuid = ? AND method IN (%s)
+                ) AS latest
+                WHERE rn = 1
+                """ % ', '.join(['?'] * len(chunk)),
+                [authorization.uuid] + chunk,
+            )
+            for method, data, timestamp in rows:
+                ret[method] = self.decode_value(authorization, data, timestamp)
+                if self.value_cache:
+                    yield self.value_cache.set(
+                        authorization.uuid, method, data, timestamp, version,
+                    )
 
-        if authorization.expired_on_timestamp and authorization.expired_on_timestamp > data.timestamp:
-            ret = [val, authorization.expired_on_timestamp]
-        else:
-            ret = [val]
         defer.returnValue(ret)
 
+    # SQL expressions for the start of the bucket that 'ts' falls in. Weeks
+    # start on Monday (the epoch was a Thursday); everything is in UTC.
+    BUCKETS = {
+        'hour': 'ts - ts % 3600',
+        'day': 'ts - ts % 86400',
+        'week': 'ts - ((ts - 345600) % 604800 + 604800) % 604800',
+        'month': "DATEDIFF(second, '19700101', DATEADD(month, DATEDIFF(month, 0, DATEADD(second, CAST(ts AS int), '19700101')), 0))",
+    }
+    # Samples that aren't plain numbers are ignored by the numeric aggregates.
+    NUMERIC_DATA = "CASE WHEN data NOT LIKE '%[^0-9.-]%' AND data LIKE '%[0-9]%' AND ISNUMERIC(data) = 1 THEN CAST(data AS float) END"
+    AGGREGATES = {
+        'last': None,
+        'max': 'MAX(%s)' % NUMERIC_DATA,
+        'min': 'MIN(%s)' % NUMERIC_DATA,
+        'avg': 'AVG(%s)' % NUMERIC_DATA,
+    }
+
+    def value_range_query(self, uuid, method, start_time, end_time,
+            bucket=None, agg='last', num=None, direction='ASC'):
+        """Build the query for get_value_range(). It returns rows of
+        (timestamp to report, data, a real timestamp from the row(s))."""
+        # Every sample in the range, plus the latest one before it if there
+        # isn't one at 'start' itself. Its timestamp is clamped to 'start'
+        # as 'ts'; 'timestamp' keeps the real one.
+        samples = """
+            SELECT timestamp, data FROM [UserData]
+            WHERE uuid = ? AND method = ? AND timestamp BETWEEN ? AND ?
+        """
+        args = [uuid, method, start_time, end_time]
+        if start_time > 1:
+            samples += """
+            UNION ALL
+            SELECT * FROM (%s) AS previous
+            """ % self.limit_query("""
+                SELECT timestamp, data FROM [UserData]
+                WHERE uuid = ? AND method = ? AND timestamp < ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM [UserData] WHERE uuid = ? AND method = ? AND timestamp = ?
+                )
+                ORDER BY timestamp DESC
+            """, 1)
+            args.extend([
+                uuid, method, start_time,
+                uuid, method, start_time,
+            ])
+        samples = """
+            SELECT CASE WHEN timestamp < ? THEN ? ELSE timestamp END AS ts, timestamp, data
+            FROM (%s) AS raw_samples
+        """ % samples
+        args = [start_time, start_time] + args
+
+        if not bucket:
+            query = """
+                SELECT ts, data, timestamp FROM (%s) AS samples
+                ORDER BY ts %s
+            """ % (samples, direction)
+        else:
+            bucket_start = self.BUCKETS[bucket]
+            bucketed = """
+                SELECT
+                    CASE WHEN %(bucket)s < ? THEN ? ELSE %(bucket)s END AS bucket,
+                    timestamp, data,
+                    ROW_NUMBER() OVER (PARTITION BY %(bucket)s ORDER BY timestamp DESC) AS rn
+                FROM (%(samples)s) AS samples
+            """ % {'bucket': bucket_start, 'samples': samples}
+            args = [start_time, start_time] + args
+            if agg == 'last':
+                query = """
+                    SELECT bucket, data, timestamp FROM (%s) AS bucketed
+                    WHERE rn = 1
+                    ORDER BY bucket %s
+                """ % (bucketed, direction)
+            else:
+                query = """
+                    SELECT bucket, %s AS data, MIN(timestamp) AS timestamp
+                    FROM (%s) AS bucketed
+                    GROUP BY bucket
+                    ORDER BY bucket %s
+                """ % (self.AGGREGATES[agg], bucketed, direction)
+
+        return self.limit_query(query, num), args
+
     @defer.inlineCallbacks
     def get_value_range(self, **kwargs):
-        """Retrieve the list of values between 'start' and 'end' for an 'authorization'"""
+        """Retrieve the list of values between 'start' and 'end' for an 'authorization'
+
+        The most recent value before 'start' is carried forward to 'start'.
+        If 'bucket' (one of BUCKETS) is given, the values are grouped into
+        buckets of that size and each bucket is reduced to one value by 'agg'
+        (one of AGGREGATES, 'last' by default). Either way this is a single
+        query, and the grouping is done by the database.
+        """
         assert kwargs.get('authorization') != None
         assert kwargs.get('method') != None
 
+        bucket = kwargs.get('bucket')
+        agg = kwargs.get('agg') or 'last'
+        if bucket and bucket not in self.BUCKETS:
+            raise InvalidArgumentError(
+                "Bad value for 'bucket': must be one of '%s'" % "', '".join(sorted(self.BUCKETS))
+            )
+        if agg not in self.AGGREGATES:
+            raise InvalidArgumentError(
+                "Bad value for 'agg': must be one of '%s'" % "', '".join(sorted(self.AGGREGATES))
+            )
+
         direction = 'ASC'
         if kwargs.get('reverse'):
             direction = 'DESC'
@@ -372,47 +840,29 @@ class DatastoreSQL(DatastoreBase):
         start_time = int(kwargs.get('start', 1))
         end_time = int(kwargs.get('end', int(time.time())))
         authorization = kwargs['authorization']
-
-        data = yield UserData.find(
-            where=[
-                'uuid = ? and method = ? and timestamp between ? and ?',
-                authorization.uuid,
-                kwargs['method'],
-                start_time,
-                end_time,
-            ],
-            orderby='timestamp %s' % direction
+        query, args = self.value_range_query(
+            authorization.uuid, kwargs['method'], start_time, end_time,
+            bucket=bucket, agg=agg, num=kwargs.get('num'), direction=direction,
+        )
+        rows = yield self.run_read(
+            authorization.uuid,
+            lambda db, pool: pool.runQuery(query, args),
         )
 
         extended_start_time = start_time
-        if start_time > 1 and start_time not in [x.timestamp for x in data]:
-            addl_row = yield UserData.find(
-                where=[
-                    'uuid = ? and method = ? and timestamp < ?',
-                    authorization.uuid,
-                    kwargs['method'],
-                    start_time,
-                ],
-                orderby='timestamp DESC',
-                limit=1,
-            )
-            if addl_row:
-                extended_start_time = addl_row.timestamp
-                if direction == 'DESC':
-                    data.append(addl_row)
-                else:
-                    data.insert(0, addl_row)
-
         ret = []
-        for d in data:
-            try:
-                val = int(d.data)
-            except:
-                val = json.loads(d.data)
-            ret.append(['%s' % d.timestamp, val])
-
-        if kwargs.get('num'):
-            ret = ret[0:kwargs['num']]
+        for ts, data, timestamp in rows:
+            extended_start_time = min(extended_start_time, timestamp)
+            if bucket and agg != 'last':
+                val = data
+                if val is not None and float(val).is_integer():
+                    val = int(val)
+            else:
+                try:
+                    val = int(data)
+                except:
+                    val = json.loads(decompress(data))
+            ret.append(['%s' % ts, val])
 
         ret_idx = len(ret) - 1
         is_expired_in_range = extended_start_time <= authorization.expired_on_timestamp <= end_time
@@ -423,13 +873,70 @@ class DatastoreSQL(DatastoreBase):
                 break
             ret_idx = ret_idx - 1
 
-        for item in ret:
-            if int(item[0]) < start_time:
-                item[0] = str(start_time)
-
         defer.returnValue(ret)
 
+    def sync(self, uuid=None):
+        """Return a Deferred that fires once the writes for 'uuid' are stored.
+        They already are, as writes here aren't buffered (see WriteBuffer)."""
+        return defer.succeed(None)
+
     @defer.inlineCallbacks
+    def compact_user_data(self, uuid=None, before=None, bucket='hour', batch_size=1000):
+        """
+        Downsample the values of 'uuid' older than 'before' to one per
+        'bucket' (one of BUCKETS) per method: the latest value in each bucket
+        is kept and the rest are deleted. That's the value get_value_range()
+        reports for the bucket, so bucketed ranges don't change.
+
+        The rows are deleted at most 'batch_size' at a time, each batch its
+        own statement, so SQL Server never escalates to a table lock. Returns
+        the number of rows deleted.
+        """
+        assert uuid != None
+        assert before != None
+        if bucket not in self.BUCKETS:
+            raise InvalidArgumentError(
+                "Bad value for 'bucket': must be one of '%s'" % "', '".join(sorted(self.BUCKETS))
+            )
+        batch_size = min(int(batch_size), self.MAX_PARAMETERS)
+
+        query = self.limit_query("""
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY method, %s ORDER BY timestamp DESC
+                ) AS rn
+                FROM (
+                    SELECT id, method, timestamp, timestamp AS ts FROM [UserData]
+                    WHERE uuid = ? AND timestamp < ?
+                ) AS samples
+            ) AS ranked
+            WHERE rn > 1
+        """ % self.BUCKETS[bucket], batch_size)
+
+        deleted = 0
+        while True:
+            rows = yield self.raw_db.runQuery(query, [uuid, int(before)])
+            if not rows:
+                break
+            ids = [row[0] for row in rows]
+            yield self.raw_db.runOperation(
+                'DELETE FROM [UserData] WHERE id IN (%s)' % ', '.join(['?'] * len(ids)),
+                ids,
+            )
+            deleted += len(ids)
+            if len(ids) < batch_size:
+                break
+        defer.returnValue(deleted)
+
+    def serialize_data(self, data):
+        "Convert a datum to the string we store in UserData.data"
+        try:
+            if "." in str(data):
+                return str(float(data))
+            return str(int(data))
+        except:
+            return compress(json.dumps(data), self.config['compress_min_size'])
+
     def write_value(self, **kwargs):
         """Set a value for 'uuid'/'method' at 'timestamp'"""
 
@@ -437,28 +944,62 @@ class DatastoreSQL(DatastoreBase):
         assert kwargs.get('method') != None
         assert kwargs.get('timestamp') != None
 
-        data = kwargs['data']
-        try:
-            if "." in str(data):
-                data = float(data)
-            else:
-                data = int(data)
-        except:
-            data = json.dumps(kwargs['data'])
-        kwargs['data'] = data
-        is_duplicate = yield self.is_duplicate_value(**kwargs)
-        if is_duplicate:
-            defer.returnValue(True)
-
-        yield UserData(
+        return self.write_values(
             uuid=kwargs['uuid'],
-            method=kwargs['method'],
-            data=kwargs['data'],
-            timestamp=int(kwargs['timestamp']),
-        ).save()
+            timestamp=kwargs['timestamp'],
+            values={kwargs['method']: kwargs['data']},
+        )
+
+    @defer.inlineCallbacks
+    def write_values(self, uuid=None, timestamp=None, values=None):
+        """
+        Set many values for 'uuid' at 'timestamp'. 'values' is a dict (or a
+        list of pairs) of method => data.
 
+        A value is only written if it differs from the most recent value for
+        its method. The comparison and the insert are a single statement, so
+        this costs one round trip no matter how many values there are.
+        """
+        assert uuid != None
+        assert timestamp != None
+
+        if type(values) == dict:
+            values = values.items()
+        # The last value wins if a method is given more than once, since
+        # there can only be one row per uuid/method/timestamp.
+        rows = dict(
+            (method, self.serialize_data(data)) for method, data in values or []
+        ).items()
+
+        self.wrote(uuid)
+        yield self.insert_values(uuid, int(timestamp), rows)
+        if self.value_cache:
+            yield self.value_cache.invalidate(uuid, [method for method, data in rows])
         defer.returnValue(True)
 
+    @defer.inlineCallbacks
+    def insert_values(self, uuid, timestamp, rows):
+        "The SQL half of write_values(). rows is a list of (method, data)."
+        for chunk in self.chunk_rows(rows, 2):
+            yield self.raw_db.runOperation(
+                """
+                INSERT INTO [UserData] (uuid, method, timestamp, data)
+                SELECT ?, v.method, ?, v.data
+                FROM (VALUES %s) AS v(method, data)
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM (
+                        SELECT TOP 1 data FROM [UserData] WITH (UPDLOCK, HOLDLOCK)
+                        WHERE uuid = ? AND method = v.method
+                        ORDER BY timestamp DESC
+                    ) AS latest
+                    WHERE latest.data = v.data
+                )
+                """ % ', '.join(
+                    ['(CAST(? AS nvarchar(100)), CAST(? AS nvarchar(max)))'] * len(chunk)
+                ),
+                [uuid, timestamp] + list(flatten(chunk)) + [uuid],
+            )
+
     @defer.inlineCallbacks
     def delete_user_data(self, **kwargs):
         "Delete all the user-data"
@@ -475,11 +1016,127 @@ class DatastoreSQL(DatastoreBase):
             else:
                 defer.returnValue(False)
 
-        yield UserData.deleteAll(where=['uuid = ?', uuid])
-        yield GranularData.deleteAll(where=['uuid = ?', uuid])
-        yield StreamCache.deleteAll(where=['uuid = ?', uuid])
+        yield self.purge_user_data(uuid)
         defer.returnValue(True)
 
+    @defer.inlineCallbacks
+    def compress_stored_data(self, table, after_id=0, batch_size=500):
+        """
+        Re-encode the JSON of the next 'batch_size' rows of 'table' (UserData
+        or StreamCache) with an id above 'after_id', as it would be encoded if
+        it were written now. Returns the id of the last row looked at, or None
+        once there are no more, and the number of rows rewritten.
+
+        A row is only rewritten if it hasn't changed since it was read (by
+        its content_hash in StreamCache, or its data), so a write that lands
+        in between isn't undone.
+        """
+        assert table in ('UserData', 'StreamCache')
+        column = 'content_hash' if table == 'StreamCache' else 'data'
+        rows = yield self.raw_db.runQuery(
+            self.limit_query(
+                'SELECT id, data, %s FROM [%s] WHERE id > ? ORDER BY id' % (column, table),
+                batch_size,
+            ),
+            [after_id],
+        )
+        if not rows:
+            defer.returnValue((None, 0))
+
+        updates = []
+        for row_id, data, read in rows:
+            if not data or data[0] not in '{["':
+                continue  # Numbers (or already encoded).
+            encoded = compress(data, self.config['compress_min_size'])
+            if encoded != data:
+                updates.append([encoded, row_id, read])
+
+        def update(txn):
+            count = 0
+            for encoded, row_id, read in updates:
+                if read is None:
+                    txn.execute(
+                        'UPDATE [%s] SET data = ? WHERE id = ? AND %s IS NULL' % (table, column),
+                        [encoded, row_id],
+                    )
+                else:
+                    txn.execute(
+                        'UPDATE [%s] SET data = ? WHERE id = ? AND %s = ?' % (table, column),
+                        [encoded, row_id, read],
+                    )
+                count += max(txn.rowcount, 0)
+            return count
+
+        count = 0
+        if updates:
+            count = yield self.run_in_transaction(update)
+        defer.returnValue((rows[-1][0], count))
+
+    # The tables holding data for a uuid, in the order they're purged.
+    PURGE_TABLES = ['UserData', 'GranularData', 'StreamCache']
+
+    @defer.inlineCallbacks
+    def purge_user_data(self, uuid, batch_size=1000):
+        """
+        Delete everything stored for 'uuid', at most 'batch_size' rows of a
+        table per (short) transaction, so a large account never holds locks
+        on these tables for long. Progress is logged as it goes. Returns a
+        dict of table => the number of rows deleted.
+        """
+        assert uuid != None
+
+        self.wrote(uuid)
+        deleted = {}
+        for table in self.PURGE_TABLES:
+            query = 'DELETE FROM [%s] WHERE id IN (%s)' % (
+                table,
+                self.limit_query('SELECT id FROM [%s] WHERE uuid = ?' % table, batch_size),
+            )
+
+            def delete_batch(txn):
+                txn.execute(query, [uuid])
+                return txn.rowcount
+
+            deleted[table] = 0
+            while True:
+                count = yield self.run_in_transaction(delete_batch)
+                if count <= 0:
+                    break
+                deleted[table] += count
+                logging.info('Purge %s: deleted %d rows from %s' % (uuid, deleted[table], table))
+                if count < batch_size:
+                    break
+
+        if self.value_cache:
+            yield self.value_cache.invalidate(uuid)
+        defer.returnValue(deleted)
+
+    @defer.inlineCallbacks
+    def purge_orphaned_data(self, batch_size=1000):
+        """
+        Purge the data of every uuid that has no authorization: the purge
+        may never have been queued or run, or a worker may have written to
+        it afterwards. Returns a dict of table => the number of rows deleted.
+        """
+        uuids = set()
+        for table in self.PURGE_TABLES:
+            rows = yield self.raw_db.runQuery(
+                """
+                SELECT DISTINCT uuid FROM [%s] AS t
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM [Authorization] AS a WHERE a.uuid = t.uuid
+                )
+                """ % table,
+            )
+            uuids.update(row[0] for row in rows)
+
+        deleted = dict((table, 0) for table in self.PURGE_TABLES)
+        for uuid in sorted(uuids):
+            purged = yield self.purge_user_data(uuid, batch_size=batch_size)
+            for table, count in purged.items():
+                deleted[table] += count
+        defer.returnValue(deleted)
+
     def get_last_granular_timestamp(self, **kwargs):
         def get_timestamp(row):
             if row:
@@ -496,35 +1153,82 @@ class DatastoreSQL(DatastoreBase):
         ).addCallback(get_timestamp)
 
     def write_granular_datum(self, **kwargs):
-        return GranularData(
-            uuid=kwargs['authorization'].uuid,
-            method=kwargs['method'],
-            item_id=kwargs['item_id'],
-            actor_id=kwargs['actor_id'],
-            timestamp=kwargs['timestamp'],
-        ).save()
+        return self.write_granular_data([kwargs], **kwargs)
 
-    def find_unwritten_granular_data(self, data, **kwargs):
-        def filterme(db_data):
-            ret = []
-            for datum, exists in zip(data, db_data):
-                if not exists:
-                    ret.append(datum)
-            return ret
+    @defer.inlineCallbacks
+    def write_granular_data(self, data, **kwargs):
+        """
+        Write many granular data for kwargs['authorization']/kwargs['method'].
+        Each datum is a dict with 'item_id', 'actor_id' and 'timestamp'.
 
+        Items that are already stored, or repeated within 'data', are skipped
+        rather than violating the (uuid, method, item_id) unique key.
+        """
         uuid = kwargs['authorization'].uuid
-        return defer.gatherResults([
-            GranularData.exists(
-                where=['uuid=? AND method=? AND item_id=?',
-                    uuid,
-                    kwargs['method'],
-                    datum['id'],
-                ],
-            ) for datum in data
-        ]).addCallback(filterme)
+        method = kwargs['method']
+
+        rows = []
+        seen = set()
+        for datum in data:
+            item_id = unicode(datum['item_id'])
+            if item_id in seen:
+                continue
+            seen.add(item_id)
+            rows.append([item_id, unicode(datum['actor_id']), int(datum['timestamp'])])
+
+        self.wrote(uuid)
+        yield self.insert_granular_data(uuid, method, rows)
+        defer.returnValue(True)
+
+    @defer.inlineCallbacks
+    def insert_granular_data(self, uuid, method, rows):
+        """The SQL half of write_granular_data(). rows is a list of
+        (item_id, actor_id, timestamp)."""
+        for chunk in self.chunk_rows(rows, 3):
+            yield self.raw_db.runOperation(
+                """
+                INSERT INTO [GranularData] (uuid, method, item_id, actor_id, timestamp)
+                SELECT ?, ?, v.item_id, v.actor_id, v.timestamp
+                FROM (VALUES %s) AS v(item_id, actor_id, timestamp)
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM [GranularData] WITH (UPDLOCK, HOLDLOCK)
+                    WHERE uuid = ? AND method = ? AND item_id = v.item_id
+                )
+                """ % ', '.join(
+                    ['(CAST(? AS nvarchar(100)), CAST(? AS nvarchar(100)), CAST(? AS bigint))'] * len(chunk)
+                ),
+                [uuid, method] + list(flatten(chunk)) + [uuid, method],
+            )
+
+    @defer.inlineCallbacks
+    def find_unwritten_granular_data(self, data, **kwargs):
+        """
+        Return the items in 'data' (dicts with an 'id') that have not been
+        written for kwargs['authorization']/kwargs['method'], in order and
+        without repeats. One query is made per chunk of items.
+        """
+        uuid = kwargs['authorization'].uuid
+        item_ids = list(set(unicode(datum['id']) for datum in data))
+
+        written = set()
+        for chunk in self.chunk_rows(item_ids, 1):
+            rows = yield self.db.select(
+                tablename='GranularData',
+                select='item_id',
+                where=self.in_where('item_id', chunk, uuid=uuid, method=kwargs['method']),
+            )
+            written.update(row['item_id'] for row in rows or [])
+
+        ret = []
+        for datum in data:
+            item_id = unicode(datum['id'])
+            if item_id not in written:
+                written.add(item_id)
+                ret.append(datum)
+        defer.returnValue(ret)
 
     def retrieve_granular_data(self, **kwargs):
-        return self.db.select(
+        return self.run_read(kwargs['uuid'], lambda db, pool: db.select(
             tablename='GranularData',
             select='actor_id, COUNT(*) AS num, MAX(timestamp) AS latest',
             where=['uuid=? AND method=? AND timestamp BETWEEN ? AND ? AND actor_id != ?',
@@ -536,96 +1240,116 @@ class DatastoreSQL(DatastoreBase):
             group='actor_id',
             orderby='num DESC, latest DESC',
             limit=1,
-        )
+        ))
 
-    def update_stream_cache(self, data, authorization):
-        records_to_process = {
-            'add': [], # should contain dicts
-            'remove': [], # should contain db records
-            'update': [], # should contain dicts
-        }
+    def stream_cache_hash(self, data):
+        "Hash a stream item, so changes can be found without loading old items."
+        return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
 
-        def categorize(db_data):
-            db_data = list(flatten(db_data))
-            db_ids = [record.item_id for record in db_data]
-            new_ids = [datum['item_id'] for datum in data]
-
-            # find records to add
-            for new_datum in data:
-                if not new_datum['item_id'] in db_ids:
-                    records_to_process['add'].append(new_datum)
-
-            # find records to delete
-            for db_datum in db_data:
-                if not db_datum.item_id in new_ids:
-                    records_to_process['remove'].append(db_datum)
-
-            # find records to update
-            for db_datum in db_data:
-                for new_datum in data:
-                    new_json = new_datum['data']
-                    old_json = json.loads(db_datum.data)
-
-                    if db_datum.item_id == new_datum['item_id'] and new_json != old_json:
-
-                        change = {
-                            'old': db_datum,
-                            'new': new_datum
-                        }
-                        records_to_process['update'].append(change)
-            return
-
-        def add(_):
-            return defer.gatherResults([
-                StreamCache(
-                    uuid=authorization.uuid,
-                    item_id=datum['item_id'],
-                    timestamp=datum['timestamp'],
-                    data=json.dumps(datum['data']),
-                ).save()
-            for datum in records_to_process['add']
-         ])
-
-
-        def update_single(change):
-            # change is a dictionary that contains two keys, `new` and `old`.
-            # `new` contains the dictionary with new data from the 3rd party api that we need to update *to*
-            # `old` containst the database record that needs to be updated with new data
-
-            new_data = change['new']
-            db_record = change['old']
-
-            db_record.data = json.dumps(new_data['data'])
-            return db_record.save()
-
-        def update(_):
-            return defer.gatherResults([
-                update_single(change)
-                    for change in records_to_process['update']])
-
-
-        def remove(_):
-            return defer.gatherResults([
-                record.delete()
-                    for record in records_to_process['remove']])
+    def update_stream_cache(self, data, authorization):
+        """
+        Make the cached stream for 'authorization' match 'data', a list of
+        dicts with 'item_id', 'timestamp' and 'data'.
 
+        Stored items are compared by their content_hash, so only the id,
+        item_id and hash of each cached row is read. Rows written before
+        content_hash existed have none and are rewritten once. All the
+        changes are applied in bulk, in one transaction.
+        """
         uuid = authorization.uuid
-        return StreamCache.find(
-            where=['uuid=?', uuid]
-        ).addCallback(categorize).addCallback(add).addCallback(remove).addCallback(update)
+
+        def categorize(db_rows):
+            db_by_item = {}
+            for row in db_rows or []:
+                db_by_item.setdefault(row['item_id'], []).append(row)
+
+            new_ids = set()
+            to_add, to_update, to_remove = [], [], []
+            for datum in data:
+                new_ids.add(datum['item_id'])
+                serialized = compress(
+                    json.dumps(datum['data']), self.config['compress_min_size'],
+                )
+                content_hash = self.stream_cache_hash(datum['data'])
+                rows = db_by_item.get(datum['item_id'])
+                if not rows:
+                    to_add.append([
+                        uuid, datum['item_id'], datum['timestamp'],
+                        serialized, content_hash,
+                        datum.get('stream_type', get_stream_type(datum['item_id'])),
+                    ])
+                    continue
+                for row in rows:
+                    if row['content_hash'] != content_hash:
+                        to_update.append([row['id'], serialized, content_hash])
+
+            for item_id, rows in db_by_item.iteritems():
+                if item_id not in new_ids:
+                    to_remove.extend(row['id'] for row in rows)
+
+            if to_add or to_update or to_remove:
+                self.wrote(uuid)
+                return self.run_in_transaction(
+                    self.apply_stream_cache_changes, to_add, to_update, to_remove,
+                )
+
+        return self.db.select(
+            tablename='StreamCache',
+            select='id, item_id, content_hash',
+            where=['uuid=?', uuid],
+        ).addCallback(categorize)
+
+    def apply_stream_cache_changes(self, txn, to_add, to_update, to_remove):
+        """The SQL half of update_stream_cache(), run inside its transaction.
+        to_add holds (uuid, item_id, timestamp, data, content_hash,
+        stream_type) rows, to_update holds (id, data, content_hash) rows and
+        to_remove holds ids."""
+        for chunk in self.chunk_rows(to_add, 6):
+            txn.execute(
+                'INSERT INTO [StreamCache] (uuid, item_id, timestamp, data, content_hash, stream_type) VALUES %s'
+                % ', '.join(['(?, ?, ?, ?, ?, ?)'] * len(chunk)),
+                list(flatten(chunk)),
+            )
+        for chunk in self.chunk_rows(to_update, 3):
+            txn.execute(
+                """
+                UPDATE sc SET data = v.data, content_hash = v.content_hash
+                FROM [StreamCache] sc
+                JOIN (VALUES %s) AS v(id, data, content_hash) ON sc.id = v.id
+                """ % ', '.join(
+                    ['(CAST(? AS bigint), CAST(? AS varchar(max)), CAST(? AS char(40)))'] * len(chunk)
+                ),
+                list(flatten(chunk)),
+            )
+        for chunk in self.chunk_rows(to_remove, 1):
+            txn.execute(
+                'DELETE FROM [StreamCache] WHERE id IN (%s)'
+                % ', '.join(['?'] * len(chunk)),
+                chunk,
+            )
 
     def retrieve_stream_cache(self, **kwargs):
+        """
+        Retrieve up to kwargs['limit'] cached stream items for kwargs['uuid'],
+        newest first.
+
+        The items can be limited to a stream_type, a 'start'/'end' timestamp
+        range, and a keyset cursor. A cursor is a (timestamp, id) pair taken
+        from a previously returned row: 'before' returns the items that come
+        after it in the timeline, and 'after' returns the items that come
+        before it (still newest first). Either way the query seeks straight
+        to the cursor, so deep pages cost no more than the first.
+        """
         where_clause = ['uuid=?',
             kwargs['uuid'],
         ]
 
-        if not kwargs.get('order_by'):
-            kwargs['order_by'] = 'timestamp DESC'
+        order_by = kwargs.get('order_by') or 'timestamp DESC, id DESC'
 
         if kwargs.get('start') or kwargs.get('end'):
             if kwargs.get('start') and kwargs.get('end'):
                 where_clause[0] += ' AND timestamp BETWEEN ? AND ?'
-                where_clause.append(kwargs.get('start'), kwargs['end'])
+                where_clause.extend([kwargs['start'], kwargs['end']])
             elif kwargs.get('start'):
                 where_clause[0] += ' AND timestamp >= ?'
                 where_clause.append(kwargs['start'])
@@ -633,10 +1357,21 @@ class DatastoreSQL(DatastoreBase):
                 where_clause[0] += ' AND timestamp <= ?'
                 where_clause.append(kwargs['end'])
 
+        if kwargs.get('before'):
+            timestamp, row_id = kwargs['before']
+            where_clause[0] += ' AND (timestamp < ? OR (timestamp = ? AND id < ?))'
+            where_clause.extend([timestamp, timestamp, row_id])
+        elif kwargs.get('after'):
+            timestamp, row_id = kwargs['after']
+            where_clause[0] += ' AND (timestamp > ? OR (timestamp = ? AND id > ?))'
+            where_clause.extend([timestamp, timestamp, row_id])
+            # Take the rows nearest the cursor, then flip them back below.
+            order_by = 'timestamp ASC, id ASC'
+
         if 'stream_type' in kwargs and kwargs['stream_type']:
             # Remove trailing 's' pluralization
-            stream_type = kwargs['stream_type'][:-1]
-            where_clause[0] += (" AND item_id LIKE '%s:%%'" % stream_type)
+            where_clause[0] += ' AND stream_type = ?'
+            where_clause.append(kwargs['stream_type'][:-1])
 
         def inflate_data(rows):
             # If no rows are returned, then don't inflate anything. This is a
@@ -649,15 +1384,16 @@ class DatastoreSQL(DatastoreBase):
                 rows = [rows]
 
             for row in rows:
-                row['data'] = json.loads(row['data'])
+                row['data'] = json.loads(decompress(row['data']))
 
+            if kwargs.get('after') and not kwargs.get('order_by'):
+                rows.reverse()
             return rows
 
-        return self.db.select(
+        return self.run_read(kwargs['uuid'], lambda db, pool: db.select(
             tablename='StreamCache',
-            select='data',
+            select='id, timestamp, data',
             where=where_clause,
-            orderby=kwargs['order_by'],
+            orderby=order_by,
             limit=kwargs['limit'],
-        ).addCallback(inflate_data)
-
+        )).addCallback(inflate_data)
@@ -0,0 +1,239 @@
+# coding: utf-8
+"""
+This is where the embedded SQLite adapter for Lightning lives. It needs no
+server, which makes it handy for local development and for running the
+datastore tests.
+"""
+
+from __future__ import absolute_import
+
+from lightning.datastore.pool import InstrumentedConnectionPool
+from lightning.datastore.sql import DatastoreSQL, fetch_dicts
+from lightning.utils import flatten
+
+from twisted.python import log
+from twistar.registry import Registry
+
+# The same tables as bin/generate_sql.py, in SQLite's dialect. As there, the
+# data tables have no foreign key to Authorization: their rows are deleted
+# in batches by purge_user_data(), not all at once by a cascade.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS [InflightAuthorization] (
+        [id] INTEGER PRIMARY KEY AUTOINCREMENT,
+        [service_name] TEXT NOT NULL,
+        [request_token] TEXT NULL,
+        [secret] TEXT NULL,
+        [state] TEXT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS [Authorization] (
+        [id] INTEGER PRIMARY KEY AUTOINCREMENT,
+        [uuid] TEXT NOT NULL,
+        [client_name] TEXT NOT NULL,
+        [service_name] TEXT NOT NULL,
+        [user_id] TEXT NOT NULL,
+        [token] TEXT NOT NULL,
+        [refresh_token] TEXT NULL,
+        [redirect_uri] TEXT NULL,
+        [secret] TEXT NULL,
+        [expired_on_timestamp] INTEGER NULL,
+        [account_created_timestamp] INTEGER NULL,
+        CONSTRAINT UX_Authorization_UUID UNIQUE (uuid),
+        CONSTRAINT UX_Authorization_csu UNIQUE (client_name, service_name, user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS [UserData] (
+        [id] INTEGER PRIMARY KEY AUTOINCREMENT,
+        [uuid] TEXT NOT NULL,
+        [method] TEXT NOT NULL,
+        [timestamp] INTEGER NOT NULL,
+        [data] TEXT NULL,
+        CONSTRAINT UX_UserData_uuid_method_ts UNIQUE (uuid, method, timestamp)
+    );
+
+    CREATE TABLE IF NOT EXISTS [GranularData] (
+        [id] INTEGER PRIMARY KEY AUTOINCREMENT,
+        [uuid] TEXT NOT NULL,
+        [method] TEXT NOT NULL,
+        [item_id] TEXT NOT NULL,
+        [actor_id] TEXT NOT NULL,
+        [timestamp] INTEGER NOT NULL,
+        CONSTRAINT UK_GranularData UNIQUE (uuid, method, item_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS [StreamCache] (
+        [id] INTEGER PRIMARY KEY AUTOINCREMENT,
+        [uuid] TEXT NOT NULL,
+        [item_id] TEXT NOT NULL,
+        [timestamp] INTEGER NOT NULL,
+        [data] TEXT NOT NULL,
+        [content_hash] TEXT NULL,
+        [stream_type] TEXT NULL
+    );
+    CREATE INDEX IF NOT EXISTS IX_StreamCache_uuid_stream_type_timestamp
+        ON [StreamCache] (uuid, stream_type, timestamp, id);
+    CREATE INDEX IF NOT EXISTS IX_StreamCache_uuid_timestamp
+        ON [StreamCache] (uuid, timestamp, id);
+
+    CREATE TABLE IF NOT EXISTS [Limit] (
+        [id] INTEGER PRIMARY KEY AUTOINCREMENT,
+        [uuid] TEXT NOT NULL REFERENCES [Authorization] (uuid) ON DELETE CASCADE,
+        [last_called_on] INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS [View] (
+        [id] INTEGER PRIMARY KEY AUTOINCREMENT,
+        [name] TEXT NOT NULL,
+        [definition] TEXT NOT NULL
+    );
+"""
+
+
+def enable_foreign_keys(conn):
+    "SQLite leaves foreign keys (and so ON DELETE CASCADE) off by default."
+    conn.execute('PRAGMA foreign_keys = ON')
+
+
+class DatastoreSQLite(DatastoreSQL):
+    """
+    This is the implementation of DatastoreBase for an embedded SQLite
+    database. The connection string is the path of the database file, or
+    ':memory:' for a private in-memory database.
+
+    Everything but the statements written in T-SQL is inherited from
+    DatastoreSQL. The bucketed value ranges use window functions, and
+    set_oauth_token() and retrieve_inflight_authz() use RETURNING, so SQLite
+    3.35 or newer is needed.
+    """
+    # SQLite's default limits are 999 parameters per statement and 500 rows
+    # in a VALUES list.
+    MAX_PARAMETERS = 999
+    MAX_VALUES_ROWS = 500
+    # Take the write lock up front, as UPDLOCK does for SQL Server.
+    BEGIN_TRANSACTION = 'BEGIN IMMEDIATE'
+    COMMIT_TRANSACTION = 'COMMIT'
+    ROLLBACK_TRANSACTION = 'ROLLBACK'
+
+    BUCKETS = dict(DatastoreSQL.BUCKETS,
+        month="CAST(strftime('%s', ts, 'unixepoch', 'start of month') AS INTEGER)",
+    )
+    NUMERIC_DATA = "CASE WHEN data NOT GLOB '*[^0-9.-]*' AND data GLOB '*[0-9]*' AND data NOT GLOB '?*-*' AND data NOT GLOB '*.*.*' THEN CAST(data AS REAL) END"
+    AGGREGATES = {
+        'last': None,
+        'max': 'MAX(%s)' % NUMERIC_DATA,
+        'min': 'MIN(%s)' % NUMERIC_DATA,
+        'avg': 'AVG(%s)' % NUMERIC_DATA,
+    }
+
+    @classmethod
+    def connect(cls, connection, *args, **kwargs):
+        "This is how we instantiate a DatastoreSQLite object with connection"
+        obj = cls(connection, *args, **kwargs)
+
+        # A single connection, whatever the pool settings say: ':memory:'
+        # databases are per-connection, and SQLite only has one writer at a
+        # time anyway. As every query runs on the one thread, creating the
+        # tables is done before anything else.
+        Registry.DBPOOL = InstrumentedConnectionPool(
+            'sqlite3',
+            obj.config['connection'],
+            check_same_thread=False,
+            isolation_level=None,
+            cp_min=1,
+            cp_max=1,
+            cp_openfun=enable_foreign_keys,
+        )
+        Registry.IMPL = None
+        obj.raw_db = Registry.DBPOOL
+        obj.db = Registry.getConfig()
+
+        obj.raw_db.runWithConnection(
+            lambda conn: conn.executescript(SCHEMA)
+        ).addErrback(log.err)
+
+        return obj
+
+    def limit_query(self, query, num):
+        "Limit a SELECT statement to its first 'num' rows, if 'num' is given."
+        if not num:
+            return query
+        return '%s LIMIT %d' % (query, int(num))
+
+    def upsert_authz(self, row):
+        "The SQL half of set_oauth_token(), with SQLite's upsert for MERGE."
+        def upsert(txn):
+            txn.execute(
+                """
+                INSERT INTO [Authorization] (%s) VALUES (%s)
+                ON CONFLICT (client_name, service_name, user_id) DO UPDATE SET
+                    token = COALESCE(NULLIF(excluded.token, ''), token),
+                    secret = COALESCE(NULLIF(excluded.secret, ''), secret)
+                RETURNING *
+                """ % (
+                    ', '.join(self.AUTHZ_UPSERT_COLUMNS),
+                    ', '.join(['?'] * len(self.AUTHZ_UPSERT_COLUMNS)),
+                ),
+                [row[column] for column in self.AUTHZ_UPSERT_COLUMNS],
+            )
+            return fetch_dicts(txn)[0]
+
+        return self.raw_db.runInteraction(upsert)
+
+    def consume_inflight_authz(self, where):
+        "The SQL half of retrieve_inflight_authz(), with RETURNING for OUTPUT."
+        def consume(txn):
+            txn.execute(
+                'DELETE FROM [InflightAuthorization] WHERE %s RETURNING *' % where[0],
+                where[1:],
+            )
+            return fetch_dicts(txn)
+
+        return self.raw_db.runInteraction(consume)
+
+    def insert_values(self, uuid, timestamp, rows):
+        "The SQL half of write_values(). rows is a list of (method, data)."
+        def insert(txn):
+            for chunk in self.chunk_rows(rows, 2):
+                txn.execute(
+                    """
+                    INSERT INTO [UserData] (uuid, method, timestamp, data)
+                    SELECT ?, v.column1, ?, v.column2
+                    FROM (VALUES %s) AS v
+                    WHERE v.column2 IS NOT (
+                        SELECT data FROM [UserData]
+                        WHERE uuid = ? AND method = v.column1
+                        ORDER BY timestamp DESC LIMIT 1
+                    )
+                    """ % ', '.join(['(?, ?)'] * len(chunk)),
+                    [uuid, timestamp] + list(flatten(chunk)) + [uuid],
+                )
+
+        return self.run_in_transaction(insert)
+
+    def insert_granular_data(self, uuid, method, rows):
+        """The SQL half of write_granular_data(). rows is a list of
+        (item_id, actor_id, timestamp)."""
+        def insert(txn):
+            for chunk in self.chunk_rows(rows, 5):
+                txn.execute(
+                    """
+                    INSERT OR IGNORE INTO [GranularData] (uuid, method, item_id, actor_id, timestamp)
+                    VALUES %s
+                    """ % ', '.join(['(?, ?, ?, ?, ?)'] * len(chunk)),
+                    list(flatten([uuid, method] + row for row in chunk)),
+                )
+
+        return self.run_in_transaction(insert)
+
+    def apply_stream_cache_changes(self, txn, to_add, to_update, to_remove):
+        """The SQL half of update_stream_cache(), run inside its transaction.
+        SQLite can't name the columns of a VALUES list, so the updates are
+        made one row at a time."""
+        super(DatastoreSQLite, self).apply_stream_cache_changes(
+            txn, to_add, [], to_remove,
+        )
+        if to_update:
+            txn.executemany(
+                'UPDATE [StreamCache] SET data = ?, content_hash = ? WHERE id = ?',
+                [[data, content_hash, row_id] for row_id, data, content_hash in to_update],
+            )
@@ -87,6 +87,13 @@ class MissingArgumentError(LightningError):
         self.code = 400
 
 
+class InvalidArgumentError(LightningError):
+    """Error when handlers are given arguments with bad values"""
+    def __init__(self, message, **kwargs):
+        super(InvalidArgumentError, self).__init__(message, **kwargs)
+        self.code = 400
+
+
 class ServiceError(LightningError):
     """Base class for all service-related errors"""
     pass
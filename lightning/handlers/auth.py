@@ -16,8 +16,36 @@ import lightning.service.daemons as daemons
 import logging
 
 class AuthBase(HandlerBase):
-    'Base class for auth handlers. Currently empty'
-    pass
+    'Base class for auth handlers.'
+
+    @defer.inlineCallbacks
+    def purge_user_data(self, uuid):
+        """Delete the data of a deleted authorization. This is queued for the
+        worker (PurgeDaemon) if there's a queue, or else done here, so call
+        it after the response has been sent."""
+        config = self.application.config
+        if self.application.redis:
+            try:
+                from twistedpyres import ResQ
+                yield daemons.PurgeDaemon.enqueue(
+                    {
+                        'environment': config.get('environment'),
+                        'purge_batch_size': config.get('purge_batch_size', 1000),
+                    },
+                    uuid,
+                    resq=ResQ(redis=self.application.redis),
+                )
+            except Exception as e:
+                logging.error('Error trying to queue purge: %s' % e.message)
+            else:
+                defer.returnValue(None)
+
+        try:
+            yield self.application.db.purge_user_data(
+                uuid, batch_size=config.get('purge_batch_size', 1000),
+            )
+        except Exception as e:
+            logging.error('Error purging %s: %s' % (uuid, e))
 
 
 class AuthHandler(AuthBase):
@@ -194,6 +222,11 @@ class AuthOneHandler(AuthBase):
                 client_name=client_name,
                 args=self.arguments(request)
             )
+            authz = yield self.application.db.get_oauth_token(
+                client_name=client_name,
+                service_name=service_name,
+                user_id=user_id,
+            )
             ret = yield self.application.db.delete_oauth_token(
                 client_name=client_name,
                 service_name=service_name,
@@ -204,6 +237,9 @@ class AuthOneHandler(AuthBase):
 
             self.write(request, {'success': 'Revocation successful'})
             self.finish(request)
+
+            if authz:
+                yield self.purge_user_data(authz.uuid)
         except HandlerError as exc:
             self.write(request, error_format(exc.message), exc.code)
             self.finish(request)
@@ -225,26 +261,22 @@ class AuthOneHandler(AuthBase):
 
             # Grab the service.
             service = self.get_service(authz.service_name, request)
-            # Delete the token and call the revocation method.
-            data_ret = yield defer.gatherResults([
-                service.revoke_authorization(
-                    authorization={'token': authz.token},
-                ),
-                self.application.db.delete_user_data(
-                    uuid=guid,
-                    user_id=authz.user_id,
-                    service_name=authz.service_name,
-                ),
-            ])
+            # Call the revocation method and delete the token.
+            yield service.revoke_authorization(
+                authorization={'token': authz.token},
+            )
             ret = yield self.application.db.delete_oauth_token(
                 uuid=guid
             )
 
-            if not ret or not data_ret:
+            if not ret:
                 raise HandlerError('Revocation failed', 404)
 
             self.write(request, {'success': 'Revocation successful'})
             self.finish(request)
+
+            # The data goes once the response is sent, as it can take a while.
+            yield self.purge_user_data(guid)
         except HandlerError as exc:
             self.write(request, error_format(exc.message), exc.code)
             self.finish(request)
@@ -47,12 +47,9 @@ class StatusHandler(StatusBase):
                 raise HandlerError("Duplicate GUIDs '%s' provided" % dupes, 400)
 
             # Retrieve authorizations
-            authorizations = [
-                Authz(uuid=g).get_token(self.application.db).addErrback(handle_db_error) for g in guids
-            ]
-            authorizations = yield defer.DeferredList(authorizations)
-            # DeferredList returns (success, result) tuple, just grab results
-            authorizations = [a[1] for a in authorizations if a[1]]
+            authorizations = yield Authz(uuid=guids).get_token(
+                self.application.db
+            ).addErrback(handle_db_error)
 
             service_names = [a.service_name for a in authorizations]
             services = {s: self.get_service(s, request) for s in service_names}
@@ -81,6 +81,22 @@ class StreamHandlerBase(HandlerBase):
             args['forward'] = (bool)(args['forward'])
             args['stream_type'] = self.stream_type
 
+            # Cached streams can be paged with a cursor ('<timestamp>:<id>')
+            # instead of a timestamp. Asking for one, even an empty one for the
+            # first page, adds the cursor for the next page to the response.
+            use_cursor = 'cursor' in request.args
+            if use_cursor:
+                args['cursor'] = None
+                cursor = self.get_argument(request, 'cursor', '')
+                if cursor:
+                    try:
+                        args['cursor'] = tuple(int(x) for x in cursor.split(':', 1))
+                        args['timestamp'] = args['cursor'][0]
+                    except ValueError:
+                        raise HandlerError("Bad value for 'cursor'", 400)
+                    if len(args['cursor']) != 2:
+                        raise HandlerError("Bad value for 'cursor'", 400)
+
             feed = []
             errors = []
 
@@ -103,16 +119,46 @@ class StreamHandlerBase(HandlerBase):
             # defer.gatherResults() will fail if any of the elements fail. We want to
             # succeed if any of the elements succeed, so use a DeferredList instead.
             yield defer.DeferredList([
-                defer.maybeDeferred(self.get_service(auth.service_name, request).get_feed(
+                defer.maybeDeferred(
+                    self.get_service(auth.service_name, request).get_feed,
                     authorization=auth, **args
-                )).addErrback(handle_error)
+                ).addErrback(handle_error)
                 for auth in authorizations
             ]).addCallback(append_to_feed)
 
-            feed.sort(key=lambda v: int(v['metadata']['timestamp']), reverse=True)
-
-
-            result = {'data': feed[0:args['num']]}
+            if use_cursor:
+                feed.sort(
+                    key=lambda v: (int(v['metadata']['timestamp']), (v.get('_cursor') or (0, 0))[1]),
+                    reverse=True,
+                )
+            else:
+                feed.sort(key=lambda v: int(v['metadata']['timestamp']), reverse=True)
+
+            cursors = [item.pop('_cursor', None) for item in feed]
+
+            if args['forward'] and args.get('cursor'):
+                # Each service returned the items just after the cursor, so
+                # the page is the oldest 'num' of them (still newest first).
+                page = slice(max(len(feed) - args['num'], 0), len(feed))
+            else:
+                page = slice(0, args['num'])
+            result = {'data': feed[page]}
+            if use_cursor:
+                # Going forward, the next page starts after the newest item
+                # (there may be newer ones later, even if the page is short);
+                # going back, it starts before the oldest, if there may be
+                # more. Items from services without a cache have no cursor,
+                # and a page with any of those can't be continued from.
+                page_cursors = cursors[page]
+                result['cursor'] = None
+                if args['forward'] and args.get('cursor') and not page_cursors:
+                    # Nothing newer yet; ask again from the same place.
+                    result['cursor'] = '%s:%s' % args['cursor']
+                elif page_cursors and all(page_cursors):
+                    if args['forward']:
+                        result['cursor'] = '%s:%s' % page_cursors[0]
+                    elif len(page_cursors) >= args['num']:
+                        result['cursor'] = '%s:%s' % page_cursors[-1]
 
             if errors:
                 result['errors'] = errors
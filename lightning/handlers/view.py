@@ -4,7 +4,9 @@ from .base import HandlerBase, HandlerError
 import json
 import logging
 from lightning.error import error_format, LightningError
+from lightning.service.base import ValueMemo
 from twisted.internet import defer
+from twisted.python import log
 from twisted.web.server import NOT_DONE_YET
 
 
@@ -157,9 +159,46 @@ class ViewOneHandler(HandlerBase):
             return super(ViewOneHandler, self).getChild(name, request)
 
 
+class ViewPlan(object):
+    """
+    A view definition with its services and methods resolved for one client,
+    so that invoking the view does no lookups.
+
+    Each step is a dict with the 'service' and 'method' the client asked for,
+    the real 'service_name', and either the bound method to 'call' or the
+    'error' that resolving it raised (which is raised again when the step is
+    invoked, so the response is the same as if it were resolved then).
+    'reads' is the stored value the method returns, if it's a plain
+    present-value method built by Web.api_method().
+    """
+    def __init__(self, definition, handler, request):
+        self.definition = definition
+        self.steps = []
+        for m in definition:
+            step = {
+                'service': m['service'],
+                'method': m['method'],
+                'service_name': handler.decode_client_servicename(m['service'], request),
+                'service_object': None,
+                'call': None,
+                'error': None,
+                'reads': None,
+            }
+            try:
+                step['service_object'] = handler.get_service(m['service'], request)
+                step['call'] = getattr(step['service_object'], m['method'])
+                step['reads'] = getattr(step['call'], 'reads', None)
+            except Exception as exc:
+                step['error'] = exc
+            self.steps.append(step)
+
+
 class ApplyViewHandler(HandlerBase):
     endpoint = r'/view/(\w+)/invoke'
 
+    # How many steps of a view are invoked at once, unless the config says.
+    concurrency = 10
+
     def __init__(self, application, view_name):
         HandlerBase.__init__(self, application)
         self.view_name = view_name
@@ -169,6 +208,70 @@ class ApplyViewHandler(HandlerBase):
         self.invoke_view(request)
         return NOT_DONE_YET
 
+    def get_plan(self, view, request):
+        """Return the ViewPlan of 'view', the definition of this handler's view.
+
+        Plans are cached by the application, by (view name, client name). The
+        datastore hands back the same definition until the view is changed, so
+        a plan is current as long as it was built from the definition
+        get_view() returns.
+        """
+        plans = self.application.view_plans
+        key = (self.view_name, self.get_client_name(request))
+        plan = plans.get(key)
+        if plan is None or plan.definition is not view:
+            plan = ViewPlan(view, self, request)
+            plans.set(key, plan)
+        return plan
+
+    @defer.inlineCallbacks
+    def invoke_step(self, m, authorization, arguments, memo):
+        """Invoke one step of a ViewPlan. Returns (result, errors), where the
+        result is None if the step was skipped."""
+        if not authorization:
+            defer.returnValue((None, [
+                error_format(
+                    'User not authorized',
+                    code=404,
+                    service=m['service'],
+                    method=m['method'],
+                )['error']
+            ]))
+
+        result = None
+        errors = []
+        kwargs = dict(authorization=authorization, arguments=arguments)
+        if m['reads']:
+            kwargs['memo'] = memo
+        try:
+            if m['error']:
+                raise m['error']
+            result = yield m['call'](**kwargs)
+            # Make a live request to get the value if the daemon hasn't
+            # populated it yet.
+            if result is None and m['method'] == 'profile':
+                result = yield self.live_request(
+                    m['service_object'],
+                    m['method'],
+                    authorization=authorization,
+                    arguments=arguments,
+                )
+        except LightningError as exc:
+            errors.append(exc.error_msg['error'])
+        except Exception as exc:
+            errors.append(error_format("%s" % exc)['error'])
+
+        if result is None:
+            result = {}
+        elif isinstance(result, list):
+            # XXX(ray): All results need to return a hash. If you're
+            # thinking of returning an array, key it with "data" in a hash.
+            raise LightningError("Expected dict for view result, got an array")
+        result['service'] = m['service']
+        result['method'] = m['method']
+
+        defer.returnValue((result, errors))
+
     @defer.inlineCallbacks
     def invoke_view(self, request):
         try:
@@ -184,19 +287,23 @@ class ApplyViewHandler(HandlerBase):
 
             # check for duplicate guids
             guid_dups = set()
-            [guid_dups.add(i) for i in guids if i not in guid_dups and guids.count(i) > 1]
+            guids_seen = set()
+            for i in guids:
+                if i in guids_seen:
+                    guid_dups.add(i)
+                guids_seen.add(i)
             if len(guid_dups):
                 raise HandlerError("Duplicate GUIDs '%s' provided" % ','.join(guid_dups), 400)
 
-            authorizations = yield self.application.db.get_oauth_token(
-                uuid=guids,
+            authorizations = yield self.application.db.get_oauth_tokens(
+                guids,
                 client_name=self.get_client_name(request),
             )
 
             # check for guids that share the same service
-            services_seen = []
+            authz_by_service = {}
             for a in authorizations:
-                if a.service_name in services_seen:
+                if a.service_name in authz_by_service:
                     # identify problematic guids for the service
                     service_guid_dups = set()
                     [service_guid_dups.add(i.uuid) for i in authorizations if i.service_name == a.service_name and a.uuid not in service_guid_dups]
@@ -205,62 +312,52 @@ class ApplyViewHandler(HandlerBase):
                         400
                     )
                 else:
-                    services_seen.append(a.service_name)
+                    authz_by_service[a.service_name] = a
+
+            plan = self.get_plan(view, request)
+
+            # Read every stored value the view needs up front, in one query
+            # per authorization, into a memo the steps share. If that fails,
+            # the steps read their own.
+            reads = {}
+            for m in plan.steps:
+                authorization = authz_by_service.get(m['service_name'])
+                if authorization and m['reads']:
+                    reads.setdefault(authorization.uuid, (authorization, set()))[1].add(m['reads'])
+            uuids = reads.keys()
+            values = yield defer.gatherResults([
+                self.application.db.get_values(
+                    authorization=reads[uuid][0], methods=list(reads[uuid][1]),
+                ).addErrback(log.err)
+                for uuid in uuids
+            ])
+            memo = ValueMemo()
+            for uuid, prefetched in zip(uuids, values):
+                if prefetched:
+                    memo.update(uuid, prefetched)
+
+            # Then invoke the steps concurrently, keeping their order.
+            semaphore = defer.DeferredSemaphore(
+                self.application.config.get('view_concurrency', self.concurrency)
+            )
+            arguments = self.arguments(request)
+            outcomes = yield defer.DeferredList([
+                semaphore.run(
+                    self.invoke_step, m, authz_by_service.get(m['service_name']),
+                    arguments, memo,
+                )
+                for m in plan.steps
+            ], consumeErrors=True)
 
-            authz_by_service = {}
             results = []
             errors = []
-            arguments = self.arguments(request)
-            for m in view:
-                result = None
-                l_servicename = self.decode_client_servicename(m['service'], request)
-                if not authz_by_service.get(l_servicename):
-                    # TODO(rob): Find a better algorithm than O(N^2)
-                    for authorization in authorizations:
-                        if authorization.service_name == l_servicename:
-                            authz_by_service[l_servicename] = authorization
-                            break  # Break out of the else clause as well
-                    else:
-                        errors.append(
-                            error_format(
-                                'User not authorized',
-                                code=404,
-                                service=m['service'],
-                                method=m['method'],
-                            )['error']
-                        )
-                        continue
-
-                try:
-                    service = self.get_service(m['service'], request)
-                    result = yield getattr(service, m['method'])(
-                        authorization=authz_by_service[l_servicename],
-                        arguments=arguments,
-                    )
-                    # Make a live request to get the value if the daemon hasn't
-                    # populated it yet.
-                    if result is None and m['method'] == 'profile':
-                        result = yield self.live_request(
-                            service,
-                            m['method'],
-                            authorization=authz_by_service[l_servicename],
-                            arguments=arguments,
-                        )
-                except LightningError as exc:
-                    errors.append(exc.error_msg['error'])
-                except Exception as exc:
-                    errors.append(error_format("%s" % exc)['error'])
-
-                if result is None:
-                    result = {}
-                elif isinstance(result, list):
-                    # XXX(ray): All results need to return a hash. If you're
-                    # thinking of returning an array, key it with "data" in a hash.
-                    raise LightningError("Expected dict for view result, got an array")
-                result['service'] = m['service']
-                result['method'] = m['method']
-
-                results.append(result)
+            for success, outcome in outcomes:
+                if not success:
+                    outcome.raiseException()
+                step_result, step_errors = outcome
+                if step_result is not None:
+                    results.append(step_result)
+                errors.extend(step_errors)
 
             code = 200
             result = {'result': results}
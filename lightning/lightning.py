@@ -10,10 +10,12 @@ from twisted.web import server
 
 import logging
 
-from lightning.datastore.sql import DatastoreSQL
+from lightning.datastore import connect as connect_datastore, options as datastore_options
+from lightning.datastore.cache import LRUCache, ValueCache
 from lightning.messaging import Email
 
 from lightning.server import Request
+from lightning.service import http_pool, rate_limit, response_cache
 from lightning.handlers import ErrorHandler, resource_tree
 from lightning.service.web import WEB_MODULES
 from cyclone import redis
@@ -25,6 +27,9 @@ from twisted.web.resource import Resource
 class Lightning(object):
 
     "The application class for the Lightning service"
+    # The Redis connection pool, unless built with do_connect_redis=False.
+    redis = None
+
     def __init__(self, config, do_connect_redis=True):
         self.email = Email(
             host=config.get(
@@ -56,11 +61,20 @@ class Lightning(object):
         # use. This configuration needs to be hoisted into an environment-level
         # service, such as hiera (provided by Puppet). That will come later.
 
+        http_pool.configure(config)
+        response_cache.configure(config, self.redis)
+        rate_limit.configure(config, self.redis)
         service_args = dict(
             config=config,
             datastore=self.db,
         )
         self.config = config
+        # The compiled plans of the views invoked, by (view name, client
+        # name); see ApplyViewHandler.get_plan().
+        self.view_plans = LRUCache(
+            size=config.get('view_plan_cache_size', 1000),
+            ttl=config.get('view_plan_cache_ttl', 300),
+        )
         self.services = {
             module.name: module(**service_args)
             for module in WEB_MODULES
@@ -101,7 +115,9 @@ class Lightning(object):
         self.site.requestFactory = Request
 
     def shutdown(self):
-        return self.redis.disconnect()
+        http_pool.get_pool().closeCachedConnections()
+        if self.redis is not None:
+            return self.redis.disconnect()
 
 
     @classmethod
@@ -112,10 +128,15 @@ class Lightning(object):
         def on_connect(db):
             'Callback'
             obj.db = db
+            if do_connect_redis and config.get('value_cache'):
+                db.value_cache = ValueCache(
+                    obj.redis, ttl=config.get('value_cache_ttl', 86400),
+                )
             obj.initialize(config)
             return obj
 
         return defer.maybeDeferred(
-            DatastoreSQL.connect,
+            connect_datastore,
             config.get('sql_connection', 'dsn=SQLServer;uid=fakeuser;pwd=fakepassword;database=fakedb;driver={SQL Server Native Client 10.0}'),
+            **datastore_options(config)
         ).addCallback(on_connect)
@@ -9,7 +9,15 @@ class Authz(DatastoreModel):
 
     @defer.inlineCallbacks
     def get_token(self, datastore):
-        """Get the token from the datastore."""
+        """Get the token from the datastore.
+        A list of UUIDs is resolved with a single batched lookup."""
+        if type(getattr(self, 'uuid', None)) == list:
+            authz = yield datastore.get_oauth_tokens(
+                self.uuid,
+                client_name=getattr(self, 'client_name', None),
+                service_name=getattr(self, 'service_name', None),
+            )
+            defer.returnValue(authz)
         authz = yield datastore.get_oauth_token(**self.to_dict())
         defer.returnValue(authz)
 
@@ -1,5 +1,15 @@
 from lightning.model import DatastoreModel
 
 
+def get_stream_type(item_id):
+    """Given a stream item's id, return its stream type: the part of the id
+    before the first ':', e.g. 'photo' for 'photo:1234'. Ids without a
+    prefix have no stream type."""
+    item_id = unicode(item_id)
+    if ':' not in item_id:
+        return None
+    return item_id.split(':', 1)[0]
+
+
 class StreamCache(DatastoreModel):
     TABLENAME = "[StreamCache]"
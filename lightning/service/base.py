@@ -3,6 +3,9 @@ from __future__ import absolute_import
 
 from functools import wraps
 
+from lightning.service.http_pool import get_pool
+from lightning.service.json_stream import count_array
+from lightning.service.response_cache import get_cache as get_response_cache, response_header
 from lightning.service.response_filter import ResponseFilter
 
 from lightning.datastore.sql import DatastoreSQL
@@ -13,10 +16,11 @@ from lightning.error import (
 )
 from lightning.model import LimitedDict
 from lightning.model.authorization import Authz
+from lightning.model.stream_cache import get_stream_type
 from lightning.utils import get_uuid
 
-import cyclone.httpclient
 from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
 from twistedpyres import ResQ
 
 import base64
@@ -28,6 +32,7 @@ import iso8601
 from hashlib import sha1
 import hmac
 from inspect import getmembers
+import itertools
 import json
 from lightning.recorder import recorder
 import logging
@@ -35,7 +40,7 @@ import oauth2
 import os
 import time
 from urllib import urlencode, quote_plus
-from urlparse import parse_qs, urlsplit, urlunsplit
+from urlparse import parse_qs, parse_qsl, urlsplit, urlunsplit
 
 import newrelic.agent
 
@@ -53,8 +58,67 @@ def daemon_log(service_name, uuid, method, message):
     return '(%s %s %s) %s' % (service_name, uuid, method, message)
 
 
+class ValueMemo(object):
+    """
+    Remembers the stored values read while serving one request, so each
+    (uuid, method) is read and decoded once, however many API methods present
+    it (the delegate_to methods of Web.api_method() often share one value).
+    Pass it to present_value(), or to a method built by api_method(), as
+    'memo'.
+
+    Reads of the same value that overlap share one query. Failed reads are
+    not remembered.
+    """
+    def __init__(self):
+        self.values = {}
+        self.pending = {}
+        self.decoded = {}
+
+    def update(self, uuid, values):
+        "Remember 'values', a dict of method => what get_value() returned."
+        for method, value in values.iteritems():
+            self.values[(uuid.rstrip(), method)] = value
+
+    def read(self, uuid, method, fetch):
+        """Return a Deferred firing with the value of uuid/method, calling
+        fetch() to get it (as get_value() would) the first time."""
+        key = (uuid.rstrip(), method)
+        if key in self.values:
+            return defer.succeed(self.values[key])
+
+        d = defer.Deferred()
+        if key in self.pending:
+            self.pending[key].append(d)
+            return d
+        self.pending[key] = [d]
+
+        def fire(result):
+            if not isinstance(result, Failure):
+                self.values[key] = result
+            for waiting in self.pending.pop(key):
+                waiting.callback(result)
+
+        defer.maybeDeferred(fetch).addBoth(fire)
+        return d
+
+    def loads(self, uuid, method, datum):
+        """json.loads() a value once. Dicts are copied, since callers add to
+        what they get back."""
+        key = (uuid.rstrip(), method)
+        if key not in self.decoded:
+            self.decoded[key] = json.loads(datum)
+        ret = self.decoded[key]
+        if isinstance(ret, dict):
+            ret = dict(ret)
+        return ret
+
+
 class Service(object):
     "Base class for Services"
+    # How many pages request_with_paging() keeps in flight for limit/offset
+    # paging. 1 means one page at a time.
+    prefetch_pages = 1
+
     def __init__(self, **kwargs):
         self.environment = kwargs.get('config', {}).get('environment', 'local')
 
@@ -106,20 +170,32 @@ class Service(object):
 
     def parse_response(self, response, **kwargs):
         """Parse the response"""
+        if kwargs.get('with_sum'):
+            # Only the count is wanted, so the items are counted as they're
+            # decoded, rather than decoding the whole response first.
+            # 'num' dict used in parse_response and Default
+            # Must change in both places
+            try:
+                return {'num': count_array(response, kwargs['with_sum'])}
+            except Exception as exc:
+                raise ApiMethodError(exc)
+
         try:
             data = json.loads(response)
         except Exception as exc:
             raise ApiMethodError(exc)
-
-        if kwargs.get('with_sum'):
-            # 'num' dict used in parse_response and Default
-            # Must change in both places
-            data = {'num': sum([1 for x in data.get(kwargs['with_sum'], [])])}
         return data
 
     def actually_request(self, *args, **kwargs):
+        "Make an HTTP request on the shared pool of keep-alive connections."
+        # The authorization is only for the services' limits on their calls.
+        kwargs.pop('authorization', None)
+        headers = kwargs.get('headers') or {}
+        conditional = 'If-None-Match' in headers or 'If-Modified-Since' in headers
+
         def handle_response(resp):
-            if resp.code not in self.good_statuses:
+            # A 304 answers a conditional GET; request() fills in the body.
+            if resp.code not in self.good_statuses and not (resp.code == 304 and conditional):
                 self.parse_error(
                     resp.code,
                     resp.request.url,
@@ -128,15 +204,78 @@ class Service(object):
                 )
             return resp
 
-        return cyclone.httpclient.fetch(*args, **kwargs).addCallback(handle_response)
+        return get_pool().fetch(*args, **kwargs).addCallback(handle_response)
+
+    def response_cache_key(self, url, authorization):
+        """The key a GET's response is cached under: the authorization's uuid
+        and the URL, with its query arguments sorted, and those that carry
+        the token or sign the request (so change every time) left out."""
+        parsed_url = urlsplit(url)
+        args = sorted(
+            (key, value) for key, value in parse_qsl(parsed_url.query, keep_blank_values=True)
+            if not key.startswith('oauth_') and key != getattr(self, 'token_param', 'access_token')
+        )
+        normalized = urlunsplit([
+            parsed_url.scheme.lower(), parsed_url.netloc.lower(),
+            parsed_url.path, urlencode(args), '',
+        ])
+        return '%s:%s' % (authorization.uuid.rstrip(), sha1(normalized).hexdigest())
 
     def request(self, **kwargs):
         "This does all the heavy lifting for doing a web request."
 
-        def handle_response(response):
+        # GETs made for an authorization are revalidated with the ETag and
+        # Last-Modified of the last response, if there's a response cache.
+        cache = get_response_cache()
+        cache_key = None
+        if cache and kwargs.get('method', 'GET') == 'GET' and kwargs.get('authorization'):
+            cache_key = self.response_cache_key(kwargs['url'], kwargs['authorization'])
+
+        def send(cached):
+            headers = kwargs.get('headers', dict())
+            if cached:
+                headers = dict(headers)
+                if cached['etag']:
+                    headers['If-None-Match'] = [cached['etag']]
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = [cached['last_modified']]
+            return self.actually_request(
+                url=kwargs['url'], headers=headers,
+                method=kwargs.get('method', 'GET'),
+                postdata=kwargs.get('body'),
+                authorization=kwargs.get('authorization'),
+            ).addCallback(revalidate, cached)
+
+        def revalidate(response, cached):
+            if cached and response.code == 304:
+                response.code = 200
+                response.body = cached['body']
+                return handle_response(response, cached)
+
+            entry = None
+            if cache_key and response.code == 200:
+                entry = {
+                    'etag': response_header(response.headers, 'ETag'),
+                    'last_modified': response_header(response.headers, 'Last-Modified'),
+                    'body': response.body,
+                }
+                if not (entry['etag'] or entry['last_modified']):
+                    entry = None
+            ret = handle_response(response, entry)
+            if entry:
+                cache.set(cache_key, entry)
+            return ret
+
+        def handle_response(response, entry=None):
+            """Parse the response, keeping what was parsed in 'entry' (its
+            cache entry, if any), or taking it from there if it's been done."""
             if kwargs.get('no_parse'):
                 return response
-            return self.parse_response(response.body, **kwargs)
+            if entry is None or kwargs.get('with_sum'):
+                return self.parse_response(response.body, **kwargs)
+            if 'parsed' not in entry:
+                entry['parsed'] = self.parse_response(response.body, **kwargs)
+            return entry['parsed']
 
         def handle_error(failure):
             """Handle RefreshTokenError from actually_request.
@@ -152,11 +291,11 @@ class Service(object):
             """
             return self.request(**request_args)
 
-        return self.actually_request(
-            url=kwargs['url'], headers=kwargs.get('headers', dict()),
-            method=kwargs.get('method', 'GET'),
-            postdata=kwargs.get('body'),
-        ).addCallback(handle_response).addErrback(handle_error)
+        if cache_key:
+            d = cache.get(cache_key)
+        else:
+            d = defer.succeed(None)
+        return d.addCallback(send).addErrback(handle_error)
 
     def transform_paged_response(self, resp):
         """Take the response and tranform it in some way, such as extracting out relevant fields.
@@ -185,6 +324,9 @@ class Service(object):
 
         stopback = kwargs.get('stopback', lambda: False)
         use_limit_offset_paging = 'offset_field' in kwargs and 'limit_field' in kwargs
+        prefetch = kwargs.pop('prefetch', self.prefetch_pages)
+        if use_limit_offset_paging and prefetch > 1:
+            return self.request_with_prefetch(path, callback, prefetch, **kwargs)
         if use_limit_offset_paging:
             # Handle limit/offset and page/per_page paging.  Relevant fields are:
             # offest_field - the name of the field  that we send the offset via.  This controls
@@ -250,6 +392,42 @@ class Service(object):
 
         return self.request(path=path, **kwargs).addCallback(collect_data).addCallback(pager)
 
+    @defer.inlineCallbacks
+    def request_with_prefetch(self, path, callback, prefetch, **kwargs):
+        """
+        request_with_paging() for limit/offset paging, with up to 'prefetch'
+        pages requested at once. The callback still gets the pages one at a
+        time, in order.
+
+        A page shorter than the limit is taken to be the last one. Once it
+        (or stopback()) is seen, no more pages are requested, and the pages
+        already requested past it are waited for and thrown away.
+        """
+        stopback = kwargs.get('stopback', lambda: False)
+        offsets = itertools.count(kwargs['starting_offset'], kwargs['offset_increase'])
+        pages = []
+
+        def request_page():
+            args = dict(kwargs.get('args') or {})
+            args[kwargs['limit_field']] = kwargs['limit']
+            args[kwargs['offset_field']] = next(offsets)
+            pages.append(self.request(path=path, **dict(kwargs, args=args)))
+
+        for i in range(prefetch):
+            request_page()
+        try:
+            while pages:
+                resp = yield pages.pop(0)
+                resp = self.transform_paged_response(resp)
+                data = self.extract_data_array(resp, data_name=kwargs['data_name'])
+                yield defer.maybeDeferred(callback, data)
+                if stopback() or len(data) < kwargs['limit']:
+                    break
+                request_page()
+        finally:
+            if pages:
+                yield defer.DeferredList(pages, consumeErrors=True)
+
     def get_authorized_full_url(self, url, **kwargs):
         """Take a fully qualified url without oauth parameters and return the same url with the relevant
         auth parameters appended"""
@@ -285,7 +463,13 @@ class Service(object):
             raise ServiceError(msg, service=self.name)
 
     def present_value(self, method_name, **kwargs):
-        'Do the work for a present-value method'
+        """Do the work for a present-value method
+
+        If a ValueMemo is given as 'memo', the value is read and decoded
+        through it, so it's done once per request.
+        """
+        memo = kwargs.get('memo')
+        authorization = kwargs['authorization']
 
         def handle_data(data):
             if len(data) <= 0:
@@ -301,7 +485,9 @@ class Service(object):
                 # TODO (ray): Tone this exception down once we figure out the
                 # root of the problem.
                 try:
-                    if datum:
+                    if datum and memo:
+                        ret = memo.loads(authorization.uuid, method_name, datum)
+                    elif datum:
                         ret = json.loads(datum)
                     else:
                         return
@@ -317,13 +503,22 @@ class Service(object):
 
             return ret
 
-        return self.datastore.get_value(
-            authorization=kwargs['authorization'],
-            method=method_name,
-        ).addCallback(handle_data)
+        def get_value():
+            return self.datastore.get_value(
+                authorization=authorization,
+                method=method_name,
+            )
+
+        if memo:
+            return memo.read(authorization.uuid, method_name, get_value).addCallback(handle_data)
+        return get_value().addCallback(handle_data)
 
     def interval_value(self, method_name, key_name, **kwargs):
-        'Do the work for a interval-value method'
+        """Do the work for a interval-value method
+
+        The optional 'bucket' (hour, day, week or month) and 'agg' (last,
+        max, min or avg) arguments return one value per bucket instead of
+        every value."""
         self.ensure_arguments(['start', 'end'], kwargs.get('arguments', {}))
 
         def handle_data(data):
@@ -340,6 +535,8 @@ class Service(object):
             method=method_name,
             start=kwargs['arguments']['start'],
             end=kwargs['arguments']['end'],
+            bucket=kwargs['arguments'].get('bucket'),
+            agg=kwargs['arguments'].get('agg'),
         ).addCallback(handle_data)
 
     def granular_value(self, method_name, key_name, **kwargs):
@@ -523,6 +720,8 @@ class Daemon(object):
                     daemon_method=method,
                     timestamp=int(time.time()),
                 )
+                # The job isn't done until what it wrote is stored.
+                yield cls.datastore.sync(uuid)
             except RateLimitError as exc:
                 logging.error(daemon_log(service.name, uuid, method, "Rate limited - enqueue at %s" % exc.retry_at))
                 skip_enqueue = True  # Don't enqueue twice.
@@ -637,6 +836,17 @@ class Daemon(object):
             feed_type=kwargs.get('feed_type'),
         )
 
+    def write_data(self, values, **kwargs):
+        """
+        Write many data at once. 'values' is a dict of method => data.
+        This must return a Deferred so that others can yield on it.
+        """
+        return self.datastore.write_values(
+            uuid=kwargs['authorization'].uuid,
+            timestamp=kwargs['timestamp'],
+            values=values,
+        )
+
 def service_class(cls):
     """
     Sets the _methods attribute on the class to a dict with keys being methods
@@ -670,15 +880,16 @@ def check_account_created_timestamp(func):
 
     @wraps(func)
     @defer.inlineCallbacks
-    def real_decorator(*args, **kwargs):
+    def real_decorator(self, *args, **kwargs):
         if kwargs['authorization'].account_created_timestamp:
             defer.returnValue({
                 'timestamp': kwargs['authorization'].account_created_timestamp
             })
         else:
-            resp = yield func(*args, **kwargs)
+            resp = yield func(self, *args, **kwargs)
             kwargs['authorization'].account_created_timestamp = resp['timestamp']
             yield kwargs['authorization'].save()
+            self.datastore.invalidate_oauth_token(kwargs['authorization'])
             defer.returnValue(resp)
 
     return real_decorator
@@ -960,6 +1171,9 @@ class Web(object):
 
         _call.api = 'GET'
         _call.__doc__ = present
+        # The stored value this reads. Callers that know it can read it ahead
+        # of time, and pass a ValueMemo.
+        _call.reads = delegate_to or method_name
         setattr(cls, method_name, _call)
         cls._methods['GET'][method_name] = present
         cls._writable[method_name] = key_name
@@ -1108,6 +1322,8 @@ class StreamCachedService:
                         proto['metadata']['is_echo'] = 1
 
                     if kwargs['echo'] >= proto['metadata']['is_echo']:
+                        if 'cursor' in kwargs:
+                            proto['_cursor'] = (post['timestamp'], post['id'])
                         posts.append(proto)
 
         def return_posts(ign):
@@ -1119,8 +1335,13 @@ class StreamCachedService:
             'stream_type': kwargs['stream_type']
         }
 
+        if kwargs.get('cursor'):
+            if kwargs.get('forward'):
+                args['after'] = kwargs['cursor']
+            else:
+                args['before'] = kwargs['cursor']
         # most_recent_activity doesn't provide a timestamp
-        if kwargs.get('timestamp'):
+        elif kwargs.get('timestamp'):
             if kwargs.get('forward'):
                 args['start'] = kwargs['timestamp']
             else:
@@ -1164,6 +1385,7 @@ class StreamCachedService:
                 entry['data'] = parsed_post
                 entry['item_id'] = entry['data']['metadata']['post_id']
                 entry['timestamp'] = entry['data']['metadata']['timestamp']
+                entry['stream_type'] = get_stream_type(entry['item_id'])
                 entries.append(entry)
 
             # save them
@@ -1283,6 +1505,7 @@ class GoogleService(ServiceOAuth2):
         response = json.loads(resp.body)
         kwargs['authorization'].token = response['access_token']
         yield kwargs['authorization'].save()
+        self.datastore.invalidate_oauth_token(kwargs['authorization'])
 
         token = kwargs['authorization'].token
         kwargs['args'][self.token_param] = token
@@ -261,12 +261,11 @@ class BloggerDaemon(Blogger, Daemon):
                 num['pages'] += pages.get('totalItems', 0)
 
             # Add deferreds to save the results we can get directly
-            results_to_gather = [self.write_datum(method=method, data=datum, **kwargs)
-                                 for method, datum in {
-                                 'num_posts': num['posts'],
-                                 'num_blogs': num['blogs'],
-                                 'num_pages': num['pages'],
-                                 }.iteritems()]
+            results_to_gather = [self.write_data({
+                'num_posts': num['posts'],
+                'num_blogs': num['blogs'],
+                'num_pages': num['pages'],
+            }, **kwargs)]
 
             # Add deferred to save the comments, which we need to get from a different,
             # dependent endpoint
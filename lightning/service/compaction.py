@@ -0,0 +1,123 @@
+"""
+The job that keeps UserData from growing forever, by downsampling old values.
+"""
+from __future__ import absolute_import
+
+from twisted.internet import defer
+
+from datetime import timedelta, datetime
+from uuid import uuid4
+import logging
+import time
+
+# Values older than 7 days are kept hourly, and older than 90 days daily.
+DEFAULT_POLICY = [[7, 'hour'], [90, 'day']]
+
+
+class CompactionDaemon(object):
+    """
+    A pyres job, run by the worker like the service daemons, that downsamples
+    the UserData of every authorization according to the 'user_data_rollup'
+    policy in the config: a list of [age in days, bucket] pairs. Values older
+    than each age are reduced to one per bucket, oldest data coarsest.
+
+    Each run also purges the data left behind by deleted authorizations
+    whose PurgeDaemon job didn't run (see purge_orphaned_data()).
+
+    Each run enqueues the next one, a day later. Start the cycle with
+    CompactionDaemon.start(config, resq). Each cycle has an id, and the one
+    in Redis (CYCLE_KEY) is the one that runs: starting a cycle again
+    replaces the one already going rather than adding a second.
+    """
+
+    queue = 'Service'
+    _delay = timedelta(days=1)
+    CYCLE_KEY = 'lightning:compaction:cycle'
+
+    @classmethod
+    def start(cls, config, resq):
+        'Start a cycle of daily runs, now, in place of any cycle already going.'
+        cycle = str(uuid4())
+        return resq.redis.set(cls.CYCLE_KEY, cycle).addCallback(
+            lambda ign: resq.enqueue_at(datetime.now(), cls, config, cycle)
+        )
+
+    @classmethod
+    @defer.inlineCallbacks
+    def perform(cls, config, cycle=None):
+        """Perform a queued job from pyres.
+
+        Args:
+            config: A dict containing the config for Lightning.
+            cycle: The id of the cycle this run belongs to.
+        """
+        try:
+            current = yield cls.resq.redis.get(cls.CYCLE_KEY)
+        except Exception as exc:
+            # Better to run than to let the cycle die.
+            logging.error("Compaction: can't check the cycle: %s" % exc)
+            current = cycle
+        if current != cycle:
+            logging.info('Compaction: cycle %s was replaced by %s, stopping' % (cycle, current))
+            defer.returnValue(None)
+
+        try:
+            yield cls.compact(config)
+            deleted = yield cls.datastore.purge_orphaned_data(
+                batch_size=config.get('purge_batch_size', 1000),
+            )
+            logging.info('Compaction: purged orphaned data, %s' % deleted)
+        except Exception as exc:
+            import traceback
+            logging.error("Compaction Error: %s" % exc.message)
+            logging.error(traceback.format_exc())
+        finally:
+            yield cls.enqueue(config, cycle=cycle)
+
+    @classmethod
+    @defer.inlineCallbacks
+    def compact(cls, config, now=None):
+        """Apply the rollup policy to the UserData of every authorization.
+        The authorizations are read by id, 'batch_size' at a time."""
+        now = int(now or time.time())
+        policy = config.get('user_data_rollup') or DEFAULT_POLICY
+        batch_size = config.get('user_data_rollup_batch_size', 1000)
+        query = cls.datastore.limit_query(
+            'SELECT id, uuid FROM [Authorization] WHERE id > ? ORDER BY id',
+            batch_size,
+        )
+
+        last_id = 0
+        count = 0
+        deleted = 0
+        while True:
+            rows = yield cls.datastore.raw_db.runQuery(query, [last_id])
+            for row_id, uuid in rows:
+                for days, bucket in sorted(policy):
+                    deleted += yield cls.datastore.compact_user_data(
+                        uuid=uuid,
+                        before=now - int(days) * 86400,
+                        bucket=bucket,
+                        batch_size=batch_size,
+                    )
+            count += len(rows)
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1][0]
+        logging.info('Compaction: deleted %d UserData rows for %d authorizations' % (
+            deleted, count,
+        ))
+        defer.returnValue(deleted)
+
+    @classmethod
+    def enqueue(cls, config, datetime=None, cycle=None):
+        'Enqueue a scheduled entry into pyres'
+        if datetime is None:
+            datetime = cls.delayed_datetime()
+
+        return cls.resq.enqueue_at(datetime, cls, config, cycle)
+
+    @classmethod
+    def delayed_datetime(cls):
+        'Overridable method to determine how long to wait for the job'
+        return datetime.now() + cls._delay
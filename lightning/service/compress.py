@@ -0,0 +1,68 @@
+"""
+The job that re-encodes the JSON stored before compression was turned on.
+"""
+from __future__ import absolute_import
+
+from lightning.error import SQLError
+
+from twisted.internet import defer
+
+from datetime import timedelta, datetime
+import logging
+
+# The tables to migrate, in order.
+TABLES = ['UserData', 'StreamCache']
+
+
+class CompressDaemon(object):
+    """
+    A pyres job, run by the worker like the service daemons, that compresses
+    the existing rows of UserData and then StreamCache (see codec.py). Each
+    run does a few batches, walking the table by id, then enqueues the next
+    run to carry on from where it stopped, so other jobs aren't held up.
+    Start it once with `worker ENVIRONMENT --compress`.
+    """
+
+    queue = 'Service'
+    _delay = timedelta(minutes=15)
+    batches_per_run = 20
+
+    @classmethod
+    @defer.inlineCallbacks
+    def perform(cls, config, table='UserData', after_id=0):
+        """Perform a queued job from pyres.
+
+        Args:
+            config: A dict containing the config for Lightning.
+            table: The table being migrated.
+            after_id: The id of the last row already migrated.
+        """
+        compressed = 0
+        try:
+            for i in range(cls.batches_per_run):
+                after_id, count = yield cls.datastore.compress_stored_data(
+                    table, after_id, batch_size=config.get('compress_batch_size', 500),
+                )
+                compressed += count
+                if after_id is None:
+                    break
+        except SQLError as exc:
+            logging.error('Compress %s: SQL Error %s - enqueueing again' % (table, exc.message))
+            yield cls.enqueue(config, table, after_id, cls.delayed_datetime())
+            defer.returnValue(None)
+
+        logging.info('Compress %s: compressed %d rows, up to id %s' % (table, compressed, after_id))
+        if after_id is not None:
+            yield cls.enqueue(config, table, after_id)
+        elif TABLES.index(table) + 1 < len(TABLES):
+            yield cls.enqueue(config, TABLES[TABLES.index(table) + 1], 0)
+
+    @classmethod
+    def enqueue(cls, config, table, after_id, when=None, resq=None):
+        'Enqueue a scheduled entry into pyres, to run right away by default'
+        return (resq or cls.resq).enqueue_at(when or datetime.now(), cls, config, table, after_id)
+
+    @classmethod
+    def delayed_datetime(cls):
+        'Overridable method to determine how long to wait for the job'
+        return datetime.now() + cls._delay
@@ -0,0 +1,129 @@
+"""
+Limits on how many calls to an upstream API a process has running at once.
+"""
+from __future__ import absolute_import
+
+from collections import deque, OrderedDict
+from functools import wraps
+from twisted.internet import defer, reactor
+
+import logging
+
+# name => the FairLimiter of each max_simultaneous_calls(), for stats().
+LIMITERS = {}
+
+
+class FairLimiter(object):
+    """
+    Runs at most 'limit' calls at once. The rest wait in a queue per key
+    (a uuid, say) and are started as soon as a call finishes, taking a turn
+    from each key in rotation, so one key with many calls waiting can't keep
+    the others waiting behind all of them.
+    """
+    def __init__(self, limit, reactor=reactor):
+        self.limit = limit
+        self.reactor = reactor
+        self.active = 0
+        # key => deque of (Deferred, when it was queued), in the order the
+        # keys take their turns.
+        self.queues = OrderedDict()
+        self.waiting = 0
+        self.calls = 0
+        self.delayed = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+        self.max_waiting = 0
+
+    def acquire(self, key=None):
+        "Return a Deferred firing once a call for key can start."
+        self.calls += 1
+        if self.active < self.limit:
+            self.active += 1
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.queues.setdefault(key, deque()).append((d, self.reactor.seconds()))
+        self.waiting += 1
+        self.delayed += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        return d
+
+    def release(self):
+        "Finish a call, and start the next one waiting, if any."
+        if not self.queues:
+            self.active -= 1
+            return
+        # The call's slot is handed straight to the next key's first waiter,
+        # and that key goes to the back of the line.
+        key, queue = self.queues.popitem(last=False)
+        d, queued_at = queue.popleft()
+        if queue:
+            self.queues[key] = queue
+        self.waiting -= 1
+        wait = self.reactor.seconds() - queued_at
+        self.waited += wait
+        self.max_wait = max(self.max_wait, wait)
+        d.callback(None)
+
+    def run(self, key, f, *args, **kwargs):
+        "Call f(*args, **kwargs) once a call for key can start."
+        def call(ign):
+            return defer.maybeDeferred(f, *args, **kwargs).addBoth(finish)
+
+        def finish(result):
+            self.release()
+            return result
+
+        return self.acquire(key).addCallback(call)
+
+    def stats(self):
+        """
+        Return how many calls are running and waiting now, and how many have
+        been made, how many of those had to wait, for how many seconds in
+        all and at most, and the most that have been waiting at once.
+        """
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'waiting': self.waiting,
+            'calls': self.calls,
+            'delayed': self.delayed,
+            'waited': self.waited,
+            'max_wait': self.max_wait,
+            'max_waiting': self.max_waiting,
+        }
+
+
+def stats():
+    "Return the stats of every max_simultaneous_calls() limiter, by name."
+    return dict((name, limiter.stats()) for name, limiter in LIMITERS.items())
+
+
+def log_stats():
+    for name, limiter_stats in sorted(stats().items()):
+        logging.info('Concurrency limit %s: %s' % (name, limiter_stats))
+
+
+def max_simultaneous_calls(simul_calls, fair=True):
+    """
+    Decorate a function returning a Deferred so that at most 'simul_calls'
+    of its calls run at once in this process. Calls over the limit wait
+    their turn, starting the moment a running call finishes. If 'fair', the
+    turns go round the uuids of the calls' 'authorization' keyword
+    arguments, calls without one sharing a turn.
+    """
+    def limit_decorator(fn):
+        limiter = FairLimiter(simul_calls)
+        LIMITERS['%s.%s' % (fn.__module__, fn.__name__)] = limiter
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = None
+            authorization = kwargs.get('authorization')
+            if fair and authorization:
+                key = authorization.uuid.rstrip()
+            return limiter.run(key, fn, *args, **kwargs)
+
+        wrapper.limiter = limiter
+        return wrapper
+
+    return limit_decorator
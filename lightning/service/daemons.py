@@ -2,6 +2,8 @@
 from __future__ import absolute_import
 
 from .blogger import BloggerDaemon
+from .compaction import CompactionDaemon
+from .compress import CompressDaemon
 from .etsy import EtsyDaemon
 from .facebook import FacebookDaemon
 from .flickr import FlickrDaemon
@@ -9,6 +11,7 @@ from .foursquare import FoursquareDaemon
 from .github import GitHubDaemon
 from .googleplus import GooglePlusDaemon
 from .instagram import InstagramDaemon
+from .purge import PurgeDaemon
 #from .linkedin import LinkedInDaemon # LinkedIn has no daemon implementation due to data storage rules in TOS
 from .reddit import RedditDaemon
 from .runkeeper import RunKeeperDaemon
@@ -23,6 +26,8 @@ from .loopback import LoopbackDaemon
 
 DAEMONS = dict(
     BloggerDaemon=BloggerDaemon,
+    CompactionDaemon=CompactionDaemon,
+    CompressDaemon=CompressDaemon,
     EtsyDaemon=EtsyDaemon,
     FacebookDaemon=FacebookDaemon,
     FlickrDaemon=FlickrDaemon,
@@ -30,6 +35,7 @@ DAEMONS = dict(
     GitHubDaemon=GitHubDaemon,
     GooglePlusDaemon=GooglePlusDaemon,
     InstagramDaemon=InstagramDaemon,
+    PurgeDaemon=PurgeDaemon,
     RedditDaemon=RedditDaemon,
     RunKeeperDaemon=RunKeeperDaemon,
     SoundCloudDaemon=SoundCloudDaemon,
@@ -10,8 +10,8 @@ from lightning.service.base import (
 
 from lightning.error import Error, AuthError, LightningError
 from lightning.model.authorization import Authz
-from lightning.model.limit import Limit
 from lightning.model.stream_event import StreamEvent, StreamType
+from lightning.service.rate_limit import request_rate
 from lightning.utils import build_full_name, create_post_id
 import logging
 from twisted.internet import defer
@@ -89,7 +89,8 @@ class Etsy(ServiceOAuth1):
         self.start_time = time.time()
 
 
-    @Limit.request_rate(1, every='second')
+    # Etsy allows each app 10 calls a second.
+    @request_rate(1, every='second', per_app=10)
     def request(self, *args, **kwargs):
 
         from pprint import pformat
@@ -284,13 +285,10 @@ class EtsyDaemon(Etsy, StreamCachedService, Daemon):
                 # If we have no feedback, make the percentage score 0 instead of null
                 score = feedback.get('score', 0) or 0
 
-                return defer.gatherResults([
-                        self.write_datum(method=method, data=datum, **kwargs)
-                        for method, datum in {
-                            'positive_feedback_percentage': score,
-                            'num_feedback': feedback.get('count', 0),
-                        }.iteritems()
-                ]).addCallback(lambda ign: None)
+                return self.write_data({
+                    'positive_feedback_percentage': score,
+                    'num_feedback': feedback.get('count', 0),
+                }, **kwargs).addCallback(lambda ign: None)
 
         return self.request(path='users/__SELF__', **kwargs).addCallback(write_values)
 
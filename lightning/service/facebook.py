@@ -10,8 +10,8 @@ from lightning.service.base import (
 
 from lightning.error import Error, AuthError, LightningError, InsufficientPermissionsError
 from lightning.model.authorization import Authz
-from lightning.model.limit import Limit
 from lightning.model.stream_event import StreamEvent, StreamType
+from lightning.service.concurrency import max_simultaneous_calls
 from lightning.utils import get_state_abbreviation, get_youtube_video_id
 
 from twisted.internet import defer
@@ -105,7 +105,7 @@ class Facebook(ServiceOAuth2):
             },
         }
 
-    @Limit.max_simultaneous_calls(10)
+    @max_simultaneous_calls(10)
     def actually_request(self, *args, **kwargs):
         return super(Facebook, self).actually_request(*args, **kwargs)
 
@@ -484,14 +484,11 @@ class FacebookDaemon(Facebook, Daemon):
                     num[x] += item.get('%s_info' % x, {}).get('%s_count' % x, 0)
 
         def write_values(_):
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_photos_uploaded': num['total'],
-                    'num_likes_photos': num['like'],
-                    'num_comments_photos': num['comment'],
-                }.iteritems()
-            ])
+            return self.write_data({
+                'num_photos_uploaded': num['total'],
+                'num_likes_photos': num['like'],
+                'num_comments_photos': num['comment'],
+            }, **kwargs)
 
         # fql_request() automatically adds "with_sum='data'"
         return self.request_with_paging(
@@ -571,16 +568,14 @@ class FacebookDaemon(Facebook, Daemon):
             if not len(data):
                 raise NotImplementedError
 
-            return defer.gatherResults([
-                # id, fromid, time, text
-                self.datastore.write_granular_datum(
-                    method='comment',
+            # id, fromid, time, text
+            return self.datastore.write_granular_data([
+                dict(
                     item_id=datum['id'],
                     actor_id=datum['fromid'],
                     timestamp=datum['time'],
-                    authorization=kwargs['authorization'],
                 ) for datum in data
-            ])
+            ], method='comment', authorization=kwargs['authorization'])
 
         def handle_results(results):
             data = results.get('data', [])
@@ -152,19 +152,16 @@ class FoursquareDaemon(Daemon, Foursquare):
         def write_additional_values(data):
             user = data['response']['user']
             # Write some counts ourselves.
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_friends': user.get('friends', {})['count'],
-                    'num_checkins': user.get('checkins', {})['count'],
-                    'num_mayorships': user.get('mayorships', {})['count'],
-                    'num_photos': user.get('photos', {})['count'],
-                    'num_lists': sum([
-                        item['count']
-                        for item in user.get('lists', {}).get('groups', [{}])
-                    ]),
-                }.iteritems()
-            ]).addCallback(lambda ign: None)
+            return self.write_data({
+                'num_friends': user.get('friends', {})['count'],
+                'num_checkins': user.get('checkins', {})['count'],
+                'num_mayorships': user.get('mayorships', {})['count'],
+                'num_photos': user.get('photos', {})['count'],
+                'num_lists': sum([
+                    item['count']
+                    for item in user.get('lists', {}).get('groups', [{}])
+                ]),
+            }, **kwargs).addCallback(lambda ign: None)
 
         return self.request(
             path='users/self',
@@ -32,6 +32,9 @@ class GitHub(ServiceOAuth2):
         http://developer.github.com/v3/
     """
     name = 'github'
+    # Repos and gists are paged by page number, so the next pages can be
+    # requested before the current one arrives.
+    prefetch_pages = 4
 
 
     def __init__(self, *args, **kwargs):
@@ -199,13 +202,10 @@ class GitHubDaemon(Daemon, StreamCachedService, GitHub):
                 num['watchers'] += repo.get('watchers', 0)
 
         def write_values(_):
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_forks': num['forks'],
-                    'num_watchers': num['watchers']
-                }.iteritems()
-           ])
+            return self.write_data({
+                'num_forks': num['forks'],
+                'num_watchers': num['watchers']
+            }, **kwargs)
 
 
         return self.request_with_paging(path='user/repos', callback=add_repo_stats, **kwargs) \
@@ -234,16 +234,13 @@ class GitHubDaemon(Daemon, StreamCachedService, GitHub):
         def write_values(user):
 
             # Write some counts.
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_public_repos': user['public_repos'],
-                    'num_public_gists': user['public_gists'],
-                    'num_following': user['following'],
-                    'num_followers': user['followers'],
-
-                }.iteritems()
-            ]).addCallback(lambda ign: None)
+            return self.write_data({
+                'num_public_repos': user['public_repos'],
+                'num_public_gists': user['public_gists'],
+                'num_following': user['following'],
+                'num_followers': user['followers'],
+
+            }, **kwargs).addCallback(lambda ign: None)
 
         return self.request(path='user', **kwargs).addCallback(write_values)
 
@@ -0,0 +1,194 @@
+"""
+The pool of persistent HTTP connections the services make their requests on.
+"""
+from __future__ import absolute_import
+
+from cyclone.escape import utf8
+from cyclone.httpclient import HTTPClient, Receiver
+from twisted.internet import defer, reactor
+from twisted.web.client import Agent, HTTPConnectionPool, WebClientContextFactory
+from twisted.web.http_headers import Headers
+
+from urlparse import urlsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class HostContextFactory(WebClientContextFactory):
+    """
+    Makes one SSL context per host and reuses it for every connection to
+    that host, rather than building a new one each time.
+    """
+    def __init__(self):
+        self.contexts = {}
+
+    def getContext(self, hostname, port):
+        key = (hostname, port)
+        if key not in self.contexts:
+            self.contexts[key] = WebClientContextFactory.getContext(self, hostname, port)
+        return self.contexts[key]
+
+
+class PooledHTTPClient(HTTPClient):
+    """
+    cyclone's HTTPClient, but making its requests with 'agent' rather than
+    the module-level Agent that cyclone.httpclient.fetch() always uses.
+    """
+    def __init__(self, agent, url, *args, **kwargs):
+        HTTPClient.__init__(self, url, *args, **kwargs)
+        self.agent = agent
+
+    @defer.inlineCallbacks
+    def fetch(self):
+        request_headers = Headers(self.headers)
+        response = yield self.agent.request(
+            self.method, self.url, request_headers, self.body_producer,
+        )
+
+        redirects = self.maxRedirects
+        while redirects >= 1 and self.followRedirect and response.code in (301, 302, 303):
+            redirects -= 1
+            location = response.headers.getRawHeaders('Location')
+            if not location:
+                break
+            # The body has to be read for the connection to be reused.
+            d = defer.Deferred()
+            response.deliverBody(Receiver(d))
+            yield d
+            response = yield self.agent.request(
+                'GET', location[0], request_headers, self.body_producer,
+            )
+
+        response.error = None
+        response.headers = dict(response.headers.getAllRawHeaders())
+        # 204 and 304 responses have no body.
+        if response.code in (204, 304):
+            response.body = ''
+        else:
+            d = defer.Deferred()
+            response.deliverBody(Receiver(d))
+            response.body = yield d
+        response.request = self
+        defer.returnValue(response)
+
+
+class HostConnectionPool(HTTPConnectionPool):
+    """
+    An HTTPConnectionPool of keep-alive connections, with a limit on the
+    requests made to each host at once and counters for each host.
+
+    * max_per_host - the most requests to one host at a time. Others wait
+      their turn. This many idle connections are kept for each host.
+    * idle_timeout - close idle connections after this many seconds.
+    * connect_timeout - give up connecting after this many seconds.
+
+    fetch() is cyclone.httpclient.fetch() on the pool, and stats() reports
+    the counters for each host.
+    """
+    def __init__(self, reactor=reactor, max_per_host=10, idle_timeout=60,
+            connect_timeout=30):
+        HTTPConnectionPool.__init__(self, reactor, persistent=True)
+        self.max_per_host = max_per_host
+        self.maxPersistentPerHost = max_per_host
+        self.cachedConnectionTimeout = idle_timeout
+        self.agent = Agent(
+            reactor,
+            contextFactory=HostContextFactory(),
+            connectTimeout=connect_timeout,
+            pool=self,
+        )
+        # 'scheme://host:port' => the DeferredSemaphore limiting its requests
+        # and its counters.
+        self.semaphores = {}
+        self.counters = {}
+
+    def host_name(self, scheme, host, port):
+        "The name a host's counters are kept under."
+        return '%s://%s:%s' % (scheme, host, port or DEFAULT_PORTS.get(scheme))
+
+    def host_counters(self, name):
+        if name not in self.counters:
+            self.counters[name] = {'requests': 0, 'connections': 0, 'errors': 0}
+        return self.counters[name]
+
+    def getConnection(self, key, endpoint):
+        self.host_counters(self.host_name(*key[:3]))['requests'] += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self.host_counters(self.host_name(*key[:3]))['connections'] += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def limit(self, name, f, *args, **kwargs):
+        "Call f(*args, **kwargs) once fewer than max_per_host requests are running for host 'name'."
+        if name not in self.semaphores:
+            self.semaphores[name] = defer.DeferredSemaphore(self.max_per_host)
+            self.host_counters(name)
+
+        def count_error(failure):
+            self.host_counters(name)['errors'] += 1
+            return failure
+
+        return self.semaphores[name].run(f, *args, **kwargs).addErrback(count_error)
+
+    def fetch(self, url, *args, **kwargs):
+        """
+        cyclone.httpclient.fetch(), with its connections from this pool.
+        The body is read before the Deferred fires, so the connection is
+        back in the pool by then.
+        """
+        url = utf8(url)
+        client = PooledHTTPClient(self.agent, url, *args, **kwargs)
+        parsed = urlsplit(url)
+        return self.limit(
+            self.host_name(parsed.scheme, parsed.hostname, parsed.port),
+            client.fetch,
+        )
+
+    def stats(self):
+        """
+        Return the counters for each host: the requests made, the
+        connections opened for them (the rest reused one), the requests
+        that failed, and how many are running, waiting and idle right now.
+        """
+        idle = {}
+        for key, connections in self._connections.items():
+            name = self.host_name(*key[:3])
+            idle[name] = idle.get(name, 0) + len(connections)
+
+        stats = {}
+        for name, counters in self.counters.items():
+            semaphore = self.semaphores.get(name)
+            stats[name] = dict(
+                counters,
+                active=semaphore.limit - semaphore.tokens if semaphore else 0,
+                waiting=len(semaphore.waiting) if semaphore else 0,
+                idle=idle.get(name, 0),
+            )
+        return stats
+
+
+# The pool the services share. configure() replaces it with one set up from
+# the config.
+POOL = None
+
+
+def get_pool():
+    "Return the shared pool, making one with the defaults if need be."
+    global POOL
+    if POOL is None:
+        POOL = HostConnectionPool()
+    return POOL
+
+
+def configure(config):
+    "Replace the shared pool with one set up from the config."
+    global POOL
+    if POOL is not None:
+        POOL.closeCachedConnections()
+    POOL = HostConnectionPool(
+        max_per_host=config.get('http_pool_max_per_host', 10),
+        idle_timeout=config.get('http_pool_idle_timeout', 60),
+        connect_timeout=config.get('http_pool_connect_timeout', 30),
+    )
+    return POOL
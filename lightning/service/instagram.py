@@ -181,14 +181,11 @@ class InstagramDaemon(Daemon, Instagram):
         "Values from profile."
         def write_additional_values(response):
             counts = response.get('data', {}).get('counts', {})
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_followers': counts['followed_by'],
-                    'num_followed': counts['follows'],
-                    'num_media': counts['media'],
-                }.iteritems()
-            ]).addCallback(lambda ign: None)
+            return self.write_data({
+                'num_followers': counts['followed_by'],
+                'num_followed': counts['follows'],
+                'num_media': counts['media'],
+            }, **kwargs).addCallback(lambda ign: None)
 
         return self.request(
             path='users/self',
@@ -202,16 +199,14 @@ class InstagramDaemon(Daemon, Instagram):
 
         def write_granular_data(data):
             if len(data):
-                return defer.gatherResults([
-                    # id, fromid, time, text
-                    self.datastore.write_granular_datum(
-                        method='comment',
+                # id, fromid, time, text
+                return self.datastore.write_granular_data([
+                    dict(
                         item_id=datum['id'],
                         actor_id=datum.get('from', {}).get('id', ''),
                         timestamp=datum['created_time'],
-                        authorization=kwargs['authorization'],
                     ) for datum in data
-                ])
+                ], method='comment', authorization=kwargs['authorization'])
 
         def summate(data):
             to_write = []
@@ -231,13 +226,10 @@ class InstagramDaemon(Daemon, Instagram):
             ).addErrback(lambda ign: None)
 
         def write_values(_):
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_likes': num['likes'],
-                    'num_comments': num['comments'],
-                }.iteritems()
-            ])
+            return self.write_data({
+                'num_likes': num['likes'],
+                'num_comments': num['comments'],
+            }, **kwargs)
 
         return self.request_with_paging(
             path='users/self/media/recent',
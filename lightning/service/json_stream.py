@@ -0,0 +1,77 @@
+"""
+Reading one array out of a large JSON response an item at a time, rather
+than json.loads()ing the whole document first.
+"""
+from __future__ import absolute_import
+
+from json.decoder import JSONDecoder, WHITESPACE
+
+DECODER = JSONDecoder()
+
+
+def skip_whitespace(text, idx):
+    return WHITESPACE.match(text, idx).end()
+
+
+def expect(text, idx, chars):
+    "The character at idx, which must be one of 'chars', and the index after it."
+    char = text[idx:idx + 1]
+    if not char or char not in chars:
+        raise ValueError('Expecting one of %r at %d' % (chars, idx))
+    return char, skip_whitespace(text, idx + 1)
+
+
+def find_key(text, idx, key):
+    """
+    Return the index of the value of 'key' in the JSON object starting at
+    idx, or None if it has no such key. The values of the keys before it are
+    decoded (and thrown away) to get past them.
+    """
+    char, idx = expect(text, idx, '{')
+    if text[idx:idx + 1] == '}':
+        return None
+    while True:
+        if text[idx:idx + 1] != '"':
+            raise ValueError('Expecting property name at %d' % idx)
+        name, idx = DECODER.raw_decode(text, idx)
+        char, idx = expect(text, skip_whitespace(text, idx), ':')
+        if name == key:
+            return idx
+        value, idx = DECODER.raw_decode(text, idx)
+        char, idx = expect(text, skip_whitespace(text, idx), ',}')
+        if char == '}':
+            return None
+
+
+def iter_array(text, key=None):
+    """
+    Yield the items of the array under the top-level 'key' of the JSON
+    object in 'text' (or of the top-level array, if key is None), decoding
+    them one at a time so only one is held at once. Yields nothing if
+    there's no such key. Raises ValueError if the JSON is malformed.
+    """
+    idx = skip_whitespace(text, 0)
+    if key is not None:
+        idx = find_key(text, idx, key)
+        if idx is None:
+            return
+    if text[idx:idx + 1] != '[':
+        # Not an array after all, so there's no saving to be had.
+        for item in DECODER.raw_decode(text, idx)[0]:
+            yield item
+        return
+
+    char, idx = expect(text, idx, '[')
+    if text[idx:idx + 1] == ']':
+        return
+    while True:
+        item, idx = DECODER.raw_decode(text, idx)
+        yield item
+        char, idx = expect(text, skip_whitespace(text, idx), ',]')
+        if char == ']':
+            return
+
+
+def count_array(text, key=None):
+    "The number of items iter_array() would yield."
+    return sum(1 for item in iter_array(text, key))
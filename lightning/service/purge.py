@@ -0,0 +1,52 @@
+"""
+The job that deletes the data of an authorization once it has been deleted.
+"""
+from __future__ import absolute_import
+
+from lightning.error import SQLError
+
+from twisted.internet import defer
+
+from datetime import timedelta, datetime
+import logging
+
+
+class PurgeDaemon(object):
+    """
+    A pyres job, run by the worker like the service daemons, that purges the
+    UserData, GranularData and StreamCache rows of a deleted authorization.
+    Those tables are large, so they're deleted in batches by
+    purge_user_data() rather than while the revoke request waits. If the
+    database fails, the job is tried again later.
+    """
+
+    queue = 'Service'
+    _delay = timedelta(minutes=15)
+
+    @classmethod
+    @defer.inlineCallbacks
+    def perform(cls, config, uuid):
+        """Perform a queued job from pyres.
+
+        Args:
+            config: A dict containing the config for Lightning.
+            uuid: A string containing the uuid of the deleted Authorization.
+        """
+        try:
+            deleted = yield cls.datastore.purge_user_data(
+                uuid, batch_size=config.get('purge_batch_size', 1000),
+            )
+            logging.info('Purge %s: done, %s' % (uuid, deleted))
+        except SQLError as exc:
+            logging.error('Purge %s: SQL Error %s - enqueueing again' % (uuid, exc.message))
+            yield cls.enqueue(config, uuid, cls.delayed_datetime())
+
+    @classmethod
+    def enqueue(cls, config, uuid, when=None, resq=None):
+        'Enqueue a scheduled entry into pyres, to run right away by default'
+        return (resq or cls.resq).enqueue_at(when or datetime.now(), cls, config, uuid)
+
+    @classmethod
+    def delayed_datetime(cls):
+        'Overridable method to determine how long to wait for the job'
+        return datetime.now() + cls._delay
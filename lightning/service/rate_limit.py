@@ -0,0 +1,195 @@
+"""
+Token buckets limiting how often the services call upstream APIs.
+
+Each bucket refills at 'rate' tokens a second, holding at most 'burst'. A
+call takes a token from each of its buckets. If one is empty the call
+isn't refused: the token is reserved (the bucket goes negative) and the
+call waits until it would have refilled. Reservations are handed out in the
+order calls arrive, so waiters go first come, first served, and each waits
+on one timer rather than polling.
+"""
+from __future__ import absolute_import
+
+from functools import wraps
+from twisted.internet import defer, reactor, task
+
+import logging
+
+UNIT_TO_SECONDS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 60 * 60,
+}
+
+# KEYS[i] is a bucket and ARGV[i] is 'rate burst now' for it. Takes a token
+# from every bucket and returns how long the caller has to wait for them,
+# as a string, since Redis would truncate a number to an integer.
+TAKE_SCRIPT = """
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate, burst, now = string.match(ARGV[i], '(%S+) (%S+) (%S+)')
+    rate, burst, now = tonumber(rate), tonumber(burst), tonumber(now)
+    local bucket = redis.call('HMGET', key, 'tokens', 'at')
+    local tokens = tonumber(bucket[1]) or burst
+    local at = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - at) * rate) - 1
+    redis.call('HMSET', key, 'tokens', tokens, 'at', math.max(at, now))
+    redis.call('EXPIRE', key, math.ceil((burst - tokens) / rate) + 1)
+    if tokens < 0 then
+        wait = math.max(wait, -tokens / rate)
+    end
+end
+return tostring(wait)
+"""
+
+
+class MemoryRateLimiter(object):
+    """
+    Keeps the buckets in this process, so the limit is per process.
+    """
+    def __init__(self, reactor=reactor):
+        self.reactor = reactor
+        # key => [tokens, when they were counted]
+        self.buckets = {}
+        self.calls = 0
+        self.delayed = 0
+        self.waited = 0.0
+
+    def take(self, buckets):
+        """
+        Take a token from each of 'buckets', a dict of key => (rate, burst),
+        and return a Deferred firing with how many seconds to wait for them.
+        """
+        now = self.reactor.seconds()
+        wait = 0.0
+        for key, (rate, burst) in buckets.items():
+            tokens, at = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0, now - at) * rate) - 1
+            self.buckets[key] = [tokens, max(at, now)]
+            if tokens < 0:
+                wait = max(wait, -tokens / rate)
+        return defer.succeed(wait)
+
+    def run(self, buckets, f, *args, **kwargs):
+        "Call f(*args, **kwargs) once there's a token in each of 'buckets'."
+        def wait_for_turn(wait):
+            self.calls += 1
+            if wait <= 0:
+                return defer.maybeDeferred(f, *args, **kwargs)
+            self.delayed += 1
+            self.waited += wait
+            return task.deferLater(self.reactor, wait, f, *args, **kwargs)
+
+        return self.take(buckets).addCallback(wait_for_turn)
+
+    def stats(self):
+        """
+        Return how many calls were made, how many of those had to wait and
+        for how many seconds in all.
+        """
+        return {
+            'calls': self.calls,
+            'delayed': self.delayed,
+            'waited': self.waited,
+            'buckets': len(self.buckets),
+        }
+
+
+class RedisRateLimiter(MemoryRateLimiter):
+    """
+    Keeps the buckets in Redis, so the limit holds across every web server
+    and worker. A bucket is a hash of its 'tokens' and when they were
+    counted ('at'), updated by a Lua script so taking from it is atomic, and
+    expires once it would be full again. The time is the caller's, so the
+    hosts' clocks need to agree. If Redis fails, the buckets in this process
+    are used instead.
+    """
+    PREFIX = 'lightning:rate:'
+
+    def __init__(self, redis, reactor=reactor):
+        super(RedisRateLimiter, self).__init__(reactor=reactor)
+        self.redis = redis
+        self.errors = 0
+
+    def take(self, buckets):
+        now = self.reactor.seconds()
+        keys, argv = [], []
+        for key, (rate, burst) in buckets.items():
+            keys.append(self.PREFIX + key)
+            argv.append('%r %r %r' % (float(rate), float(burst), now))
+
+        def failed(failure):
+            self.errors += 1
+            logging.warning('Rate limiter error: %s' % failure.getErrorMessage())
+            return MemoryRateLimiter.take(self, buckets)
+
+        # cyclone's client has no EVAL of its own, and raises rather than
+        # failing the Deferred when it isn't connected.
+        d = defer.maybeDeferred(
+            self.redis.execute_command, 'EVAL', TAKE_SCRIPT, len(keys), *(keys + argv)
+        )
+        return d.addCallbacks(float, failed)
+
+    def stats(self):
+        return dict(super(RedisRateLimiter, self).stats(), errors=self.errors)
+
+
+# The limiter the services share. configure() sets it up from the config.
+LIMITER = None
+
+
+def get_limiter():
+    "Return the shared limiter, making one in memory if need be."
+    global LIMITER
+    if LIMITER is None:
+        LIMITER = MemoryRateLimiter()
+    return LIMITER
+
+
+def configure(config, redis=None):
+    """
+    Set up the shared limiter from the config: 'rate_limit' is 'redis'
+    (which needs 'redis', a connection) or anything else for 'memory'.
+    """
+    global LIMITER
+    if config.get('rate_limit') == 'redis' and redis is not None:
+        LIMITER = RedisRateLimiter(redis)
+    else:
+        LIMITER = MemoryRateLimiter()
+    return LIMITER
+
+
+def request_rate(max, every='second', per_app=None, burst=1):
+    """Limit the request rate of a Service method per uuid.
+
+    Args:
+       max: int, Max number of calls each uuid (of the 'authorization'
+           keyword argument) can make per `every`.
+       every: string, time period that max must occur within. ["second", "minute", "hour"]
+       per_app: int, Max number of calls the service's app key can make per
+           `every`, whichever uuid they're for. None for no limit.
+       burst: int, How many calls can be made at once after a quiet spell.
+
+    Returns:
+       A decorator; calls over the rate wait their turn, rather than failing.
+    """
+    seconds = float(UNIT_TO_SECONDS.get(every, 1))
+
+    def limit_decorator(fn):
+        @wraps(fn)
+        def wrapped_request(self, *args, **kwargs):
+            buckets = {}
+            authorization = kwargs.get('authorization')
+            if authorization:
+                key = '%s:uuid:%s' % (self.name, authorization.uuid.rstrip())
+                buckets[key] = (max / seconds, burst)
+            if per_app:
+                key = '%s:app:%s' % (self.name, self.app_info[self.environment]['app_id'])
+                buckets[key] = (per_app / seconds, burst)
+            if not buckets:
+                return fn(self, *args, **kwargs)
+            return get_limiter().run(buckets, fn, self, *args, **kwargs)
+
+        return wrapped_request
+
+    return limit_decorator
@@ -132,6 +132,7 @@ class Reddit(ServiceOAuth2):
         response = json.loads(resp.body)
         token = kwargs['authorization'].token = response['access_token']
         yield kwargs['authorization'].save()
+        self.datastore.invalidate_oauth_token(kwargs['authorization'])
 
         kwargs['headers']['Authorization'] = ['Bearer %s' % token]
         del kwargs['url']
@@ -174,13 +175,10 @@ class RedditDaemon(Daemon, StreamCachedService, Reddit):
     def values_from_profile(self, **kwargs):
         """get the user's current number of link and comment karma points"""
         def write_values(user):
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_link_karma': user.get('link_karma', 0),
-                    'num_comment_karma': user.get('comment_karma', 0),
-                }.iteritems()
-            ]).addCallback(lambda ign: None)
+            return self.write_data({
+                'num_link_karma': user.get('link_karma', 0),
+                'num_comment_karma': user.get('comment_karma', 0),
+            }, **kwargs).addCallback(lambda ign: None)
 
         return self.request(path='api/v1/me.json', **kwargs).addCallback(write_values)
 
@@ -0,0 +1,210 @@
+"""
+The cache of upstream responses that Service.request() revalidates with
+conditional GETs.
+
+An entry is a dict of the response's 'etag' and 'last_modified' headers (or
+None) and its 'body'. Only responses with at least one of the headers are
+worth keeping: the next request sends them back as If-None-Match and
+If-Modified-Since, and a 304 reply is answered with the cached body. It may
+also hold the body as parse_response() decoded it ('parsed'), which the
+in-memory cache keeps so a hit isn't decoded again.
+"""
+from __future__ import absolute_import
+
+from collections import OrderedDict
+from twisted.internet import defer
+
+import base64
+import json
+import logging
+import marshal
+import time
+
+
+def response_header(headers, name):
+    "The first value of header 'name' in a response's headers, or None."
+    for key, values in headers.items():
+        if key.lower() == name.lower():
+            return values[0] if values else None
+    return None
+
+
+def entry_size(entry):
+    "Roughly how many bytes an entry takes, once 'parsed' is serialized."
+    return (
+        len(entry['body']) + len(entry.get('etag') or '') +
+        len(entry.get('last_modified') or '') + len(entry.get('parsed') or '')
+    )
+
+
+class MemoryResponseCache(object):
+    """
+    Keeps entries in this process, evicting the least recently used once
+    their bodies add up to more than 'max_bytes'. Entries bigger than
+    'max_entry_bytes' aren't kept at all, and entries expire after 'ttl'
+    seconds (None means never).
+
+    The parsed body is kept marshalled: loading it is much quicker than
+    decoding the JSON again, and every hit gets its own copy to change.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=1024 * 1024,
+            ttl=86400, clock=time.time):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        "Return a Deferred firing with the entry for key, or None on a miss."
+        item = self._data.pop(key, None)
+        if item is not None and self.ttl is not None and item[1] <= self.clock():
+            self.bytes -= entry_size(item[0])
+            item = None
+        if item is None:
+            self.misses += 1
+            return defer.succeed(None)
+
+        # Re-insert to mark this key as the most recently used.
+        self._data[key] = item
+        self.hits += 1
+        entry = item[0]
+        if 'parsed' in entry:
+            entry = dict(entry, parsed=marshal.loads(entry['parsed']))
+        return defer.succeed(entry)
+
+    def set(self, key, entry):
+        "Store the entry for key, evicting the least recently used entries."
+        self.delete(key)
+        if 'parsed' in entry:
+            try:
+                entry = dict(entry, parsed=marshal.dumps(entry['parsed']))
+            except ValueError:
+                # Not made of plain dicts, lists, strings and numbers.
+                entry = dict(entry)
+                del entry['parsed']
+        size = entry_size(entry)
+        if size <= self.max_entry_bytes:
+            expires_at = None
+            if self.ttl is not None:
+                expires_at = self.clock() + self.ttl
+            self._data[key] = (entry, expires_at)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                evicted_key, (evicted, ign) = self._data.popitem(last=False)
+                self.bytes -= entry_size(evicted)
+        return defer.succeed(None)
+
+    def delete(self, key):
+        "Remove key, if present."
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= entry_size(item[0])
+        return defer.succeed(None)
+
+    def stats(self):
+        "Return the counters and occupancy of the cache."
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class RedisResponseCache(object):
+    """
+    Keeps entries in Redis, where the web servers and workers share them.
+    Each entry expires after 'ttl' seconds; beyond that, what is evicted
+    when Redis runs out of memory is up to its maxmemory-policy (see
+    conf/redis.conf). Entries bigger than 'max_entry_bytes' aren't kept.
+    Bodies are stored base64-encoded, so they come back byte for byte, and
+    without the parsed body. Redis errors, and entries that can't be decoded, are logged and treated
+    as misses.
+    """
+    PREFIX = 'lightning:response:'
+
+    def __init__(self, redis, max_entry_bytes=1024 * 1024, ttl=86400):
+        self.redis = redis
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def failed(self, failure):
+        logging.warning('Response cache error: %s' % failure.getErrorMessage())
+        return None
+
+    def get(self, key):
+        "Return a Deferred firing with the entry for key, or None on a miss."
+        def decode(value):
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry = json.loads(value)
+            entry['body'] = base64.b64decode(entry['body'])
+            for header in ['etag', 'last_modified']:
+                if entry[header] is not None:
+                    entry[header] = entry[header].encode('utf-8')
+            return entry
+
+        return self.redis.get(self.PREFIX + key).addCallback(decode).addErrback(self.failed)
+
+    def set(self, key, entry):
+        "Store the entry for key."
+        entry = dict(entry)
+        entry.pop('parsed', None)
+        if entry_size(entry) > self.max_entry_bytes:
+            return self.delete(key)
+        value = json.dumps(dict(entry, body=base64.b64encode(entry['body'])))
+        if self.ttl:
+            d = self.redis.setex(self.PREFIX + key, self.ttl, value)
+        else:
+            d = self.redis.set(self.PREFIX + key, value)
+        return d.addErrback(self.failed)
+
+    def delete(self, key):
+        "Remove key, if present."
+        return self.redis.delete(self.PREFIX + key).addErrback(self.failed)
+
+    def stats(self):
+        "Return the hit/miss counters of the cache."
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+# The cache the services share, or None for no caching. configure() sets it
+# up from the config.
+CACHE = None
+
+
+def get_cache():
+    "Return the shared response cache, or None if there isn't one."
+    return CACHE
+
+
+def configure(config, redis=None):
+    """
+    Set up the shared response cache from the config: 'response_cache' is
+    'memory', 'redis' (which needs 'redis', a connection) or anything else
+    for none.
+    """
+    global CACHE
+    kind = config.get('response_cache')
+    max_entry_bytes = config.get('response_cache_max_entry_bytes', 1024 * 1024)
+    ttl = config.get('response_cache_ttl', 86400)
+    if kind == 'memory':
+        CACHE = MemoryResponseCache(
+            max_bytes=config.get('response_cache_max_bytes', 64 * 1024 * 1024),
+            max_entry_bytes=max_entry_bytes,
+            ttl=ttl,
+        )
+    elif kind == 'redis' and redis is not None:
+        CACHE = RedisResponseCache(redis, max_entry_bytes=max_entry_bytes, ttl=ttl)
+    else:
+        CACHE = None
+    return CACHE
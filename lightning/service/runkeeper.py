@@ -277,14 +277,11 @@ class RunKeeperDaemon(Daemon, RunKeeper):
             ])
 
         def write_values(_):
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_calories': num['calories'],
-                    'total_duration': num['duration'],
-                    'total_distance': meters_to_miles(num['distance']),
-                }.iteritems()
-           ])
+            return self.write_data({
+                'num_calories': num['calories'],
+                'total_duration': num['duration'],
+                'total_distance': meters_to_miles(num['distance']),
+            }, **kwargs)
 
         return self.request_with_paging(
             path='fitnessActivities',
@@ -24,6 +24,9 @@ import urlparse
 class SoundCloud(ServiceOAuth2):
     "CLASS DOCSTRING"
     name = 'soundcloud'
+    # Only used by request_with_offset_paging(); the next_href paging has
+    # to wait for each page to know the next.
+    prefetch_pages = 4
 
     def __init__(self, *args, **kwargs):
         super(SoundCloud, self).__init__(*args, **kwargs)
@@ -212,15 +215,12 @@ class SoundCloudDaemon(SoundCloud, StreamCachedService, Daemon):
     def values_from_profile(self, **kwargs):
         "Fetch various stats from the current user's profile and write them to the database"
         def write_values(user):
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_public_tracks': user['track_count'],
-                    'num_public_playlists': user['playlist_count'],
-                    'num_following': user['followings_count'],
-                    'num_followers': user['followers_count'],
-                }.iteritems()
-            ]).addCallback(lambda ign: None)
+            return self.write_data({
+                'num_public_tracks': user['track_count'],
+                'num_public_playlists': user['playlist_count'],
+                'num_following': user['followings_count'],
+                'num_followers': user['followers_count'],
+            }, **kwargs).addCallback(lambda ign: None)
 
         return self.request(path='me.json', **kwargs).addCallback(write_values)
 
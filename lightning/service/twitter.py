@@ -212,17 +212,14 @@ class TwitterDaemon(Twitter, Daemon):
             Profile of currently authenticated user.
         """
         def write_additional_values(response):
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_followers': response['followers_count'],
-                    'num_following': response['friends_count'],
-                    'num_tweets': response['statuses_count'],
-                    # British spelling is correct in what we receive.
-                    'num_favorites': response['favourites_count'],
-                    'num_listed': response['listed_count'],
-                }.iteritems()
-            ]).addCallback(lambda ign: None)
+            return self.write_data({
+                'num_followers': response['followers_count'],
+                'num_following': response['friends_count'],
+                'num_tweets': response['statuses_count'],
+                # British spelling is correct in what we receive.
+                'num_favorites': response['favourites_count'],
+                'num_listed': response['listed_count'],
+            }, **kwargs).addCallback(lambda ign: None)
 
         return self.request(
             path='account/verify_credentials.json',
@@ -295,18 +292,16 @@ class TwitterDaemon(Twitter, Daemon):
             if not len(data):
                 return
 
-            return defer.gatherResults([
-                # id, fromid, time, text
-                self.datastore.write_granular_datum(
-                    method='mention',
+            # id, fromid, time, text
+            return self.datastore.write_granular_data([
+                dict(
                     item_id=datum['id'],
                     actor_id=datum['user']['id'],
                     timestamp=calendar.timegm(
                         rfc822.parsedate(datum['created_at'])
                     ),
-                    authorization=kwargs['authorization'],
                 ) for datum in data
-            ])
+            ], method='mention', authorization=kwargs['authorization'])
 
         def handle_results(data):
             if not len(data):
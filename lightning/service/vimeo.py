@@ -269,19 +269,16 @@ class VimeoDaemon(Vimeo, StreamCachedService, Daemon):
             user = data['person']
 
             # Write some counts ourselves.
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_contacts': user['number_of_contacts'],
-                    'num_uploads': user['number_of_uploads'],
-                    'num_likes': user['number_of_likes'],
-                    'num_videos': user['number_of_videos'],
-                    'num_videos_appears_in': user['number_of_videos_appears_in'],
-                    'num_albums': user['number_of_albums'],
-                    'num_channels': user['number_of_channels'],
-                    'num_groups': user['number_of_groups'],
-                }.iteritems()
-            ]).addCallback(lambda ign: None)
+            return self.write_data({
+                'num_contacts': user['number_of_contacts'],
+                'num_uploads': user['number_of_uploads'],
+                'num_likes': user['number_of_likes'],
+                'num_videos': user['number_of_videos'],
+                'num_videos_appears_in': user['number_of_videos_appears_in'],
+                'num_albums': user['number_of_albums'],
+                'num_channels': user['number_of_channels'],
+                'num_groups': user['number_of_groups'],
+            }, **kwargs).addCallback(lambda ign: None)
 
         authorization = kwargs['authorization']
         url = self.profile_url(authorization.token)
@@ -144,13 +144,10 @@ class WordPressDaemon(Daemon, WordPress):
         for post in posts:
             total_comments += post.get('comment_count', 0)
 
-        defer.gatherResults([
-            self.write_datum(method=method, data=datum, **kwargs)
-            for method, datum in {
-                'num_posts': total_posts,
-                'num_comments_recent_10_posts': total_comments,
-            }.iteritems()
-        ])
+        yield self.write_data({
+            'num_posts': total_posts,
+            'num_comments_recent_10_posts': total_comments,
+        }, **kwargs)
 
     @recurring
     @enqueue_delta(days=30)
@@ -277,16 +277,13 @@ class YoutubeDaemon(Youtube, StreamCachedService, Daemon):
         "User's videos."
 
         def write_values(_):
-            return defer.gatherResults([
-                self.write_datum(method=method, data=datum, **kwargs)
-                for method, datum in {
-                    'num_videos': num['total'],
-                    'num_comments': num['comments'],
-                    'num_likes': num['likes'],
-                    'num_views': num['views'],
-                    'num_favorites': num['favorites'],
-                }.iteritems()
-            ])
+            return self.write_data({
+                'num_videos': num['total'],
+                'num_comments': num['comments'],
+                'num_likes': num['likes'],
+                'num_views': num['views'],
+                'num_favorites': num['favorites'],
+            }, **kwargs)
 
         return self.parse_and_save_paged_stream(
             path='feeds/api/users/default/uploads',
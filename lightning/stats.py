@@ -0,0 +1,35 @@
+"""
+Logs the gauges of the shared connection pools (the datastore's and the
+outbound HTTP pool) every so often, so they can be watched while a web
+server or worker runs, and not only when something has already gone wrong.
+"""
+from __future__ import absolute_import
+
+from lightning.service import http_pool
+from twisted.internet import reactor, task
+
+import logging
+
+
+def log_stats(datastore=None):
+    "Log the gauges of the datastore's connection pools and the HTTP pool."
+    if hasattr(datastore, 'pool_stats'):
+        logging.info('Connection pool: %s' % datastore.pool_stats())
+    logging.info('HTTP pool: %s' % http_pool.get_pool().stats())
+
+
+def start(config, datastore=None, clock=reactor):
+    """
+    Call log_stats() every 'stats_interval' seconds of the config (300 by
+    default, or 0 for never). Returns the LoopingCall, or None.
+    """
+    interval = config.get('stats_interval', 300)
+    if not interval:
+        return None
+
+    loop = task.LoopingCall(log_stats, datastore)
+    loop.clock = clock
+    loop.start(interval, now=False).addErrback(
+        lambda failure: logging.error('Stats error: %s' % failure.getErrorMessage())
+    )
+    return loop
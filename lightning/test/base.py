@@ -8,6 +8,7 @@ from twisted.trial import unittest
 from twistar.registry import Registry
 
 from lightning import Lightning
+from lightning.datastore.cache import SET_SCRIPT, INVALIDATE_SCRIPT
 from lightning.model.authorization import Authz
 from lightning.utils import compose_url
 
@@ -71,6 +72,89 @@ class TestWithRedis(object):
         os.unlink(self.redis_conf_file.name)
 
 
+class FakeRedis(object):
+    """
+    Just enough of a cyclone redis connection for the caches: strings,
+    hashes, and the ValueCache scripts (done in Python), all answered at
+    once. TTLs are only recorded.
+    """
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.expires = {}
+
+    def get(self, key):
+        return defer.succeed(self.values.get(key))
+
+    def set(self, key, value):
+        self.values[key] = value
+        return defer.succeed(True)
+
+    def setex(self, key, seconds, value):
+        self.values[key] = value
+        self.expires[key] = seconds
+        return defer.succeed(True)
+
+    def hget(self, key, field):
+        return defer.succeed(self.hashes.get(key, {}).get(field))
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+        return defer.succeed(1)
+
+    def hdel(self, key, fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+        return defer.succeed(len(fields))
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.hashes.pop(key, None)
+        return defer.succeed(1)
+
+    def expire(self, key, seconds):
+        self.expires[key] = seconds
+        return defer.succeed(1)
+
+    def execute_command(self, command, script, numkeys, *args):
+        assert command == 'EVAL'
+        keys, argv = args[:numkeys], [str(arg) for arg in args[numkeys:]]
+        return getattr(self, self.SCRIPTS[script])(keys, argv)
+
+    SCRIPTS = {
+        SET_SCRIPT: 'eval_set',
+        INVALIDATE_SCRIPT: 'eval_invalidate',
+    }
+
+    def eval_set(self, keys, argv):
+        version, method, entry, ttl = argv
+        if self.hashes.get(keys[0], {}).get('_version', '0') != version:
+            return defer.succeed(0)
+        self.hset(keys[0], method, entry)
+        if int(ttl) > 0:
+            self.expire(keys[0], int(ttl))
+        return defer.succeed(1)
+
+    def eval_invalidate(self, keys, argv):
+        fields = self.hashes.setdefault(keys[0], {})
+        version = str(int(fields.get('_version', 0)) + 1)
+        if len(argv) > 1:
+            self.hdel(keys[0], argv[1:])
+        else:
+            fields.clear()
+        fields['_version'] = version
+        if int(argv[0]) > 0:
+            self.expire(keys[0], int(argv[0]))
+        return defer.succeed(int(version))
+
+
+class FakeAuthz(object):
+    "Stands in for an Authz where only its uuid and service_name are used."
+    def __init__(self, uuid='abcd', service_name='loopback'):
+        self.uuid = uuid
+        self.service_name = service_name
+
+
 class TestWithSQL(object):
     """
     This is a mixin that allows for re-initializing our test SQL server.
@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from lightning.datastore.buffer import WriteBuffer
+from lightning.error import SQLError
+from ..base import FakeAuthz
+
+
+class FakeDatastore(object):
+    "Records the writes made, and fails those for uuids in 'broken'."
+    def __init__(self):
+        self.calls = []
+        self.broken = set()
+
+    def record(self, uuid, *call):
+        self.calls.append(call)
+        if uuid in self.broken:
+            return defer.fail(SQLError('Write failed'))
+        return defer.succeed(True)
+
+    def write_values(self, uuid=None, timestamp=None, values=None):
+        return self.record(uuid, 'write_values', uuid, timestamp, dict(values))
+
+    def write_granular_data(self, data, **kwargs):
+        uuid = kwargs['authorization'].uuid
+        return self.record(uuid, 'write_granular_data', uuid, kwargs['method'], data)
+
+    def update_stream_cache(self, data, authorization):
+        return self.record(authorization.uuid, 'update_stream_cache', authorization.uuid, data)
+
+    def get_value(self, **kwargs):
+        return 'value'
+
+
+class TestWriteBuffer(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.datastore = FakeDatastore()
+        self.buffer = WriteBuffer(self.datastore, max_writes=5, max_delay=1, clock=self.clock)
+
+    @defer.inlineCallbacks
+    def test_coalesce(self):
+        authz = FakeAuthz('abcd')
+        self.buffer.max_writes = 10
+        yield self.buffer.write_value(uuid='abcd', timestamp=10, method='foo', data=1)
+        yield self.buffer.write_values(uuid='abcd', timestamp=10, values={'bar': 2})
+        yield self.buffer.write_granular_datum(authorization=authz, method='likes', item_id='1')
+        yield self.buffer.write_granular_data([{'item_id': '2'}], authorization=authz, method='likes')
+        yield self.buffer.update_stream_cache([{'item_id': 'a'}], authz)
+        self.assertEqual(self.datastore.calls, [])
+        self.assertEqual(self.buffer.writes, 5)
+
+        yield self.buffer.update_stream_cache([{'item_id': 'b'}], authz)
+        self.assertEqual(self.buffer.writes, 6)
+        yield self.buffer.sync('abcd')
+        self.assertEqual(self.datastore.calls, [
+            ('write_values', 'abcd', 10, {'foo': 1, 'bar': 2}),
+            ('write_granular_data', 'abcd', 'likes', [
+                {'authorization': authz, 'method': 'likes', 'item_id': '1'},
+                {'item_id': '2'},
+            ]),
+            ('update_stream_cache', 'abcd', [{'item_id': 'b'}]),
+        ])
+
+        # Reads go straight through.
+        self.assertEqual(self.buffer.get_value(), 'value')
+
+    @defer.inlineCallbacks
+    def test_flush_by_size_and_time(self):
+        for timestamp in range(4):
+            yield self.buffer.write_value(uuid='abcd', timestamp=timestamp, method='foo', data=1)
+        self.assertEqual(self.datastore.calls, [])
+        self.clock.advance(1)
+        self.assertEqual(len(self.datastore.calls), 4)
+
+        for timestamp in range(5):
+            yield self.buffer.write_value(uuid='abcd', timestamp=10 + timestamp, method='foo', data=1)
+        self.assertEqual(len(self.datastore.calls), 9)
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    @defer.inlineCallbacks
+    def test_sync_failure(self):
+        self.datastore.broken.add('abcd')
+        yield self.buffer.write_value(uuid='abcd', timestamp=10, method='foo', data=1)
+        yield self.buffer.write_value(uuid='efgh', timestamp=10, method='foo', data=1)
+        yield self.assertFailure(self.buffer.sync('abcd'), SQLError)
+        yield self.buffer.sync('efgh')
+        self.assertEqual(len(self.flushLoggedErrors(SQLError)), 1)
+
+        # A failure nobody was waiting for is reported to the next sync().
+        yield self.buffer.write_value(uuid='abcd', timestamp=20, method='foo', data=1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.flushLoggedErrors(SQLError)), 1)
+        yield self.assertFailure(self.buffer.sync('abcd'), SQLError)
+        yield self.buffer.sync('abcd')
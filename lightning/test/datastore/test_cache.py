@@ -0,0 +1,140 @@
+from __future__ import absolute_import
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lightning.datastore.cache import LRUCache, ValueCache
+from ..base import FakeRedis
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = LRUCache(size=2)
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats(), {
+            'hits': 1, 'misses': 1, 'size': 1, 'max_size': 2,
+        })
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Touching 'a' leaves 'b' as the oldest entry.
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(size=2, ttl=60, clock=clock)
+        cache.set('a', 1)
+        clock.now += 59
+        self.assertEqual(cache.get('a'), 1)
+        clock.now += 1
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_delete_and_clear(self):
+        cache = LRUCache(size=0)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+
+        cache = LRUCache(size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        self.assertFalse('a' in cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TestValueCache(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_get_set_invalidate(self):
+        redis = FakeRedis()
+        clock = FakeClock()
+        cache = ValueCache(redis, ttl=60, clock=clock)
+        value = yield cache.get('abcd  ', 'num')
+        self.assertEqual(value, None)
+
+        version = yield cache.version('abcd  ')
+        self.assertEqual(version, '0')
+        yield cache.set('abcd  ', 'num', '5', 10, version)
+        clock.now += 30
+        yield cache.set('abcd', 'profile', '{}', 20, version)
+        self.assertEqual(redis.expires, {'lightning:value:abcd': 60})
+        value = yield cache.get('abcd', 'num')
+        self.assertEqual(value, ('5', 10))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1})
+
+        yield cache.invalidate('abcd', ['num'])
+        value = yield cache.get('abcd', 'num')
+        self.assertEqual(value, None)
+        value = yield cache.get('abcd', 'profile')
+        self.assertEqual(value, ('{}', 20))
+
+        # Each entry expires on its own, though the hash is kept alive.
+        clock.now += 31
+        yield cache.set('abcd', 'num', '6', 40, '1')
+        clock.now += 30
+        value = yield cache.get('abcd', 'num')
+        self.assertEqual(value, ('6', 40))
+        value = yield cache.get('abcd', 'profile')
+        self.assertEqual(value, None)
+
+        yield cache.invalidate('abcd')
+        value = yield cache.get('abcd', 'num')
+        self.assertEqual(value, None)
+        self.assertEqual(redis.hashes['lightning:value:abcd'], {'_version': '2'})
+
+    @defer.inlineCallbacks
+    def test_invalidate_during_read(self):
+        redis = FakeRedis()
+        cache = ValueCache(redis)
+
+        # A reader misses and reads '5' from the database; a write of '6'
+        # then lands and invalidates before the reader caches what it read.
+        value = yield cache.get('abcd', 'num')
+        self.assertEqual(value, None)
+        version = yield cache.version('abcd')
+        yield cache.invalidate('abcd', ['num'])
+        yield cache.set('abcd', 'num', '5', 10, version)
+        value = yield cache.get('abcd', 'num')
+        self.assertEqual(value, None)
+
+        # The next reader caches what it reads.
+        version = yield cache.version('abcd')
+        yield cache.set('abcd', 'num', '6', 20, version)
+        value = yield cache.get('abcd', 'num')
+        self.assertEqual(value, ('6', 20))
+
+    @defer.inlineCallbacks
+    def test_redis_errors_are_misses(self):
+        class BrokenRedis(object):
+            def hget(self, key, field):
+                return defer.fail(Exception('Connection refused'))
+
+            def execute_command(self, *args):
+                raise Exception('Not connected')
+
+        cache = ValueCache(BrokenRedis())
+        value = yield cache.get('abcd', 'num')
+        self.assertEqual(value, None)
+        version = yield cache.version('abcd')
+        self.assertEqual(version, None)
+        yield cache.set('abcd', 'num', '5', 10, version)
+        yield cache.invalidate('abcd')
+        self.assertEqual(len(self.flushLoggedErrors()), 0)
@@ -0,0 +1,31 @@
+# coding: utf-8
+from __future__ import absolute_import
+
+from twisted.trial import unittest
+
+from lightning.datastore.codec import compress, decompress, ZLIB_HEADER
+import base64
+import json
+import random
+
+
+class TestCodec(unittest.TestCase):
+    def test_round_trip(self):
+        text = json.dumps({'name': u'J\xf6e', 'bio': 'words ' * 200})
+        encoded = compress(text)
+        self.assertTrue(encoded.startswith(ZLIB_HEADER))
+        self.assertTrue(len(encoded) < len(text))
+        self.assertEqual(decompress(encoded), text)
+
+    def test_stored_as_is(self):
+        # Too short, compression disabled, or no smaller once compressed.
+        self.assertEqual(compress('"short"'), '"short"')
+        self.assertEqual(compress('"%s"' % ('x' * 1000), min_size=None), '"%s"' % ('x' * 1000))
+        rand = random.Random(1)
+        noise = json.dumps(base64.b64encode(''.join(chr(rand.randrange(256)) for i in range(600))))
+        self.assertEqual(compress(noise, min_size=10), noise)
+
+        # Old rows, and numbers, come back unchanged.
+        self.assertEqual(decompress('{"a": 1}'), '{"a": 1}')
+        self.assertEqual(decompress(u'5'), u'5')
+        self.assertEqual(decompress(None), None)
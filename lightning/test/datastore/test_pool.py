@@ -0,0 +1,54 @@
+from __future__ import absolute_import
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lightning.datastore.pool import InstrumentedConnectionPool
+import sqlite3
+
+
+class TestInstrumentedConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.now = [1000.0]
+        self.pool = InstrumentedConnectionPool(
+            'sqlite3', ':memory:',
+            check_same_thread=False,
+            cp_min=1,
+            cp_max=1,
+            cp_recycle=60,
+            cp_clock=lambda: self.now[0],
+        )
+
+    def tearDown(self):
+        self.pool.close()
+
+    @defer.inlineCallbacks
+    def test_stats(self):
+        yield self.pool.warm()
+        stats = self.pool.stats()
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['interactions'], 1)
+
+        rv = yield self.pool.runQuery('SELECT 1')
+        self.assertEqual(rv, [(1,)])
+        stats = self.pool.stats()
+        self.assertEqual(stats['interactions'], 2)
+        self.assertEqual(stats['recycled'], 0)
+
+    @defer.inlineCallbacks
+    def test_recycle(self):
+        yield self.pool.runOperation('CREATE TABLE Foo (id INTEGER)')
+        self.now[0] += 30
+        rv = yield self.pool.runQuery('SELECT COUNT(*) FROM Foo')
+        self.assertEqual(rv, [(0,)])
+        self.assertEqual(self.pool.stats()['recycled'], 0)
+
+        # A new connection means a new (empty) in-memory database.
+        self.now[0] += 60
+        yield self.assertFailure(
+            self.pool.runQuery('SELECT COUNT(*) FROM Foo'),
+            sqlite3.OperationalError,
+        )
+        self.assertEqual(self.pool.stats()['recycled'], 1)
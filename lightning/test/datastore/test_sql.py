@@ -1,12 +1,41 @@
 from __future__ import absolute_import
 
 
-from ..base import TestBase, TestWithSQL
+from ..base import FakeRedis, TestBase, TestWithSQL
 from twisted.internet import defer
-from lightning.datastore.sql import DatastoreSQL
+from lightning.datastore.cache import ValueCache
+from lightning.datastore.sql import DatastoreSQL, bind_config
 from lightning.model.authorization import Authz
-from lightning.error import SQLError
+from lightning.error import InvalidArgumentError, SQLError
+import json
 import pprint
+import time
+
+
+class ReadPool(object):
+    "Stands in for a read replica: the primary's pool, counted, and maybe down."
+    def __init__(self, pool):
+        self.pool = pool
+        self.reads = 0
+        self.down = False
+
+    def run(self, name, *args, **kwargs):
+        self.reads += 1
+        if self.down:
+            return defer.fail(SQLError('Read pool is down'))
+        return getattr(self.pool, name)(*args, **kwargs)
+
+    def runQuery(self, *args, **kwargs):
+        return self.run('runQuery', *args, **kwargs)
+
+    def runOperation(self, *args, **kwargs):
+        return self.run('runOperation', *args, **kwargs)
+
+    def runInteraction(self, *args, **kwargs):
+        return self.run('runInteraction', *args, **kwargs)
+
+    def close(self):
+        pass
 
 
 class TestDatastoreSQL(TestBase, TestWithSQL):
@@ -149,6 +178,99 @@ class TestDatastoreSQL(TestBase, TestWithSQL):
         )
         self.assertEqual(len(oauth_token), 0, 'No oauth token anymore')
 
+    @defer.inlineCallbacks
+    def test_set_oauth_token_update(self):
+        authz = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback',
+            user_id='a1234', token='abcd', secret='1234',
+        )
+        self.assertTrue(authz.is_new)
+        self.assertTrue(authz.id)
+
+        # The same client/service/user gets the same authorization, and only
+        # the token and secret given are changed.
+        again = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback',
+            user_id='a1234', token='efgh',
+        )
+        self.assertFalse(again.is_new)
+        self.assertEqual(again.id, authz.id)
+        self.assertEqual(again.uuid, authz.uuid)
+        self.assertEqual(again.token, 'efgh')
+        self.assertEqual(again.secret, '1234')
+
+        stored = yield self.db.get_oauth_token(uuid=authz.uuid)
+        self.assertEqual(stored.token, 'efgh')
+
+    @defer.inlineCallbacks
+    def test_retrieve_inflight_authz(self):
+        yield self.db.store_inflight_authz(
+            service_name='loopback', request_token='abcd', secret='1234',
+        )
+        yield self.db.store_inflight_authz(
+            service_name='loopback', request_token='efgh', secret='5678',
+        )
+
+        # Retrieving it deletes it, so it can only be used once.
+        inflight = yield self.db.retrieve_inflight_authz(
+            service_name='loopback', request_token='abcd',
+        )
+        self.assertEqual(inflight.secret, '1234')
+        inflight = yield self.db.retrieve_inflight_authz(
+            service_name='loopback', request_token='abcd',
+        )
+        self.assertEqual(inflight, None)
+
+        inflight = yield self.db.retrieve_inflight_authz(
+            service_name='loopback', request_token='efgh',
+        )
+        self.assertEqual(inflight.secret, '5678')
+
+    @defer.inlineCallbacks
+    def test_get_oauth_tokens(self):
+        lb = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback',
+            user_id='a1234', token='abcd',
+        )
+        lb2 = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback2',
+            user_id='a1234', token='abcd',
+        )
+        other = yield self.db.set_oauth_token(
+            client_name='other', service_name='loopback',
+            user_id='a1234', token='abcd',
+        )
+
+        rv = yield self.db.get_oauth_tokens([])
+        self.assertEqual(rv, [])
+
+        # Order follows the requested UUIDs and unknown UUIDs are dropped.
+        rv = yield self.db.get_oauth_tokens([lb2.uuid, 'unknown', lb.uuid])
+        self.assertEqual([a.uuid for a in rv], [lb2.uuid, lb.uuid])
+
+        rv = yield self.db.get_oauth_tokens(
+            [lb.uuid, lb2.uuid, other.uuid], client_name='testing',
+        )
+        self.assertEqual([a.uuid for a in rv], [lb.uuid, lb2.uuid])
+
+        rv = yield self.db.get_oauth_tokens(
+            [lb.uuid, lb2.uuid, other.uuid], service_name='loopback2',
+        )
+        self.assertEqual([a.uuid for a in rv], [lb2.uuid])
+
+        rv = yield self.db.get_oauth_tokens(
+            [lb.uuid, lb2.uuid, other.uuid],
+            client_name='testing', service_name=['loopback', 'loopback2'],
+        )
+        self.assertEqual([a.uuid for a in rv], [lb.uuid, lb2.uuid])
+
+        # Lists larger than a single chunk are split across queries.
+        self.db.AUTHZ_CHUNK_SIZE = 2
+        rv = yield self.db.get_oauth_tokens([other.uuid, lb2.uuid, lb.uuid])
+        self.assertEqual(
+            [a.uuid for a in rv], [other.uuid, lb2.uuid, lb.uuid]
+        )
+
     # Need to add:
     # 1) What happens when we pass set_view() an empty list for values?
     # 2) Add the assert() calls to X_view()
@@ -272,6 +394,31 @@ class TestDatastoreSQL(TestBase, TestWithSQL):
         )
         self.assertFalse(view_foo_exists)
 
+    @defer.inlineCallbacks
+    def test_set_view_update(self):
+        yield self.db.set_view(name='foo', values=[dict(service='a', method='a1')])
+        rv = yield self.db.get_view(name='foo')
+        self.assertEqual(rv, [{'service': 'a', 'method': 'a1'}])
+
+        # Overwriting the view replaces the cached definition, even if it's
+        # being read at the same time.
+        reading = self.db.get_view(name='foo')
+        yield self.db.set_view(name='foo', values=[dict(service='b', method='b2')])
+        yield reading
+        rv = yield self.db.get_view(name='foo')
+        self.assertEqual(rv, [{'service': 'b', 'method': 'b2'}])
+        views = yield self.db.get_views()
+        self.assertEqual(views, ['foo'])
+
+        # A read that finishes after the change doesn't cache the old row.
+        self.db.view_cache.delete('foo')
+        version = self.db.view_versions['foo']
+        reading = self.db.get_view(name='foo')
+        self.db.changed_view('foo')
+        yield reading
+        self.assertEqual(self.db.view_cache.get('foo'), None)
+        self.assertEqual(self.db.view_versions['foo'], version + 1)
+
     def _get(self, authorization=None, method='foo'):
         if not authorization:
             if hasattr(self, 'authorization'):
@@ -453,6 +600,146 @@ class TestDatastoreSQL(TestBase, TestWithSQL):
             ['30', 'baz'],
         ])
 
+    @defer.inlineCallbacks
+    def test_write_values(self):
+        yield self._write(timestamp=10, method='foo', data='bar')
+
+        rv = yield self.db.write_values(uuid='abcd', timestamp=20, values={
+            'foo': 'bar',
+            'num': 5,
+            'ratio': '1.5',
+        })
+        self.assertEqual(rv, True)
+        rv = yield self._get_range(start=8, end=108, method='foo')
+        self.assertEqual(rv, [['10', 'bar']])
+        rv = yield self._get_range(start=8, end=108, method='num')
+        self.assertEqual(rv, [['20', 5]])
+        rv = yield self._get_range(start=8, end=108, method='ratio')
+        self.assertEqual(rv, [['20', 1.5]])
+
+        # Only the values that changed since their latest row are written.
+        yield self.db.write_values(uuid='abcd', timestamp=30, values=[
+            ('foo', 'baz'),
+            ('num', 5),
+            ('ratio', 1.5),
+        ])
+        rv = yield self._get_range(start=8, end=108, method='foo')
+        self.assertEqual(rv, [['10', 'bar'], ['30', 'baz']])
+        rv = yield self._get_range(start=8, end=108, method='num')
+        self.assertEqual(rv, [['20', 5]])
+        rv = yield self._get_range(start=8, end=108, method='ratio')
+        self.assertEqual(rv, [['20', 1.5]])
+
+    @defer.inlineCallbacks
+    def test_value_cache(self):
+        redis = FakeRedis()
+        self.db.value_cache = ValueCache(redis)
+        yield self._write(timestamp=10, method='foo', data='bar')
+
+        rv = yield self._get(method='foo')
+        self.assertEqual(rv, ['bar'])
+        self.assertEqual(
+            json.loads(redis.hashes['lightning:value:abcd']['foo'])[:2], ['"bar"', 10],
+        )
+
+        # Served from the cache, and still marked as expired if it has been.
+        authorization = self._create_auth('abcd')
+        authorization.expired_on_timestamp = 20
+        redis.hashes['lightning:value:abcd']['foo'] = json.dumps(['"cached"', 10, time.time()])
+        rv = yield self._get(authorization=authorization, method='foo')
+        self.assertEqual(rv, ['cached', 20])
+
+        # Writing a value drops it from the cache.
+        yield self._write(timestamp=30, method='foo', data='baz')
+        self.assertEqual(redis.hashes['lightning:value:abcd'], {'_version': '2'})
+        rv = yield self._get(method='foo')
+        self.assertEqual(rv, ['baz'])
+
+        yield self.db.delete_user_data(uuid='abcd')
+        self.assertEqual(redis.hashes, {'lightning:value:abcd': {'_version': '3'}})
+
+    @defer.inlineCallbacks
+    def test_get_values(self):
+        yield self._write(timestamp=10, method='foo', data='bar')
+        yield self._write(timestamp=20, method='foo', data='baz')
+        yield self._write(timestamp=10, method='num', data=5)
+
+        authorization = self._create_auth('abcd')
+        rv = yield self.db.get_values(
+            authorization=authorization, methods=['foo', 'num', 'missing', 'num'],
+        )
+        self.assertEqual(rv, {'foo': ['baz'], 'num': [5], 'missing': []})
+
+        authorization.expired_on_timestamp = 15
+        rv = yield self.db.get_values(authorization=authorization, methods=['foo', 'num'])
+        self.assertEqual(rv, {'foo': ['baz'], 'num': [5, 15]})
+
+    @defer.inlineCallbacks
+    def test_read_pool(self):
+        read_pool = ReadPool(self.db.raw_db)
+        self.db.read_pool = read_pool
+        self.db.read_db = bind_config(self.db.db, read_pool)
+        yield self._write(timestamp=10, method='foo', data='bar')
+
+        # Just written, so it's read from the primary.
+        rv = yield self._get(method='foo')
+        self.assertEqual(rv, ['bar'])
+        self.assertEqual(read_pool.reads, 0)
+
+        self.db.recent_writes.clear()
+        rv = yield self._get(method='foo')
+        self.assertEqual(rv, ['bar'])
+        rv = yield self.db.get_value_range(
+            authorization=self._create_auth('abcd'), method='foo', start=1, end=20,
+        )
+        self.assertEqual(rv, [['10', 'bar']])
+        self.assertEqual(read_pool.reads, 2)
+
+        # If the read pool fails, the primary answers.
+        read_pool.down = True
+        rv = yield self._get(method='foo')
+        self.assertEqual(rv, ['bar'])
+        self.assertEqual(read_pool.reads, 3)
+        self.assertEqual(len(self.flushLoggedErrors(SQLError)), 1)
+
+        # What fills the value cache comes from the primary.
+        read_pool.down = False
+        self.db.value_cache = ValueCache(FakeRedis())
+        rv = yield self._get(method='foo')
+        self.assertEqual(rv, ['bar'])
+        rv = yield self.db.get_values(
+            authorization=self._create_auth('abcd'), methods=['foo'],
+        )
+        self.assertEqual(rv, {'foo': ['bar']})
+        self.assertEqual(read_pool.reads, 3)
+
+    @defer.inlineCallbacks
+    def test_compact_user_data(self):
+        for timestamp, data in [(100, 1), (200, 2), (3700, 3), (3800, 4), (7300, 5), (7400, 6)]:
+            yield self._write(timestamp=timestamp, method='foo', data=data)
+        yield self._write(timestamp=100, method='bar', data=1)
+        yield self._write(timestamp=200, method='bar', data=2)
+
+        # Only values before 'before' are touched, and only the latest one in
+        # each bucket (per method) survives.
+        rv = yield self.db.compact_user_data(uuid='abcd', before=7300, bucket='hour', batch_size=1)
+        self.assertEqual(rv, 3)
+        yield self.ensure_range(start=1, end=10000, expected=[
+            ['200', 2], ['3800', 4], ['7300', 5], ['7400', 6],
+        ])
+        yield self.ensure_range(method='bar', start=1, end=10000, expected=[['200', 2]])
+
+        rv = yield self.db.compact_user_data(uuid='abcd', before=10000, bucket='day')
+        self.assertEqual(rv, 3)
+        yield self.ensure_range(start=1, end=10000, expected=[['7400', 6]])
+        rv = yield self._get(method='foo')
+        self.assertEqual(rv, [6])
+
+        yield self.assertFailure(
+            self.db.compact_user_data(uuid='abcd', before=10000, bucket='decade'),
+            InvalidArgumentError,
+        )
+
     @defer.inlineCallbacks
     def test_range_gets(self):
         yield self._write(timestamp=10, data=20)
@@ -525,6 +812,38 @@ class TestDatastoreSQL(TestBase, TestWithSQL):
         yield self.ensure_range(start=20, end=30, num=1,reverse=True, expected=[['20',200]])
         yield self.ensure_range(start=20, end=30, num=2,reverse=True, expected=[['20',200]])
 
+    @defer.inlineCallbacks
+    def test_range_buckets(self):
+        yield self._write(timestamp=3610, data=5)
+        yield self._write(timestamp=3620, data=7)
+        yield self._write(timestamp=7205, data=3)
+        authorization = self._create_auth('abcd')
+
+        def get(**kwargs):
+            return self.db.get_value_range(
+                authorization=authorization, method='foo', **kwargs
+            )
+
+        rv = yield get(start=1, end=10000, bucket='hour')
+        self.assertEqual(rv, [['3600', 7], ['7200', 3]])
+        rv = yield get(start=1, end=10000, bucket='hour', agg='min')
+        self.assertEqual(rv, [['3600', 5], ['7200', 3]])
+        rv = yield get(start=1, end=10000, bucket='hour', agg='avg')
+        self.assertEqual(rv, [['3600', 6], ['7200', 3]])
+        rv = yield get(start=1, end=10000, bucket='day', agg='max')
+        self.assertEqual(rv, [['1', 7]])
+        rv = yield get(start=1, end=10000, bucket='hour', reverse=True, num=1)
+        self.assertEqual(rv, [['7200', 3]])
+
+        # The value before 'start' is carried forward into the first bucket.
+        rv = yield get(start=3615, end=10000, bucket='hour', agg='min')
+        self.assertEqual(rv, [['3615', 5], ['7200', 3]])
+        rv = yield get(start=7300, end=10000, bucket='hour')
+        self.assertEqual(rv, [['7300', 3]])
+
+        yield self.assertFailure(get(bucket='year'), InvalidArgumentError)
+        yield self.assertFailure(get(bucket='day', agg='median'), InvalidArgumentError)
+
     @defer.inlineCallbacks
     def notest_range_gets_with_expiration(self):
         yield self.set_authorization()
@@ -547,3 +866,274 @@ class TestDatastoreSQL(TestBase, TestWithSQL):
 
         yield self.ensure_range(start=11,end=19,num=1,expected=[['11','20','15']])
         yield self.ensure_range(start=11,end=19,num=1,reverse=True,expected=[['11','20','15']])
+
+    @defer.inlineCallbacks
+    def test_update_stream_cache(self):
+        authorization = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback',
+            user_id='a1234', token='abcd',
+        )
+
+        def item(item_id, timestamp, story):
+            return {
+                'item_id': item_id,
+                'timestamp': timestamp,
+                'data': {'metadata': {'post_id': item_id}, 'story': story},
+            }
+
+        @defer.inlineCallbacks
+        def ensure_cache(expected):
+            rows = yield self.db.db.select(
+                tablename='StreamCache',
+                select='item_id, data, content_hash',
+                where=['uuid=?', authorization.uuid],
+                orderby='item_id',
+            )
+            self.assertEqual(
+                [(row['item_id'], json.loads(row['data'])['story']) for row in rows],
+                expected,
+            )
+            for row in rows:
+                self.assertEqual(
+                    row['content_hash'],
+                    self.db.stream_cache_hash(json.loads(row['data'])),
+                )
+
+        yield self.db.update_stream_cache(
+            [item('status:1', 10, 'one'), item('status:2', 20, 'two')],
+            authorization,
+        )
+        yield ensure_cache([('status:1', 'one'), ('status:2', 'two')])
+
+        # Adds, updates and removes all at once.
+        yield self.db.update_stream_cache(
+            [item('status:2', 20, 'two, edited'), item('status:3', 30, 'three')],
+            authorization,
+        )
+        yield ensure_cache([('status:2', 'two, edited'), ('status:3', 'three')])
+
+        # Nothing changed, nothing to do.
+        yield self.db.update_stream_cache(
+            [item('status:2', 20, 'two, edited'), item('status:3', 30, 'three')],
+            authorization,
+        )
+        yield ensure_cache([('status:2', 'two, edited'), ('status:3', 'three')])
+
+        # Rows written before content_hash existed are rewritten.
+        yield self.db.raw_db.runOperation(
+            'UPDATE [StreamCache] SET content_hash = NULL WHERE uuid = ?',
+            [authorization.uuid],
+        )
+        yield self.db.update_stream_cache(
+            [item('status:2', 20, 'two, edited'), item('status:3', 30, 'three')],
+            authorization,
+        )
+        yield ensure_cache([('status:2', 'two, edited'), ('status:3', 'three')])
+
+    @defer.inlineCallbacks
+    def test_compressed_data(self):
+        profile = {'name': 'Joe', 'bio': 'words ' * 20}
+        yield self._write(timestamp=10, method='profile', data=profile)
+        yield self._write(timestamp=10, method='num', data=5)
+
+        # Written before compression was turned on.
+        rows = yield self.db.raw_db.runQuery('SELECT data FROM [UserData] ORDER BY id')
+        self.assertEqual([row[0] for row in rows], [json.dumps(profile), '5'])
+
+        self.db.config['compress_min_size'] = 10
+        rv = yield self.db.compress_stored_data('UserData', batch_size=1)
+        self.assertEqual(rv[1], 1)
+        rv = yield self.db.compress_stored_data('UserData', after_id=rv[0], batch_size=1)
+        self.assertEqual(rv[1], 0)
+        rv = yield self.db.compress_stored_data('UserData', after_id=rv[0], batch_size=1)
+        self.assertEqual(rv, (None, 0))
+
+        rows = yield self.db.raw_db.runQuery('SELECT data FROM [UserData] ORDER BY id')
+        self.assertTrue(rows[0][0].startswith('~z1:'))
+        rv = yield self._get(method='profile')
+        self.assertEqual(rv, [profile])
+        rv = yield self._get(method='num')
+        self.assertEqual(rv, [5])
+
+        # The same value, compressed the same way, isn't written again.
+        yield self._write(timestamp=20, method='profile', data=profile)
+        rows = yield self.db.raw_db.runQuery('SELECT COUNT(*) FROM [UserData]')
+        self.assertEqual(rows[0][0], 2)
+
+        authorization = self._create_auth('abcd')
+        yield self.db.update_stream_cache([
+            {'item_id': 'status:1', 'timestamp': 10, 'data': profile},
+        ], authorization)
+        rows = yield self.db.retrieve_stream_cache(uuid='abcd', limit=10)
+        self.assertEqual([row['data'] for row in rows], [profile])
+
+    @defer.inlineCallbacks
+    def test_compress_concurrent_write(self):
+        profile = {'name': 'Joe', 'bio': 'words ' * 20}
+        yield self._write(timestamp=10, method='profile', data=profile)
+        authorization = self._create_auth('abcd')
+        yield self.db.update_stream_cache([
+            {'item_id': 'status:1', 'timestamp': 10, 'data': profile},
+        ], authorization)
+        edited = dict(profile, name='Jane')
+
+        # Each table's row changes between being read and being rewritten.
+        writes = [
+            ('UPDATE [UserData] SET data = ?', [json.dumps(edited)]),
+            ('UPDATE [StreamCache] SET data = ?, content_hash = ?', [
+                json.dumps(edited), self.db.stream_cache_hash(edited),
+            ]),
+        ]
+        run_in_transaction = self.db.run_in_transaction
+        def write_first(*args, **kwargs):
+            d = self.db.raw_db.runOperation(*writes.pop(0))
+            return d.addCallback(lambda ign: run_in_transaction(*args, **kwargs))
+        self.patch(self.db, 'run_in_transaction', write_first)
+
+        self.db.config['compress_min_size'] = 10
+        for table in ['UserData', 'StreamCache']:
+            rv = yield self.db.compress_stored_data(table)
+            self.assertEqual(rv[1], 0)
+
+        rv = yield self._get(method='profile')
+        self.assertEqual(rv, [edited])
+        rows = yield self.db.retrieve_stream_cache(uuid='abcd', limit=10)
+        self.assertEqual([row['data'] for row in rows], [edited])
+
+    @defer.inlineCallbacks
+    def test_purge_user_data(self):
+        authorization = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback',
+            user_id='a1234', token='abcd',
+        )
+        other = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback',
+            user_id='b5678', token='efgh',
+        )
+        for authz in [authorization, other]:
+            for timestamp in range(5):
+                yield self.db.write_value(
+                    uuid=authz.uuid, timestamp=timestamp, method='foo', data=timestamp,
+                )
+            yield self.db.write_granular_data([
+                dict(item_id=1, actor_id='x', timestamp=10),
+            ], authorization=authz, method='comment')
+            yield self.db.update_stream_cache([
+                {'item_id': 'status:1', 'timestamp': 10, 'data': {'id': 1}},
+            ], authz)
+
+        # The data outlives its authorization until it's purged.
+        yield self.db.delete_oauth_token(uuid=authorization.uuid)
+        rv = yield self.db.purge_user_data(authorization.uuid, batch_size=2)
+        self.assertEqual(rv, {'UserData': 5, 'GranularData': 1, 'StreamCache': 1})
+
+        for table in self.db.PURGE_TABLES:
+            rows = yield self.db.raw_db.runQuery(
+                'SELECT uuid, COUNT(*) FROM [%s] GROUP BY uuid' % table,
+            )
+            self.assertEqual([row[0].strip() for row in rows], [other.uuid])
+
+        # Whatever is written after the purge is left to the sweep.
+        yield self.db.write_value(
+            uuid=authorization.uuid, timestamp=10, method='foo', data=10,
+        )
+        yield self.db.update_stream_cache([
+            {'item_id': 'status:2', 'timestamp': 20, 'data': {'id': 2}},
+        ], authorization)
+        rv = yield self.db.purge_orphaned_data(batch_size=2)
+        self.assertEqual(rv, {'UserData': 1, 'GranularData': 0, 'StreamCache': 1})
+        for table in self.db.PURGE_TABLES:
+            rows = yield self.db.raw_db.runQuery(
+                'SELECT uuid, COUNT(*) FROM [%s] GROUP BY uuid' % table,
+            )
+            self.assertEqual([row[0].strip() for row in rows], [other.uuid])
+
+    @defer.inlineCallbacks
+    def test_granular_data(self):
+        authorization = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback',
+            user_id='a1234', token='abcd',
+        )
+        kwargs = dict(authorization=authorization, method='comment')
+
+        page = [{'id': 1}, {'id': '2'}, {'id': 1}]
+        rv = yield self.db.find_unwritten_granular_data(page, **kwargs)
+        self.assertEqual(rv, [{'id': 1}, {'id': '2'}])
+
+        yield self.db.write_granular_data([
+            dict(item_id=1, actor_id='x', timestamp=10),
+            dict(item_id=1, actor_id='x', timestamp=10),
+        ], **kwargs)
+        rv = yield self.db.find_unwritten_granular_data(page, **kwargs)
+        self.assertEqual(rv, [{'id': '2'}])
+
+        # Items that are already written are skipped.
+        yield self.db.write_granular_data([
+            dict(item_id=1, actor_id='x', timestamp=10),
+            dict(item_id=2, actor_id='y', timestamp=20),
+        ], **kwargs)
+        rv = yield self.db.find_unwritten_granular_data(page, **kwargs)
+        self.assertEqual(rv, [])
+
+        rv = yield self.db.find_unwritten_granular_data(
+            page, authorization=authorization, method='mention',
+        )
+        self.assertEqual(rv, [{'id': 1}, {'id': '2'}])
+
+        rv = yield self.db.retrieve_granular_data(
+            uuid=authorization.uuid, method='comment', start=0, end=100,
+            user_id='a1234',
+        )
+        # Both actors have one comment, so the most recent one wins.
+        self.assertEqual(rv['actor_id'], 'y')
+        self.assertEqual(rv['num'], 1)
+
+    @defer.inlineCallbacks
+    def test_retrieve_stream_cache(self):
+        authorization = yield self.db.set_oauth_token(
+            client_name='testing', service_name='loopback',
+            user_id='a1234', token='abcd',
+        )
+        yield self.db.update_stream_cache([
+            {'item_id': item_id, 'timestamp': timestamp, 'data': {'id': item_id}}
+            for item_id, timestamp in [
+                ('status:1', 10), ('photo:2', 20), ('status:3', 20),
+                ('photo:4', 30), ('status:5', 40),
+            ]
+        ], authorization)
+
+        def ids(rows):
+            return [row['data']['id'] for row in rows or []]
+
+        # photo:2 and status:3 share a timestamp, so their ids decide.
+        everything = yield self.db.retrieve_stream_cache(uuid=authorization.uuid, limit=10)
+        everything = ids(everything)
+        self.assertEqual(everything[0:2], ['status:5', 'photo:4'])
+        self.assertEqual(sorted(everything[2:4]), ['photo:2', 'status:3'])
+        self.assertEqual(everything[4:], ['status:1'])
+
+        rows = yield self.db.retrieve_stream_cache(
+            uuid=authorization.uuid, limit=10, stream_type='photos',
+        )
+        self.assertEqual(ids(rows), ['photo:4', 'photo:2'])
+
+        rows = yield self.db.retrieve_stream_cache(
+            uuid=authorization.uuid, limit=10, start=20, end=30,
+        )
+        self.assertEqual(ids(rows), everything[1:4])
+
+        # Page through with cursors; items sharing a timestamp are neither
+        # skipped nor repeated.
+        page1 = yield self.db.retrieve_stream_cache(uuid=authorization.uuid, limit=3)
+        self.assertEqual(ids(page1), everything[0:3])
+        cursor = (page1[-1]['timestamp'], page1[-1]['id'])
+        page2 = yield self.db.retrieve_stream_cache(
+            uuid=authorization.uuid, limit=3, before=cursor,
+        )
+        self.assertEqual(ids(page2), everything[3:5])
+
+        cursor = (page2[0]['timestamp'], page2[0]['id'])
+        rows = yield self.db.retrieve_stream_cache(
+            uuid=authorization.uuid, limit=2, after=cursor,
+        )
+        self.assertEqual(ids(rows), everything[1:3])
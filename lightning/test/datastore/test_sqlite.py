@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+
+
+from . import test_sql
+from twisted.internet import defer
+from lightning.datastore import connect
+from lightning.datastore.sqlite import DatastoreSQLite
+from lightning.model.authorization import Authz
+import sqlite3
+
+
+class TestDatastoreSQLite(test_sql.TestDatastoreSQL):
+    """
+    Run the DatastoreSQL tests against an in-memory SQLite database.
+    (The module is imported, not the class, so trial doesn't collect the
+    SQL Server tests twice.)
+    """
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        # Skip TestDatastoreSQL.setUp(), which connects to SQL Server.
+        yield super(test_sql.TestDatastoreSQL, self).setUp()
+        self.db = yield connect('sqlite::memory:')
+
+    def tearDown(self):
+        self.db.disconnect()
+        super(test_sql.TestDatastoreSQL, self).tearDown()
+
+    def test_connect(self):
+        self.assertIsInstance(self.db, DatastoreSQLite)
+        self.assertEqual(self.db.config['connection'], ':memory:')
+
+    def test_insert_null(self):
+        self.failUnlessFailure(
+            Authz(
+                uuid=None,
+                token=None
+            ).save(),
+            sqlite3.IntegrityError,
+            'Inserting Authorization fails with non-null columns set to null'
+        )
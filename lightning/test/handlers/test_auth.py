@@ -189,6 +189,45 @@ class TestAuthOneHandler(TestHandler):
             result=error_format("Missing argument 'signed_request'"),
         )
 
+    @defer.inlineCallbacks
+    def test_delete_purges_data(self):
+        yield self.set_authorization(user_id='a1234', token='abcd')
+        other = self.authorization
+        yield self.set_authorization(user_id='b5678', token='efgh')
+        for authz in [self.authorization, other]:
+            yield self.app.db.write_value(
+                uuid=authz.uuid, timestamp=1, method='foo', data=1,
+            )
+            yield self.app.db.write_granular_data([
+                dict(item_id=1, actor_id='x', timestamp=10),
+            ], authorization=authz, method='comment')
+            yield self.app.db.update_stream_cache([
+                {'item_id': 'status:1', 'timestamp': 10, 'data': {'id': 1}},
+            ], authz)
+
+        # Without a queue, the data is purged once the response is sent.
+        purged = defer.Deferred()
+        purge_user_data = self.app.db.purge_user_data
+        def purge(*args, **kwargs):
+            return purge_user_data(*args, **kwargs).addCallback(
+                lambda rv: purged.callback(rv) or rv
+            )
+        self.patch(self.app.db, 'purge_user_data', purge)
+
+        yield self.delete_and_verify(
+            path='/auth/' + self.uuid,
+            response_code=200,
+            result={'success': "Revocation successful"},
+        )
+        rv = yield purged
+        self.assertEqual(rv, {'UserData': 1, 'GranularData': 1, 'StreamCache': 1})
+
+        for table in self.app.db.PURGE_TABLES:
+            rows = yield self.app.db.raw_db.runQuery(
+                'SELECT uuid, COUNT(*) FROM [%s] GROUP BY uuid' % table,
+            )
+            self.assertEqual([row[0].strip() for row in rows], [other.uuid])
+
     def test_delete_not_found(self):
         # Confirm that attempting to delete
         return self.delete_and_verify(
@@ -1,10 +1,16 @@
 from __future__ import absolute_import
 
 from .base import TestHandler
+from ..base import FakeAuthz
 
+from lightning.handlers.stream import StreamHandler
 from lightning.service.loopback import LoopbackWeb, Loopback2Web
 from lightning.error import error_format
 from twisted.internet import defer
+from twisted.trial import unittest
+from twisted.web.test.test_web import DummyRequest
+
+import json
 
 
 class TestStreamHandler(TestHandler):
@@ -417,3 +423,77 @@ class TestStreamHandler(TestHandler):
                 },
             ]},
         )
+
+
+class FakeCachedService(object):
+    "Answers get_feed() from 'items' ((timestamp, id) pairs) like the stream cache."
+    def __init__(self, items):
+        self.items = sorted(items, reverse=True)
+
+    def get_feed(self, cursor=None, forward=False, num=20, **kwargs):
+        if cursor and forward:
+            items = [item for item in self.items if item > cursor][-num:]
+        elif cursor:
+            items = [item for item in self.items if item < cursor][:num]
+        else:
+            items = self.items[:num]
+        return defer.succeed([
+            {'metadata': {'timestamp': timestamp}, 'id': row_id, '_cursor': (timestamp, row_id)}
+            for timestamp, row_id in items
+        ])
+
+
+class TestStreamCursor(unittest.TestCase):
+    def setUp(self):
+        self.services = {
+            'one': FakeCachedService([(100, 1), (100, 3), (200, 5), (300, 7)]),
+            'two': FakeCachedService([(100, 2), (150, 4), (250, 6), (300, 8)]),
+        }
+        self.handler = StreamHandler(None)
+        self.handler.get_authorizations = lambda request: defer.succeed(
+            [FakeAuthz(service_name='one'), FakeAuthz(service_name='two')]
+        )
+        self.handler.get_service = lambda name, request: self.services[name]
+
+    def get(self, **args):
+        request = DummyRequest([])
+        request._disconnected = False
+        request.args = dict((key, [str(value)]) for key, value in args.items())
+        self.handler.show_stream(request)
+        return json.loads(''.join(request.written))
+
+    def test_forward(self):
+        # Two pages forward from the oldest item, each the 'num' items
+        # nearest the cursor, newest first.
+        rv = self.get(cursor='100:1', forward=1, num=3)
+        self.assertEqual([item['id'] for item in rv['data']], [4, 3, 2])
+        self.assertEqual(rv['cursor'], '150:4')
+        rv = self.get(cursor=rv['cursor'], forward=1, num=3)
+        self.assertEqual([item['id'] for item in rv['data']], [7, 6, 5])
+        self.assertEqual(rv['cursor'], '300:7')
+
+        # The last page, and then nothing newer yet.
+        rv = self.get(cursor=rv['cursor'], forward=1, num=3)
+        self.assertEqual([item['id'] for item in rv['data']], [8])
+        self.assertEqual(rv['cursor'], '300:8')
+        rv = self.get(cursor=rv['cursor'], forward=1, num=3)
+        self.assertEqual(rv, {'data': [], 'cursor': '300:8'})
+
+    def test_back(self):
+        rv = self.get(cursor='', num=3)
+        self.assertEqual([item['id'] for item in rv['data']], [8, 7, 6])
+        self.assertEqual(rv['cursor'], '250:6')
+        rv = self.get(cursor=rv['cursor'], num=3)
+        self.assertEqual([item['id'] for item in rv['data']], [5, 4, 3])
+        rv = self.get(cursor=rv['cursor'], num=3)
+        self.assertEqual([item['id'] for item in rv['data']], [2, 1])
+        self.assertEqual(rv['cursor'], None)
+
+    def test_uncached_items(self):
+        # An item without a cursor means there's no cursor for the page.
+        self.services['two'].get_feed = lambda **kwargs: defer.succeed(
+            [{'metadata': {'timestamp': 400}}]
+        )
+        rv = self.get(cursor='', num=3)
+        self.assertEqual(len(rv['data']), 3)
+        self.assertEqual(rv['cursor'], None)
@@ -3,6 +3,7 @@ from __future__ import absolute_import
 from .base import TestHandler
 from twisted.internet import defer
 import json
+import time
 from lightning.error import error_format
 
 
@@ -746,6 +747,76 @@ class TestApplyViewHandler(TestHandler):
             }
         )
 
+    @defer.inlineCallbacks
+    def test_get_view_plan_cache(self):
+        yield self.post_and_verify(
+            path='/view',
+            args=json.dumps(dict(
+                name='foo',
+                definition=[{'service': 'loopback', 'method': 'num_foo'}],
+            )),
+            response_code=200,
+            result={"success": "View 'foo' created"},
+        )
+        yield self.set_authorization(
+            user_id='1234', token='some token',
+        )
+        yield self.write_value(method='num_foo', data='30')
+        yield self.write_value(method='random', data='40')
+
+        # The second invocation reuses the plan built by the first.
+        self.app.view_plans.clear()
+        hits = self.app.view_plans.hits
+        for i in range(2):
+            yield self.get_and_verify(
+                path='/view/foo/invoke',
+                args=dict(guid=self.uuid),
+                response_code=200,
+                result={'result': [
+                    {'service': 'loopback', 'method': 'num_foo', 'num': 30},
+                ]},
+            )
+        self.assertEqual(self.app.view_plans.hits - hits, 1)
+
+        # Redefining the view replaces the plan.
+        yield self.delete_and_verify(
+            path='/view/foo',
+            response_code=200,
+            result={'definition': [{'service': 'loopback', 'method': 'num_foo'}]},
+        )
+        yield self.post_and_verify(
+            path='/view',
+            args=json.dumps(dict(
+                name='foo',
+                definition=[{'service': 'loopback', 'method': 'random'}],
+            )),
+            response_code=200,
+            result={"success": "View 'foo' created"},
+        )
+        yield self.get_and_verify(
+            path='/view/foo/invoke',
+            args=dict(guid=self.uuid),
+            response_code=200,
+            result={'result': [
+                {'service': 'loopback', 'method': 'random', 'num': 40},
+            ]},
+        )
+
+        # Plans expire, and are built again from the definition.
+        plans = self.app.view_plans
+        now = time.time() + plans.ttl
+        self.patch(plans, 'clock', lambda: now)
+        misses = plans.misses
+        yield self.get_and_verify(
+            path='/view/foo/invoke',
+            args=dict(guid=self.uuid),
+            response_code=200,
+            result={'result': [
+                {'service': 'loopback', 'method': 'random', 'num': 40},
+            ]},
+        )
+        self.assertEqual(plans.misses - misses, 1)
+
     @defer.inlineCallbacks
     def test_get_loopback_view_with_error(self):
         # Create a view
@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lightning.service.base import Service, ValueMemo
+
+
+class TestValueMemo(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_read_once(self):
+        memo = ValueMemo()
+        reads = []
+        pending = defer.Deferred()
+
+        def fetch():
+            reads.append(1)
+            return pending
+
+        # Overlapping reads share one fetch.
+        first = memo.read('abcd  ', 'profile', fetch)
+        second = memo.read('abcd', 'profile', fetch)
+        pending.callback(['{"name": "joe"}'])
+        rv = yield defer.gatherResults([first, second])
+        self.assertEqual(rv, [['{"name": "joe"}'], ['{"name": "joe"}']])
+
+        rv = yield memo.read('abcd', 'profile', fetch)
+        self.assertEqual(rv, ['{"name": "joe"}'])
+        self.assertEqual(len(reads), 1)
+
+    @defer.inlineCallbacks
+    def test_failures_are_not_remembered(self):
+        memo = ValueMemo()
+        yield self.assertFailure(
+            memo.read('abcd', 'profile', lambda: defer.fail(ValueError('down'))),
+            ValueError,
+        )
+        rv = yield memo.read('abcd', 'profile', lambda: ['5'])
+        self.assertEqual(rv, ['5'])
+
+    @defer.inlineCallbacks
+    def test_update_and_loads(self):
+        memo = ValueMemo()
+        memo.update('abcd', {'num': [5]})
+        rv = yield memo.read('abcd', 'num', lambda: self.fail('Not prefetched'))
+        self.assertEqual(rv, [5])
+
+        profile = memo.loads('abcd', 'profile', '{"name": "joe"}')
+        profile['service'] = 'loopback'
+        self.assertEqual(
+            memo.loads('abcd', 'profile', 'not decoded again'), {'name': 'joe'},
+        )
+
+
+class PagedService(Service):
+    "Serves 'items' in pages, answering each request when told to."
+    name = 'paged'
+
+    def __init__(self, items):
+        super(PagedService, self).__init__(datastore=None)
+        self.items = items
+        self.requested = []
+        self.waiting = {}
+
+    def request(self, **kwargs):
+        offset, limit = kwargs['args']['offset'], kwargs['args']['limit']
+        self.requested.append(offset)
+        self.waiting[offset] = (defer.Deferred(), self.items[offset:offset + limit])
+        return self.waiting[offset][0]
+
+    def answer(self, offset):
+        d, page = self.waiting.pop(offset)
+        d.callback(page)
+
+
+class TestRequestWithPrefetch(unittest.TestCase):
+    def page(self, service, callback, prefetch=3):
+        return service.request_with_paging(
+            'items', callback, prefetch=prefetch, data_name=None,
+            limit_field='limit', offset_field='offset',
+            limit=2, starting_offset=0, offset_increase=2,
+        )
+
+    def test_in_order(self):
+        service = PagedService(range(7))
+        pages = []
+        d = self.page(service, pages.append)
+        self.assertEqual(service.requested, [0, 2, 4])
+
+        # Pages that come back early wait for those before them.
+        service.answer(4)
+        service.answer(2)
+        self.assertEqual(pages, [])
+        service.answer(0)
+        self.assertEqual(pages, [[0, 1], [2, 3], [4, 5]])
+        self.assertEqual(service.requested, [0, 2, 4, 6, 8, 10])
+
+        # The short page is the last: the rest are waited for, then dropped.
+        service.answer(6)
+        self.assertEqual(pages, [[0, 1], [2, 3], [4, 5], [6]])
+        self.assertFalse(d.called)
+        service.answer(8)
+        service.answer(10)
+        self.assertEqual(pages, [[0, 1], [2, 3], [4, 5], [6]])
+        self.assertEqual(service.requested, [0, 2, 4, 6, 8, 10])
+        return d
+
+    def test_stopback(self):
+        service = PagedService(range(20))
+        pages = []
+        d = service.request_with_paging(
+            'items', pages.append, prefetch=2, data_name=None,
+            stopback=lambda: len(pages) == 2,
+            limit_field='limit', offset_field='offset',
+            limit=2, starting_offset=0, offset_increase=2,
+        )
+        service.answer(0)
+        service.answer(2)
+        service.answer(4)
+        self.assertEqual(pages, [[0, 1], [2, 3]])
+        self.assertEqual(service.requested, [0, 2, 4])
+        return d
@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lightning.datastore import connect
+from lightning.service.compaction import CompactionDaemon
+from ..base import FakeRedis
+
+
+class FakeResQ(object):
+    "Records the jobs enqueued."
+    def __init__(self):
+        self.redis = FakeRedis()
+        self.enqueued = []
+
+    def enqueue_at(self, when, klass, *args):
+        self.enqueued.append(args)
+        return defer.succeed(None)
+
+
+class TestCompactionDaemon(unittest.TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.db = yield connect('sqlite::memory:')
+        self.resq = FakeResQ()
+        # The worker sets these on the job classes.
+        CompactionDaemon.datastore = self.db
+        CompactionDaemon.resq = self.resq
+        self.config = {'user_data_rollup': [[1, 'day']], 'user_data_rollup_batch_size': 2}
+
+    def tearDown(self):
+        del CompactionDaemon.datastore, CompactionDaemon.resq
+        self.db.disconnect()
+
+    @defer.inlineCallbacks
+    def test_compact(self):
+        for user_id in ['a', 'b', 'c']:
+            authz = yield self.db.set_oauth_token(
+                client_name='testing', service_name='loopback',
+                user_id=user_id, token='abcd',
+            )
+            for timestamp in [100, 200]:
+                yield self.db.write_value(
+                    uuid=authz.uuid, timestamp=timestamp, method='foo', data=timestamp,
+                )
+
+        # The authorizations are read two at a time; all are compacted.
+        rv = yield CompactionDaemon.compact(self.config, now=10 * 86400)
+        self.assertEqual(rv, 3)
+
+    @defer.inlineCallbacks
+    def test_cycle(self):
+        yield CompactionDaemon.start(self.config, self.resq)
+        yield CompactionDaemon.start(self.config, self.resq)
+        first, second = [args[1] for args in self.resq.enqueued]
+        self.assertNotEqual(first, second)
+
+        # Only the last cycle started goes on.
+        yield CompactionDaemon.perform(self.config, first)
+        self.assertEqual(len(self.resq.enqueued), 2)
+        yield CompactionDaemon.perform(self.config, second)
+        self.assertEqual(self.resq.enqueued[2], (self.config, second))
@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from lightning.service.concurrency import FairLimiter, max_simultaneous_calls
+from ..base import FakeAuthz
+
+
+class TestFairLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.limiter = FairLimiter(2, self.clock)
+        self.started = []
+        self.running = {}
+
+    def call(self, key, name):
+        def start():
+            self.started.append(name)
+            self.running[name] = defer.Deferred()
+            return self.running[name]
+        return self.limiter.run(key, start)
+
+    def test_limit(self):
+        done = [self.call(None, name) for name in 'abc']
+        self.assertEqual(self.started, ['a', 'b'])
+        stats = self.limiter.stats()
+        self.assertEqual((stats['active'], stats['waiting']), (2, 1))
+
+        # The next starts the moment a slot is free, not on a timer.
+        self.clock.advance(0.25)
+        self.running['a'].callback(None)
+        self.assertEqual(self.started, ['a', 'b', 'c'])
+        self.running['b'].errback(ValueError('Failed'))
+        self.assertFailure(done[1], ValueError)
+        self.running['c'].callback(None)
+
+        stats = self.limiter.stats()
+        self.assertEqual((stats['active'], stats['waiting'], stats['calls'], stats['delayed']), (0, 0, 3, 1))
+        self.assertEqual((stats['max_wait'], stats['max_waiting']), (0.25, 1))
+        return defer.gatherResults(done)
+
+    def test_fairness(self):
+        # One uuid's backlog doesn't hold up another's calls.
+        for name in ['heavy1', 'heavy2', 'heavy3', 'heavy4', 'heavy5']:
+            self.call('heavy', name)
+        self.call('light', 'light1')
+        self.call('light', 'light2')
+        for name in ['heavy1', 'heavy2', 'heavy3', 'light1', 'heavy4']:
+            self.running[name].callback(None)
+        self.assertEqual(self.started, [
+            'heavy1', 'heavy2', 'heavy3', 'light1', 'heavy4', 'light2', 'heavy5',
+        ])
+
+
+class TestMaxSimultaneousCalls(unittest.TestCase):
+    def test_decorator(self):
+        running = []
+
+        @max_simultaneous_calls(1)
+        def request(path, **kwargs):
+            running.append(defer.Deferred())
+            return running[-1]
+
+        one = request('a', authorization=FakeAuthz('one'))
+        two = request('b', authorization=FakeAuthz('two'))
+        self.assertEqual(len(running), 1)
+        self.assertEqual(request.limiter.stats()['waiting'], 1)
+        running[0].callback('a')
+        running[1].callback('b')
+        return defer.gatherResults([one, two]).addCallback(self.assertEqual, ['a', 'b'])
@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+from twisted.trial import unittest
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
+
+from lightning.service.http_pool import HostConnectionPool
+
+
+class FakeTransport(object):
+    def loseConnection(self):
+        pass
+
+
+class FakeProtocol(object):
+    state = 'QUIESCENT'
+    transport = FakeTransport()
+
+
+class FakeEndpoint(object):
+    def connect(self, factory):
+        return defer.succeed(FakeProtocol())
+
+
+class FakeResponse(object):
+    def __init__(self, code, headers, body):
+        self.code = code
+        self.headers = Headers(headers)
+        self.body = body
+
+    def deliverBody(self, protocol):
+        protocol.dataReceived(self.body)
+        protocol.connectionLost(Failure(ResponseDone()))
+
+
+class FakeAgent(object):
+    "Answers every request from 'responses', and remembers the requests."
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        self.requests.append((method, uri))
+        return defer.succeed(self.responses.pop(0))
+
+
+class TestHostConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = HostConnectionPool(self.clock, max_per_host=2, idle_timeout=10)
+
+    @defer.inlineCallbacks
+    def test_reuse(self):
+        key = ('https', 'api.github.com', 443)
+        connection = yield self.pool.getConnection(key, FakeEndpoint())
+        self.pool._putConnection(key, connection)
+        self.assertEqual(self.pool.stats()['https://api.github.com:443']['idle'], 1)
+
+        # The idle connection is used again, rather than a new one opened.
+        yield self.pool.getConnection(key, FakeEndpoint())
+        stats = self.pool.stats()['https://api.github.com:443']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['idle'], 0)
+
+        # Idle connections are closed after idle_timeout.
+        connection = yield self.pool.getConnection(key, FakeEndpoint())
+        self.pool._putConnection(key, connection)
+        self.clock.advance(10)
+        self.assertEqual(self.pool.stats()['https://api.github.com:443']['idle'], 0)
+
+    def test_limit(self):
+        host = 'https://graph.facebook.com:443'
+        running = [defer.Deferred() for i in range(3)]
+        done = [self.pool.limit(host, lambda d=d: d) for d in running]
+        stats = self.pool.stats()[host]
+        self.assertEqual((stats['active'], stats['waiting']), (2, 1))
+
+        # The third starts as soon as one of the first two is done.
+        running[0].callback(None)
+        stats = self.pool.stats()[host]
+        self.assertEqual((stats['active'], stats['waiting']), (2, 0))
+
+        running[1].callback(None)
+        running[2].errback(ValueError('Failed'))
+        self.assertFailure(done[2], ValueError)
+        stats = self.pool.stats()[host]
+        self.assertEqual((stats['active'], stats['waiting'], stats['errors']), (0, 0, 1))
+        return defer.gatherResults(done)
+
+    @defer.inlineCallbacks
+    def test_fetch(self):
+        # Requests, redirects included, are made with the pool's Agent, not
+        # the one cyclone.httpclient.fetch() uses.
+        self.pool.agent = FakeAgent([
+            FakeResponse(302, {'Location': ['https://api.github.com/b']}, ''),
+            FakeResponse(200, {'ETag': ['"v1"']}, '{"a": 1}'),
+        ])
+        response = yield self.pool.fetch(u'https://api.github.com/a', followRedirect=1)
+        self.assertEqual(self.pool.agent.requests, [
+            ('GET', 'https://api.github.com/a'),
+            ('GET', 'https://api.github.com/b'),
+        ])
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, '{"a": 1}')
+        self.assertEqual(response.headers['ETag'], ['"v1"'])
+        self.assertEqual(response.request.url, 'https://api.github.com/a')
+        self.assertEqual(self.pool.stats()['https://api.github.com:443']['active'], 0)
@@ -0,0 +1,36 @@
+from __future__ import absolute_import
+
+from twisted.trial import unittest
+
+from lightning.error import ApiMethodError
+from lightning.service.base import Service
+from lightning.service.json_stream import count_array, iter_array
+
+
+class TestJsonStream(unittest.TestCase):
+    def test_iter_array(self):
+        text = ' {"paging": {"next": "x"}, "data": [{"id": 1}, [2, 3], "4" ] } '
+        self.assertEqual(list(iter_array(text, 'data')), [{'id': 1}, [2, 3], '4'])
+        self.assertEqual(list(iter_array('[1, 2]')), [1, 2])
+        self.assertEqual(list(iter_array('{"data": []}', 'data')), [])
+
+    def test_count_array(self):
+        self.assertEqual(count_array('{"ids": [1, 2, 3], "next_cursor": 0}', 'ids'), 3)
+        # Only the top-level key counts.
+        self.assertEqual(count_array('{"a": {"ids": [1]}, "b": 1}', 'ids'), 0)
+        self.assertEqual(count_array('{}', 'ids'), 0)
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, count_array, '{"ids": [1, 2', 'ids')
+        self.assertRaises(ValueError, count_array, '{"ids": [1 2]}', 'ids')
+        self.assertRaises(ValueError, count_array, '<html>', 'ids')
+
+
+class TestParseResponse(unittest.TestCase):
+    def setUp(self):
+        self.service = Service(datastore=None)
+
+    def test_with_sum(self):
+        rv = self.service.parse_response('{"data": [{"a": 1}, {"a": 2}]}', with_sum='data')
+        self.assertEqual(rv, {'num': 2})
+        self.assertRaises(ApiMethodError, self.service.parse_response, '{"data": [', with_sum='data')
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+
+from cyclone.redis import RedisFactory
+from twisted.internet import defer, task
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial import unittest
+
+from lightning.service import rate_limit
+from lightning.service.rate_limit import (
+    MemoryRateLimiter, RedisRateLimiter, request_rate,
+)
+from ..base import FakeAuthz
+
+
+class FakeService(object):
+    name = 'fake'
+    environment = 'local'
+    app_info = {'local': {'app_id': 'key'}}
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.called = []
+
+    @request_rate(1, every='second', per_app=2)
+    def request(self, path, **kwargs):
+        self.called.append((path, self.clock.seconds()))
+        return defer.succeed(path)
+
+
+class TestRequestRate(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        rate_limit.LIMITER = MemoryRateLimiter(self.clock)
+        self.service = FakeService(self.clock)
+
+    def tearDown(self):
+        rate_limit.LIMITER = None
+
+    def test_per_uuid(self):
+        one, two = FakeAuthz('one'), FakeAuthz('two')
+        done = [
+            self.service.request('a', authorization=one),
+            self.service.request('b', authorization=one),
+            self.service.request('c', authorization=one),
+        ]
+        # The first goes at once, the rest a second apart, in order.
+        self.assertEqual(self.service.called, [('a', 0)])
+        self.clock.advance(1)
+        self.assertEqual(self.service.called, [('a', 0), ('b', 1)])
+        self.clock.advance(1)
+        self.assertEqual(self.service.called, [('a', 0), ('b', 1), ('c', 2)])
+
+        # Another uuid has its own bucket, but shares the app's.
+        self.clock.advance(1)
+        done.append(self.service.request('d', authorization=two))
+        done.append(self.service.request('e', authorization=FakeAuthz('three')))
+        self.assertEqual(self.service.called[3:], [('d', 3)])
+        self.clock.advance(0.5)
+        self.assertEqual(self.service.called[4:], [('e', 3.5)])
+
+        stats = rate_limit.get_limiter().stats()
+        self.assertEqual((stats['calls'], stats['delayed']), (5, 3))
+        return defer.gatherResults(done)
+
+    def connect_redis(self):
+        "A cyclone Redis connection pool talking to a StringTransport."
+        factory = RedisFactory(None, None, 1, isLazy=True)
+        protocol = factory.buildProtocol(None)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        return factory.handler, protocol, transport
+
+    @defer.inlineCallbacks
+    def test_redis(self):
+        redis, protocol, transport = self.connect_redis()
+        limiter = rate_limit.LIMITER = RedisRateLimiter(redis, self.clock)
+        d = self.service.request('a', authorization=FakeAuthz('one'))
+
+        # Both buckets are taken from in one EVAL.
+        sent = transport.value()
+        self.assertTrue(sent.startswith('*7\r\n$4\r\nEVAL\r\n'))
+        self.assertIn('lightning:rate:fake:uuid:one', sent)
+        self.assertIn('lightning:rate:fake:app:key', sent)
+        self.assertIn('1.0 1.0 0.0', sent)
+        self.assertIn('2.0 1.0 0.0', sent)
+
+        protocol.dataReceived('$3\r\n0.5\r\n')
+        self.assertEqual(self.service.called, [])
+        self.clock.advance(0.5)
+        rv = yield d
+        self.assertEqual(rv, 'a')
+        self.assertEqual(limiter.stats()['delayed'], 1)
+        self.assertEqual(limiter.stats()['errors'], 0)
+
+    @defer.inlineCallbacks
+    def test_redis_errors(self):
+        # If Redis is down, the buckets in this process are used.
+        redis, protocol, transport = self.connect_redis()
+        protocol.connectionLost(None)
+        limiter = rate_limit.LIMITER = RedisRateLimiter(redis, self.clock)
+        rv = yield self.service.request('a', authorization=FakeAuthz('one'))
+        self.assertEqual(rv, 'a')
+        self.assertEqual(limiter.stats()['errors'], 1)
@@ -0,0 +1,149 @@
+from __future__ import absolute_import
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lightning.service import response_cache
+from lightning.service.base import Service
+from lightning.service.response_cache import MemoryResponseCache, RedisResponseCache
+from ..base import FakeAuthz, FakeRedis
+
+
+class FakeResponse(object):
+    def __init__(self, code, body='', headers=None):
+        self.code = code
+        self.body = body
+        self.headers = headers or {}
+
+
+class FakeService(Service):
+    "Answers from 'responses', and remembers the headers it was sent."
+    name = 'fake'
+
+    def __init__(self, responses):
+        super(FakeService, self).__init__(datastore=None)
+        self.responses = responses
+        self.sent = []
+
+    def actually_request(self, *args, **kwargs):
+        self.sent.append(kwargs['headers'])
+        return defer.succeed(self.responses.pop(0))
+
+
+class TestMemoryResponseCache(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_eviction(self):
+        now = [0]
+        cache = MemoryResponseCache(max_bytes=10, max_entry_bytes=8, ttl=60, clock=lambda: now[0])
+        yield cache.set('a', {'etag': 'x', 'last_modified': None, 'body': '1234'})
+        yield cache.set('b', {'etag': 'y', 'last_modified': None, 'body': '1234'})
+        self.assertEqual(cache.stats()['bytes'], 10)
+
+        # The least recently used entry goes when there's no room.
+        yield cache.get('a')
+        yield cache.set('c', {'etag': 'z', 'last_modified': None, 'body': '12'})
+        rv = yield cache.get('b')
+        self.assertEqual(rv, None)
+        rv = yield cache.get('a')
+        self.assertEqual(rv['body'], '1234')
+
+        # Entries too big to keep, and expired entries, are misses.
+        yield cache.set('d', {'etag': 'w', 'last_modified': None, 'body': '123456789'})
+        rv = yield cache.get('d')
+        self.assertEqual(rv, None)
+        now[0] = 61
+        rv = yield cache.get('a')
+        self.assertEqual(rv, None)
+        self.assertEqual(cache.stats()['size'], 1)
+
+
+class TestConditionalRequests(unittest.TestCase):
+    def setUp(self):
+        self.cache = response_cache.CACHE = MemoryResponseCache()
+
+    def tearDown(self):
+        response_cache.CACHE = None
+
+    @defer.inlineCallbacks
+    def test_not_modified(self):
+        service = FakeService([
+            FakeResponse(200, '{"a": 1}', {'Etag': ['"v1"'], 'Last-Modified': ['Mon']}),
+            FakeResponse(304),
+        ])
+        url = 'https://api.example.com/user?b=2&access_token=one&a=1'
+        rv = yield service.request(url=url, authorization=FakeAuthz())
+        self.assertEqual(rv, {'a': 1})
+        self.assertEqual(service.sent[0], {})
+
+        # The same URL, whatever the token and order of its arguments, is
+        # revalidated, and a 304 gets the body from the cache.
+        url = 'https://api.example.com/user?a=1&b=2&access_token=two'
+        rv = yield service.request(url=url, authorization=FakeAuthz())
+        self.assertEqual(rv, {'a': 1})
+        self.assertEqual(service.sent[1], {
+            'If-None-Match': ['"v1"'],
+            'If-Modified-Since': ['Mon'],
+        })
+
+    @defer.inlineCallbacks
+    def test_parsed_once(self):
+        service = FakeService([
+            FakeResponse(200, '{"a": {"b": 1}}', {'ETag': ['"v1"']}),
+            FakeResponse(304),
+            FakeResponse(304),
+        ])
+        parsed = []
+        parse_response = service.parse_response
+        def count_parses(response, **kwargs):
+            parsed.append(response)
+            return parse_response(response, **kwargs)
+        service.parse_response = count_parses
+
+        # A 304 is answered with what was parsed the first time, and what
+        # callers do to it doesn't change the cache.
+        url = 'https://api.example.com/user'
+        rv = yield service.request(url=url, authorization=FakeAuthz())
+        rv['a']['b'] = 2
+        for i in range(2):
+            rv = yield service.request(url=url, authorization=FakeAuthz())
+            self.assertEqual(rv, {'a': {'b': 1}})
+            rv['a']['b'] = 2
+        self.assertEqual(len(parsed), 1)
+
+    @defer.inlineCallbacks
+    def test_uncached(self):
+        service = FakeService([
+            FakeResponse(200, '{"a": 1}'),
+            FakeResponse(200, '{"a": 2}', {'ETag': ['"v1"']}),
+            FakeResponse(200, '{"a": 3}'),
+        ])
+        url = 'https://api.example.com/user'
+        # Responses without an ETag or Last-Modified aren't kept, nor are
+        # those of requests made without an authorization.
+        yield service.request(url=url, authorization=FakeAuthz())
+        yield service.request(url=url)
+        rv = yield service.request(url=url, authorization=FakeAuthz())
+        self.assertEqual(rv, {'a': 3})
+        self.assertEqual(service.sent, [{}, {}, {}])
+
+
+class TestRedisResponseCache(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_body_kept_exactly(self):
+        redis = FakeRedis()
+        cache = RedisResponseCache(redis, ttl=60)
+        # Not UTF-8: a gzip header and a Latin-1 'e acute'.
+        body = '\x1f\x8b\x08caf\xe9'
+        yield cache.set('a', {'etag': '"v1"', 'last_modified': None, 'body': body})
+        self.assertEqual(redis.expires, {'lightning:response:a': 60})
+
+        rv = yield cache.get('a')
+        self.assertEqual(rv, {'etag': '"v1"', 'last_modified': None, 'body': body})
+        self.assertIsInstance(rv['body'], str)
+        self.assertIsInstance(rv['etag'], str)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 0})
+
+        # The parsed body is left out.
+        yield cache.set('b', {'etag': '"v1"', 'last_modified': None, 'body': '{}', 'parsed': {}})
+        rv = yield cache.get('b')
+        self.assertEqual(rv, {'etag': '"v1"', 'last_modified': None, 'body': '{}'})
@@ -0,0 +1,42 @@
+from __future__ import absolute_import
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from lightning import stats
+from lightning.service import http_pool
+
+import logging
+
+
+class FakeDatastore(object):
+    def pool_stats(self):
+        return {'in_use': 1}
+
+
+class FakePool(object):
+    def stats(self):
+        return {'api.example.com:443': {'requests': 2}}
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.logged = []
+        self.patch(logging, 'info', self.logged.append)
+        self.patch(http_pool, 'POOL', FakePool())
+
+    def test_start(self):
+        clock = task.Clock()
+        loop = stats.start({'stats_interval': 60}, FakeDatastore(), clock=clock)
+        self.addCleanup(loop.stop)
+        self.assertEqual(self.logged, [])
+        clock.advance(60)
+        self.assertEqual(self.logged, [
+            "Connection pool: {'in_use': 1}",
+            "HTTP pool: {'api.example.com:443': {'requests': 2}}",
+        ])
+        clock.advance(60)
+        self.assertEqual(len(self.logged), 4)
+
+    def test_disabled(self):
+        self.assertEqual(stats.start({'stats_interval': 0}, FakeDatastore()), None)